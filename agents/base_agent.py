@@ -2,9 +2,19 @@ import zmq.asyncio
 import asyncio
 import logging
 import json
+import os
+import threading
+import time
 from enum import Enum
-from datetime import datetime
-from agents.mcp_message import MCPMessage, MCPPerformatives
+from agents.mcp_message import MCPMessage, MCPPerformatives, MonotonicIdGenerator, uuid_id
+from agents.catalog import json_default
+from agents.compression import SUPPORTED_ENCODINGS, negotiate_encoding, compress_content, decompress_content
+from agents.capture import TrafficCapture, INBOUND, OUTBOUND
+from agents.profiler import SamplingProfiler
+from agents.history import ConversationHistory
+from agents.shm_transport import SharedArena, ArenaReader, SHM_ENCODING
+from agents.watchdog import watch_loop, unwatch_loop
+from config import MESSAGE_ID_MODE, COMPRESSION, STREAMING, CAPTURE, PROFILING, HISTORY, SHARED_MEMORY, WATCHDOG
 
 logger = logging.getLogger(__name__)
 
@@ -14,6 +24,9 @@ class ConnectionState(Enum):
     CONNECTED = "connected"
 
 class BaseAgent:
+    # Provider role announced to the planner in the handshake (None for agents that answer no CFPs)
+    role = None
+
     def __init__(self, agent_id, endpoint, is_planner=False):
         """Initialize the base agent with ZMQ context and socket"""
         self.agent_id = agent_id
@@ -28,6 +41,30 @@ class BaseAgent:
         self.running = False
         self.connection_state = ConnectionState.DISCONNECTED
         self.connected_agents = set()
+        # Content encodings each peer advertised during the handshake
+        self.peer_encodings = {}
+        # Identity envelopes for peers reached through a front router (planner shards)
+        self.peer_routes = {}
+        # Shared memory transport: our arena, the arenas of peers we read, and peers that read ours
+        self.arena = None
+        self.arena_reader = ArenaReader()
+        self.shm_readable = {}  # Peer -> name of its arena we attached
+        self.shm_peers = set()  # Peers that attached our arena
+        # Traffic capture for replay (see start_capture)
+        self.capture = None
+        # Sampling profile in progress, started by a "profile" QUERY
+        self.profiler = None
+        # Event loop lag and slow handler monitor, shared by the agents on the same loop
+        self.watchdog = None
+        # Recent messages by conversation_id, for debugging and auditing
+        self.history = ConversationHistory(
+            max_messages=HISTORY["max_messages"],
+            max_bytes=HISTORY["max_bytes"],
+            max_content=HISTORY["max_content"]
+        ) if HISTORY["enabled"] else None
+        
+        # Conversation id generator for messages originated by this agent
+        self.id_factory = MonotonicIdGenerator(agent_id) if MESSAGE_ID_MODE == "monotonic" else uuid_id
         
         # Set identity for non-planner agents
         if not is_planner:
@@ -46,7 +83,22 @@ class BaseAgent:
                 self.socket.connect(self.endpoint)
             
             self.running = True
-            self.connection_state = ConnectionState.CONNECTING
+            if CAPTURE["enabled"]:
+                self.start_capture()
+            if WATCHDOG["enabled"]:
+                self.watchdog = watch_loop(
+                    self.agent_id,
+                    interval=WATCHDOG["interval"],
+                    lag_threshold=WATCHDOG["lag_threshold"],
+                    handler_budget=WATCHDOG["handler_budget"],
+                    report_interval=WATCHDOG["report_interval"],
+                    max_stack_depth=WATCHDOG["max_stack_depth"]
+                )
+            if SHARED_MEMORY["enabled"] and not self.is_planner:
+                # Offered to the planner in the handshake for large payloads we send it
+                self.arena = SharedArena(SHARED_MEMORY["arena_size"], lease=SHARED_MEMORY["lease"])
+            # The planner is ready as soon as it is bound; other agents wait for the handshake
+            self.connection_state = ConnectionState.CONNECTED if self.is_planner else ConnectionState.CONNECTING
             
             # Start message receiver
             asyncio.create_task(self._receive_messages())
@@ -54,7 +106,7 @@ class BaseAgent:
             
             # For non-planner agents, send connection request
             if not self.is_planner:
-                await self._send_connection_request()
+                await self.perform_handshake("planner")
             
         except Exception as e:
             logger.error(f"{self.agent_id} failed to start: {str(e)}")
@@ -66,56 +118,242 @@ class BaseAgent:
         logger.info(f"Stopping {self.agent_id} agent...")
         self.running = False
         self.connection_state = ConnectionState.DISCONNECTED
+        self.stop_capture()
+        if self.watchdog:
+            unwatch_loop(self.watchdog, self.agent_id)
+            self.watchdog = None
         self.socket.close()
         self.context.term()
+        self.arena_reader.close()
+        if self.arena:
+            self.arena.close()
+            self.arena = None
         logger.info(f"{self.agent_id} agent stopped")
 
-    async def _send_connection_request(self):
-        """Send connection request to planner"""
+    def start_capture(self, path=None):
+        """Record every frame this agent sends or receives (see replay.py)"""
+        if self.capture is None:
+            self.capture = TrafficCapture(
+                path or os.path.join(CAPTURE["directory"], f"{self.agent_id}.cap"),
+                buffer_size=CAPTURE["buffer_size"],
+                flush_interval=CAPTURE["flush_interval"],
+                max_bytes=CAPTURE["max_bytes"]
+            )
+
+    def stop_capture(self):
+        """Stop recording traffic and close the capture file"""
+        if self.capture is not None:
+            capture, self.capture = self.capture, None
+            capture.close()
+
+    async def handle_profile_request(self, message, content):
+        """
+        Start a time-boxed sampling profile of the event loop thread for a
+        QUERY of type "profile" ({"duration": seconds, "interval": seconds}).
+        The request is confirmed right away and answered with a RESPONSE
+        carrying the path of the collapsed-stack file once the profile is done.
+        """
+        if self.profiler is not None and self.profiler.running:
+            response = message.create_reply(
+                MCPPerformatives.DISCONFIRM,
+                json.dumps({"type": "profile", "status": "busy", "message": "A profile is already running"})
+            )
+            await self.send_message(response)
+            return
+        
+        try:
+            duration = min(float(content.get("duration", PROFILING["default_duration"])), PROFILING["max_duration"])
+            interval = max(float(content.get("interval", PROFILING["interval"])), PROFILING["min_interval"])
+        except (TypeError, ValueError):
+            response = message.create_reply(
+                MCPPerformatives.FAILURE,
+                json.dumps({"type": "profile", "status": "error", "message": "Invalid duration or interval"})
+            )
+            await self.send_message(response)
+            return
+        
+        # Only the file name is chosen here; requests can't write elsewhere
+        path = os.path.join(PROFILING["directory"], f"{self.agent_id}-{time.strftime('%Y%m%d-%H%M%S')}.folded")
+        loop = asyncio.get_running_loop()
+        
+        def on_done(profiler, error):
+            result = {"type": "profile", "status": "failed" if error else "completed",
+                      "path": profiler.path, "samples": profiler.samples}
+            if error:
+                result["message"] = str(error)
+            reply = message.create_reply(MCPPerformatives.RESPONSE, json.dumps(result))
+            try:
+                loop.call_soon_threadsafe(lambda: asyncio.ensure_future(self.send_message(reply)))
+            except RuntimeError:
+                pass  # The agent stopped while profiling
+        
+        self.profiler = SamplingProfiler(threading.get_ident(), path, duration, interval)
+        self.profiler.start(on_done)
+        logger.info(f"{self.agent_id} profiling for {duration}s into {path}")
+        response = message.create_reply(
+            MCPPerformatives.CONFIRM,
+            json.dumps({"type": "profile", "status": "started", "duration": duration, "path": path,
+                        "message": f"Profiling {self.agent_id} for {duration}s"})
+        )
+        await self.send_message(response)
+
+    async def handle_history_request(self, message, content):
+        """
+        Answer a QUERY of type "history" with the recorded timeline of
+        content["conversation_id"], or with the most recent conversation ids
+        and store statistics when no conversation is given.
+        """
+        if self.history is None:
+            result = {"type": "history", "status": "disabled"}
+        elif content.get("conversation_id"):
+            conversation_id = content["conversation_id"]
+            result = {
+                "type": "history",
+                "status": "ok" if conversation_id in self.history else "unknown",
+                "conversation_id": conversation_id,
+                "messages": self.history.timeline(conversation_id)
+            }
+        else:
+            result = {
+                "type": "history",
+                "status": "ok",
+                "recent": self.history.recent(content.get("limit", 20)),
+                **self.history.stats()
+            }
+        await self.send_message(message.create_reply(MCPPerformatives.RESPONSE, json.dumps(result)))
+
+    def _handshake_capabilities(self):
+        """Capabilities advertised to peers during the connection handshake"""
+        capabilities = {
+            "accept_encoding": list(SUPPORTED_ENCODINGS) if COMPRESSION["enabled"] else []
+        }
+        if self.arena:
+            capabilities["shm_arena"] = self.arena.name
+        if self.role:
+            capabilities["role"] = self.role
+            capabilities["capabilities"] = self.provider_capabilities()
+        return capabilities
+
+    def provider_capabilities(self):
+        """
+        Schema of what a provider offers, sent with its role: the CFP type it
+        answers, whether it streams proposals, answers batched CFPs and takes
+        bookings, and how the planner should pick an option for a plan
+        ("first" or "cheapest" by price_field).
+        """
+        return {
+            "options": f"{self.role}_options",
+            "streaming": STREAMING["enabled"],
+            "batch": False,
+            "booking": False,
+            "select": "first"
+        }
+
+    def record_peer_capabilities(self, peer_id, content):
+        """Remember what a peer advertised in its handshake"""
+        self.peer_encodings[peer_id] = frozenset(content.get("accept_encoding", ()))
+        if SHARED_MEMORY["enabled"] and content.get("shm_arena") and self.arena_reader.attach(content["shm_arena"]):
+            self.shm_readable[peer_id] = content["shm_arena"]
+        if content.get("shm_readable"):
+            logger.info(f"{self.agent_id} sends large payloads to {peer_id} through shared memory")
+            self.shm_peers.add(peer_id)
+
+    async def perform_handshake(self, peer_id):
+        """Send connection request to a peer (normally the planner)"""
         try:
             connection_msg = MCPMessage(
                 performative=MCPPerformatives.INFORM,
                 content=json.dumps({
                     "type": "connect",
                     "agent_id": self.agent_id,
-                    "status": "requesting_connection"
+                    "status": "requesting_connection",
+                    **self._handshake_capabilities()
                 }),
                 sender=self.agent_id,
-                receiver="planner"
+                receiver=peer_id,
+                id_factory=self.id_factory
             )
             await self.send_message(connection_msg)
-            logger.info(f"{self.agent_id} sent connection request to planner")
+            logger.info(f"{self.agent_id} sent connection request to {peer_id}")
         except Exception as e:
             logger.error(f"{self.agent_id} failed to send connection request: {str(e)}")
             self.connection_state = ConnectionState.DISCONNECTED
 
+    async def _encode_body(self, message):
+        """
+        Serialize a message into body frames; large content goes through our
+        shared memory arena to peers that read it, or is compressed for peers
+        that accept it
+        """
+        content = message.content
+        # Captures must stay replayable, so they never hold arena handles
+        if message.receiver in self.shm_peers and self.capture is None and isinstance(content, str) \
+                and len(content) >= SHARED_MEMORY["min_size"]:
+            handle = self.arena.put(content.encode())
+            if handle is not None:
+                envelope = message.to_dict()
+                envelope["content"] = ""
+                envelope["content_encoding"] = SHM_ENCODING
+                return [json.dumps(envelope).encode(), handle]
+            logger.debug(f"{self.agent_id} arena is full, sending to {message.receiver} over the socket")
+        
+        encoding = None
+        if COMPRESSION["enabled"] and isinstance(content, str) and len(content) >= COMPRESSION["min_size"]:
+            encoding = negotiate_encoding(self.peer_encodings.get(message.receiver, ()))
+        
+        if encoding:
+            # Compression of large payloads releases the GIL, so keep it off the event loop
+            payload = await asyncio.get_running_loop().run_in_executor(
+                None, compress_content, content, encoding, COMPRESSION["level"]
+            )
+            if len(payload) < len(content):
+                envelope = message.to_dict()
+                envelope["content"] = ""
+                envelope["content_encoding"] = encoding
+                return [json.dumps(envelope).encode(), payload]
+        
+        return [message.to_json().encode()]
+
+    def _decode_body(self, body, peer=None):
+        """Rebuild a message from body frames, decompressing (or reading from shared memory) content if needed"""
+        message = MCPMessage.from_json(body[0].decode())
+        if message.content_encoding == SHM_ENCODING:
+            # Only from the peer's own arena, offered in its handshake (peer is the transport identity)
+            arena = self.shm_readable.get(peer)
+            if arena is None:
+                raise ValueError(f"Shared memory content from {peer}, which offered no arena")
+            message.content = self.arena_reader.read(body[1], arena)
+            message.content_encoding = None
+        elif message.content_encoding:
+            message.content = decompress_content(body[1], message.content_encoding)
+            message.content_encoding = None
+        return message
+
     async def send_message(self, message):
         """Send a message to another agent"""
         try:
             if not isinstance(message, MCPMessage):
                 raise ValueError("Message must be an instance of MCPMessage")
             
-            # Add protocol and timestamp if not present
-            if not hasattr(message, 'protocol'):
-                message.protocol = "MCP"
-            if not hasattr(message, 'timestamp'):
-                message.timestamp = datetime.now().isoformat()
-            
-            # Convert message to JSON
-            message_json = message.to_json()
+            body = await self._encode_body(message)
             
             if self.is_planner:
-                # For planner, send to specific agent
+                # For planner, send to specific agent (through the front router if it came that way)
+                route = self.peer_routes.get(message.receiver) or [message.receiver.encode()]
                 frames = [
-                    message.receiver.encode(),  # recipient identity
+                    *route,  # recipient identity
                     b"",  # empty frame
-                    message_json.encode()  # message content
+                    *body  # message content (plus compressed payload)
                 ]
             else:
-                # For other agents, just send the message
-                frames = [message_json.encode()]
+                # For other agents, the ROUTER adds our identity in front of the empty frame
+                frames = [b"", *body]
             
             logger.info(f"{self.agent_id} sending message to {message.receiver}")
+            if self.capture is not None:
+                self.capture.record(OUTBOUND, frames)
+            if self.history is not None:
+                self.history.record(OUTBOUND, message)
             await self.socket.send_multipart(frames)
             logger.info(f"{self.agent_id} message sent successfully")
             
@@ -123,6 +361,128 @@ class BaseAgent:
             logger.error(f"{self.agent_id} failed to send message: {str(e)}")
             raise
 
+    async def send_proposal(self, cfp_message, cfp_content, options):
+        """Answer a CFP with PROPOSE messages, streaming options in chunks if the CFP asked for it"""
+        stream = cfp_content.get("stream", False)
+        if stream:
+            size = STREAMING["chunk_size"]
+            chunks = [options[i:i + size] for i in range(0, len(options), size)] or [[]]
+        else:
+            chunks = [options]
+        
+        for index, chunk in enumerate(chunks):
+            proposal = {
+                "trip_id": cfp_content.get("trip_id"),
+                "options": chunk
+            }
+            if stream:
+                proposal["chunk"] = index
+                proposal["final"] = index == len(chunks) - 1
+            
+            response = MCPMessage(
+                performative=MCPPerformatives.PROPOSE,
+                content=json.dumps(proposal, default=json_default),
+                sender=self.agent_id,
+                receiver=cfp_message.sender,
+                conversation_id=cfp_message.conversation_id
+            )
+            await self.send_message(response)
+            # Let the planner (and other handlers) make progress between chunks
+            await asyncio.sleep(0)
+
+    async def send_batch_proposal(self, cfp_message, queries, options_for):
+        """
+        Answer a batched CFP with one PROPOSE holding the options of every
+        trip in it. Queries are grouped by destination and options_for(destination,
+        queries) returns the options of each query, so a provider looks a
+        destination up once for the whole batch.
+        """
+        by_destination = {}
+        for query in queries:
+            by_destination.setdefault(query.get("destination"), []).append(query)
+        
+        proposals = []
+        for destination, group in by_destination.items():
+            for query, options in zip(group, options_for(destination, group)):
+                proposals.append({"trip_id": query.get("trip_id"), "options": options})
+        
+        response = MCPMessage(
+            performative=MCPPerformatives.PROPOSE,
+            content=json.dumps({"batch": proposals, "final": True}, default=json_default),
+            sender=self.agent_id,
+            receiver=cfp_message.sender,
+            conversation_id=cfp_message.conversation_id
+        )
+        await self.send_message(response)
+
+    async def handle_booking_message(self, message, content, inventory, booking_units):
+        """
+        Provider side of a booking against an InventoryLedger: ACCEPT_PROPOSAL
+        holds the selected option, CONFIRM turns the hold into a booking and
+        CANCEL releases a hold or booking. booking_units(content) returns the
+        (inventory keys, capacity) of the selected option, or raises ValueError
+        if it cannot be booked. Returns False if the message is not a booking message.
+        """
+        trip_id = content.get("trip_id")
+        if message.performative == MCPPerformatives.ACCEPT_PROPOSAL:
+            quantity = content.get("quantity", 1)
+            try:
+                if type(quantity) is not int or quantity < 1:
+                    raise ValueError(f"Invalid quantity {quantity!r}")
+                keys, capacity = booking_units(content)
+            except ValueError as e:
+                reply = {"type": "hold", "trip_id": trip_id, "status": "invalid", "message": str(e)}
+            else:
+                # The planner's hold_key makes retried ACCEPT_PROPOSALs return the same hold
+                hold = inventory.hold(
+                    content.get("hold_key") or message.conversation_id, keys, quantity, capacity
+                )
+                if hold is None:
+                    reply = {"type": "hold", "trip_id": trip_id, "status": "unavailable",
+                             "message": "Not enough inventory left for the selected option"}
+                else:
+                    reply = {"type": "hold", "trip_id": trip_id, "status": hold.state, "hold_id": hold.hold_id,
+                             "booking_id": hold.booking_id, "expires_in": max(0.0, hold.expires_at - inventory.clock())}
+        elif message.performative == MCPPerformatives.CONFIRM and content.get("type") == "booking":
+            hold = inventory.confirm(content.get("hold_id"))
+            if hold is None:
+                reply = {"type": "booking", "trip_id": trip_id, "status": "expired", "hold_id": content.get("hold_id"),
+                         "message": "Hold expired or was released"}
+            else:
+                reply = {"type": "booking", "trip_id": trip_id, "status": "booked",
+                         "hold_id": hold.hold_id, "booking_id": hold.booking_id}
+        elif message.performative == MCPPerformatives.CANCEL:
+            reference = content.get("booking_id") or content.get("hold_id")
+            hold = inventory.cancel(reference)
+            if hold is None:
+                reply = {"type": "cancel", "trip_id": trip_id, "status": "unknown", "reference": reference,
+                         "message": "No such hold or booking"}
+            else:
+                reply = {"type": "cancel", "trip_id": trip_id, "status": "cancelled", "reference": reference}
+        else:
+            return False
+
+        performative = MCPPerformatives.CONFIRM if reply["status"] in ("held", "booked", "cancelled") else MCPPerformatives.DISCONFIRM
+        await self.send_message(message.create_reply(performative, json.dumps(reply)))
+        return True
+
+    async def handle_catalog_snapshot_request(self, message, catalog, publisher):
+        """
+        A planner's catalog replica is missing or stale: publish a snapshot,
+        or, if this agent doesn't publish (only one set of providers does when
+        planner shards share catalogs), send the catalog to the planner directly
+        """
+        if publisher is not None:
+            publisher.request_snapshot()
+            return
+        with catalog.pinned() as catalog_file:
+            payload = await asyncio.get_running_loop().run_in_executor(None, catalog_file.raw_file)
+        response = message.create_reply(
+            MCPPerformatives.RESPONSE,
+            json.dumps({"type": "catalog_snapshot", "role": self.role, "catalog": payload.decode()})
+        )
+        await self.send_message(response)
+
     async def _receive_messages(self):
         """Continuously receive and process messages"""
         logger.info(f"{self.agent_id} starting message receiver")
@@ -130,29 +490,42 @@ class BaseAgent:
             try:
                 # Receive multipart message
                 frames = await self.socket.recv_multipart()
+                if self.capture is not None:
+                    self.capture.record(INBOUND, frames)
                 
+                route = None
                 if self.is_planner:
-                    if len(frames) < 3:
+                    if len(frames) < 3 or b"" not in frames:
                         logger.error(f"{self.agent_id} received invalid message format")
                         continue
                     
-                    sender_identity = frames[0].decode()
-                    message_json = frames[2].decode()
+                    # [router identity, client identity] when relayed by a PlannerRouter
+                    delimiter = frames.index(b"")
+                    route = frames[:delimiter]
+                    sender_identity = route[-1].decode()
+                    body = frames[delimiter + 1:]
                 else:
-                    message_json = frames[0].decode()
+                    body = frames[1:] if frames[0] == b"" else frames
                     sender_identity = "planner"  # For non-planner agents, sender is always planner
                 
                 try:
-                    message = MCPMessage.from_json(message_json)
+                    message = self._decode_body(body, sender_identity)
+                    if route and len(route) > 1:
+                        self.peer_routes[message.sender] = route
+                    if self.history is not None:
+                        self.history.record(INBOUND, message)
                     logger.info(f"{self.agent_id} received message from {sender_identity}")
-                    logger.debug(f"Message content: {message_json}")
+                    logger.debug(f"Message content: {message.content}")
                     
                     # Handle message
-                    await self.handle_message(message)
+                    await self.run_handler(self.dispatch_message, message)
                     
                 except json.JSONDecodeError as e:
                     logger.error(f"{self.agent_id} failed to parse message JSON: {str(e)}")
                     continue
+                except ValueError as e:
+                    logger.error(f"{self.agent_id} rejected message from {sender_identity}: {str(e)}")
+                    continue
                 
             except zmq.error.ZMQError as e:
                 if e.errno == zmq.EAGAIN:
@@ -163,6 +536,21 @@ class BaseAgent:
                 logger.error(f"{self.agent_id} error processing message: {str(e)}")
                 await asyncio.sleep(1)
 
+    async def run_handler(self, handler, message):
+        """Await handler(message), timed by the watchdog against the handler budget"""
+        if self.watchdog is None:
+            await handler(message)
+            return
+        token = self.watchdog.handler_started(self.agent_id, message)
+        try:
+            await handler(message)
+        finally:
+            self.watchdog.handler_finished(token)
+
+    async def dispatch_message(self, message):
+        """Hand a received message to handle_message (agents may queue or reorder messages here)"""
+        await self.handle_message(message)
+
     async def handle_message(self, message):
         """Handle incoming messages - to be implemented by subclasses"""
         raise NotImplementedError("Subclasses must implement handle_message")
@@ -181,6 +569,7 @@ class BaseAgent:
                 # Planner received connection request
                 agent_id = content.get("agent_id")
                 logger.info(f"{self.agent_id} received connection request from {agent_id}")
+                self.record_peer_capabilities(agent_id, content)
                 
                 # Send connection acknowledgment
                 response = MCPMessage(
@@ -188,10 +577,13 @@ class BaseAgent:
                     content=json.dumps({
                         "type": "connected",
                         "status": "connected",
-                        "message": f"Connection established with {agent_id}"
+                        "message": f"Connection established with {agent_id}",
+                        "shm_readable": agent_id in self.shm_readable,
+                        **self._handshake_capabilities()
                     }),
                     sender=self.agent_id,
-                    receiver=agent_id
+                    receiver=agent_id,
+                    id_factory=self.id_factory
                 )
                 await self.send_message(response)
                 self.connected_agents.add(agent_id)
@@ -200,6 +592,7 @@ class BaseAgent:
             elif msg_type == "connected":
                 # Agent received connection acknowledgment
                 logger.info(f"{self.agent_id} received connection acknowledgment")
+                self.record_peer_capabilities(message.sender, content)
                 self.connection_state = ConnectionState.CONNECTED
                 logger.info(f"{self.agent_id} connection state: {self.connection_state.value}")
                 
@@ -0,0 +1,123 @@
+import logging
+import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"MCPCAP1\n"
+INBOUND = 0
+OUTBOUND = 1
+
+# File header: magic, wall-clock start (ns since the epoch)
+_FILE_HEADER = struct.Struct("<8sq")
+# Record header: ns since the capture started, direction, frame count
+_RECORD_HEADER = struct.Struct("<QBH")
+_FRAME_LENGTH = struct.Struct("<I")
+
+
+class CaptureRecord:
+    """One captured multipart message"""
+    __slots__ = ("offset_ns", "direction", "frames")
+
+    def __init__(self, offset_ns, direction, frames):
+        self.offset_ns = offset_ns
+        self.direction = direction
+        self.frames = frames
+
+
+class TrafficCapture:
+    """
+    Records every multipart message an agent sends or receives, exactly as
+    it went over the socket, to a compact binary capture file.
+
+    ``record`` only packs the frames into an in-memory buffer; the buffer
+    is handed to a single background thread (so records stay in order)
+    once it holds ``buffer_size`` bytes or is ``flush_interval`` seconds
+    old, so writes never block the event loop. Capturing stops once the
+    file would grow past ``max_bytes``.
+    """
+
+    def __init__(self, path, buffer_size=1 << 20, flush_interval=1.0, max_bytes=256 << 20):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.buffer_size = buffer_size
+        self.flush_interval_ns = int(flush_interval * 1e9)
+        self.max_bytes = max_bytes
+        self._file = open(path, "wb")
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="capture")
+        self._start_ns = time.monotonic_ns()
+        self._last_flush_ns = self._start_ns
+        self._buffer = [_FILE_HEADER.pack(MAGIC, time.time_ns())]
+        self._buffered = len(self._buffer[0])
+        self._written = 0
+        self.full = False
+        logger.info(f"Capturing traffic to {path}")
+
+    def record(self, direction, frames):
+        """Buffer one message (INBOUND or OUTBOUND) with its timestamp"""
+        if self.full:
+            return
+        now = time.monotonic_ns()
+        parts = [_RECORD_HEADER.pack(now - self._start_ns, direction, len(frames))]
+        size = _RECORD_HEADER.size
+        for frame in frames:
+            frame = bytes(frame)
+            parts.append(_FRAME_LENGTH.pack(len(frame)))
+            parts.append(frame)
+            size += _FRAME_LENGTH.size + len(frame)
+
+        if self._written + self._buffered + size > self.max_bytes:
+            logger.warning(f"Capture {self.path} reached {self.max_bytes} bytes, no longer recording")
+            self.full = True
+            return
+        self._buffer.extend(parts)
+        self._buffered += size
+        if self._buffered >= self.buffer_size or now - self._last_flush_ns >= self.flush_interval_ns:
+            self._flush()
+
+    def _flush(self):
+        self._last_flush_ns = time.monotonic_ns()
+        if self._buffer:
+            self._writer.submit(self._file.write, b"".join(self._buffer))
+            self._written += self._buffered
+            self._buffer = []
+            self._buffered = 0
+
+    def close(self):
+        """Write what is buffered and close the file"""
+        self._flush()
+        self._writer.shutdown(wait=True)
+        self._file.close()
+        logger.info(f"Capture {self.path} closed ({self._written} bytes)")
+
+
+def read_capture(path):
+    """Yield the CaptureRecords of a capture file in order; returns early on a truncated record"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < _FILE_HEADER.size:
+        raise ValueError(f"{path} is not a capture file")
+    magic, _ = _FILE_HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a capture file")
+
+    pos = _FILE_HEADER.size
+    size = len(data)
+    while pos + _RECORD_HEADER.size <= size:
+        offset_ns, direction, count = _RECORD_HEADER.unpack_from(data, pos)
+        pos += _RECORD_HEADER.size
+        frames = []
+        for _ in range(count):
+            if pos + _FRAME_LENGTH.size > size:
+                return
+            (length,) = _FRAME_LENGTH.unpack_from(data, pos)
+            pos += _FRAME_LENGTH.size
+            if pos + length > size:
+                return
+            frames.append(data[pos:pos + length])
+            pos += length
+        yield CaptureRecord(offset_ns, direction, frames)
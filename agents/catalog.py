@@ -0,0 +1,261 @@
+import asyncio
+import json
+import logging
+import mmap
+import os
+import threading
+from array import array
+from collections import OrderedDict
+from contextlib import contextmanager
+from types import MappingProxyType
+
+logger = logging.getLogger(__name__)
+
+
+def freeze(value):
+    """Recursively turn dicts into read-only mappings and lists into tuples"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+class CatalogOverlay:
+    """
+    Per-request view of an immutable catalog entry: the request-specific
+    fields (dates, computed prices, ...) live in the overlay and are only
+    merged with the shared entry when the option is serialized.
+    """
+    __slots__ = ("base", "fields", "hidden")
+
+    def __init__(self, base, hidden=(), **fields):
+        self.base = base
+        self.fields = fields
+        self.hidden = hidden
+
+    def __getitem__(self, key):
+        if key in self.fields:
+            return self.fields[key]
+        return self.base[key]
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_dict(self):
+        merged = {key: value for key, value in self.base.items() if key not in self.hidden}
+        merged.update(self.fields)
+        return merged
+
+
+def json_default(value):
+    """json.dumps default= hook for catalog entries and overlays"""
+    if isinstance(value, CatalogOverlay):
+        return value.to_dict()
+    if isinstance(value, MappingProxyType):
+        return dict(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def parse_entries(raw_entries):
+    """Parse raw JSON entries into a tuple of immutable entries"""
+    return tuple(freeze(json.loads(raw)) for raw in raw_entries)
+
+
+def split_catalog_lines(data):
+    """Group the entries of catalog-format bytes by destination, without parsing them"""
+    destinations = {}
+    for line in data.split(b"\n"):
+        destination, tab, raw = line.partition(b"\t")
+        if tab and not line.startswith(b"#"):
+            destinations.setdefault(destination.decode(), []).append(raw)
+    return destinations
+
+
+def thaw(value):
+    """Turn overlays and immutable catalog values back into plain dicts and lists"""
+    if isinstance(value, CatalogOverlay):
+        value = value.to_dict()
+    if isinstance(value, (dict, MappingProxyType)):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw(item) for item in value]
+    return value
+
+
+class _CatalogFile:
+    """
+    An open, memory-mapped catalog file plus its destination -> line offsets
+    index. Readers off the event loop acquire it first; close() waits for
+    the last of them to release it before unmapping the file.
+    """
+
+    def __init__(self, path):
+        stat = os.stat(path)
+        self.version = (stat.st_mtime_ns, stat.st_size)
+        self.index = {}
+        self._lock = threading.Lock()
+        self._readers = 0
+        self._closing = False
+        self._file = open(path, "rb")
+        self.mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if stat.st_size else b""
+
+        # Only the destination keys are read here; entries are parsed lazily
+        mm = self.mm
+        size = len(mm)
+        pos = 0
+        while pos < size:
+            end = mm.find(b"\n", pos)
+            if end == -1:
+                end = size
+            tab = mm.find(b"\t", pos, end)
+            if tab != -1 and mm[pos:pos + 1] != b"#":
+                destination = mm[pos:tab].decode()
+                offsets = self.index.get(destination)
+                if offsets is None:
+                    offsets = self.index[destination] = array("Q")
+                offsets.append(tab + 1)
+            pos = end + 1
+
+    def raw_entries(self, destination):
+        """Unparsed JSON entries of a destination, as bytes"""
+        mm = self.mm
+        raw = []
+        for start in self.index.get(destination, ()):
+            end = mm.find(b"\n", start)
+            raw.append(mm[start:end if end != -1 else len(mm)])
+        return raw
+
+    def read_entries(self, destination):
+        return parse_entries(self.raw_entries(destination))
+
+    def raw_destinations(self):
+        return {destination: self.raw_entries(destination) for destination in self.index}
+
+    def raw_file(self):
+        return bytes(self.mm)
+
+    def acquire(self):
+        with self._lock:
+            self._readers += 1
+        return self
+
+    def release(self):
+        with self._lock:
+            self._readers -= 1
+            unmap = self._closing and not self._readers
+        if unmap:
+            self._unmap()
+
+    def close(self):
+        """Unmap the file now, or when the last reader releases it"""
+        with self._lock:
+            self._closing = True
+            unmap = not self._readers
+        if unmap:
+            self._unmap()
+
+    def _unmap(self):
+        if isinstance(self.mm, mmap.mmap):
+            self.mm.close()
+        self._file.close()
+
+
+class Catalog:
+    """
+    Provider catalog loaded from a file of "<destination>\\t<JSON entry>" lines
+    (lines starting with "#" are comments).
+
+    The file is memory-mapped and only indexed by destination at load time;
+    a destination's entries are parsed on first use into immutable mappings
+    (safe to share between concurrent requests) and kept in a bounded LRU
+    cache. ``watch`` reloads the file when it changes, swapping the new
+    index in atomically between requests. Update the file by writing a new
+    one and renaming it over the old path, never by editing it in place.
+    """
+
+    def __init__(self, path, cache_size=256):
+        self.path = path
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._current = _CatalogFile(path)
+        logger.info(f"Loaded catalog {path} with {len(self._current.index)} destinations")
+
+    @property
+    def version(self):
+        """(mtime_ns, size) of the catalog file currently loaded"""
+        return self._current.version
+
+    def destinations(self):
+        return list(self._current.index)
+
+    def raw_entries(self, destination):
+        """Unparsed JSON entries (bytes) of one destination"""
+        return self._current.raw_entries(destination)
+
+    def raw_file(self):
+        """The whole catalog file as bytes"""
+        return self._current.raw_file()
+
+    def raw_destinations(self):
+        """destination -> unparsed JSON entries (bytes) for the whole catalog, e.g. for replication"""
+        return self._current.raw_destinations()
+
+    @contextmanager
+    def pinned(self):
+        """
+        The loaded catalog file (raw_entries, raw_destinations, raw_file,
+        version), kept open until the block exits even if a reload swaps
+        it out, so it can be read from an executor thread
+        """
+        current = self._current.acquire()
+        try:
+            yield current
+        finally:
+            current.release()
+
+    def get(self, destination):
+        """Immutable entries for a destination (empty tuple if unknown)"""
+        entries = self._cache.get(destination)
+        if entries is not None:
+            self._cache.move_to_end(destination)
+            return entries
+
+        entries = self._current.read_entries(destination)
+        self._cache[destination] = entries
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return entries
+
+    def _changed(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        return (stat.st_mtime_ns, stat.st_size) != self._current.version
+
+    async def reload(self):
+        """Re-index the catalog file off the event loop and swap it in"""
+        loaded = await asyncio.get_running_loop().run_in_executor(None, _CatalogFile, self.path)
+        # Lookups never await, so no request can observe a half-swapped catalog
+        previous, self._current = self._current, loaded
+        self._cache = OrderedDict()
+        # Unmapped once readers in executor threads (see pinned) are done with it
+        previous.close()
+        logger.info(f"Reloaded catalog {self.path} with {len(loaded.index)} destinations")
+
+    async def watch(self, interval):
+        """Poll the catalog file and hot-reload it whenever it changes"""
+        while True:
+            await asyncio.sleep(interval)
+            if self._changed():
+                try:
+                    await self.reload()
+                except Exception as e:
+                    logger.error(f"Failed to reload catalog {self.path}: {str(e)}")
+
+    def close(self):
+        self._current.close()
@@ -0,0 +1,239 @@
+import zmq
+import zmq.asyncio
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from agents.catalog import parse_entries, split_catalog_lines
+
+logger = logging.getLogger(__name__)
+
+TOPIC_PREFIX = b"catalog."
+
+
+class CatalogPublisher:
+    """
+    Publishes a provider catalog over PUB as [topic, header, payload] frames.
+
+    A full snapshot (the catalog file as-is) goes out every
+    ``snapshot_interval``; when the catalog file changes in between, only
+    the destinations whose entries changed are published as a delta.
+    Heartbeats carry the current version so replicas can tell that they
+    are up to date, or that they missed something and are stale.
+    """
+
+    def __init__(self, context, endpoint, role, catalog, snapshot_interval=30.0, heartbeat_interval=1.0):
+        self.endpoint = endpoint
+        self.role = role
+        self.topic = TOPIC_PREFIX + role.encode()
+        self.catalog = catalog
+        self.snapshot_interval = snapshot_interval
+        self.heartbeat_interval = heartbeat_interval
+        self.socket = context.socket(zmq.PUB)
+        self.version = 0
+        self._digests = {}
+        self._catalog_version = None
+        self._snapshot_requested = False
+        self._wake = None
+        self._task = None
+
+    def start(self):
+        logger.info(f"Publishing {self.role} catalog on {self.endpoint}")
+        self.socket.bind(self.endpoint)
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+        self.socket.close(linger=0)
+
+    def request_snapshot(self):
+        """Publish a full snapshot right away (e.g. for a replica that joined late)"""
+        self._snapshot_requested = True
+        if self._wake:
+            self._wake.set()
+
+    @staticmethod
+    def _digest_destinations(catalog_file):
+        return {
+            destination: hashlib.blake2b(b"\n".join(raw), digest_size=16).digest()
+            for destination, raw in catalog_file.raw_destinations().items()
+        }
+
+    async def _publish(self, kind, payload=b"", **fields):
+        if kind != "heartbeat":
+            self.version += 1
+        header = {"role": self.role, "kind": kind, "version": self.version, **fields}
+        await self.socket.send_multipart([self.topic, json.dumps(header).encode(), payload])
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_snapshot = 0
+        while True:
+            try:
+                if self.catalog.version != self._catalog_version:
+                    # Pinned: a reload must not unmap the file while the executor reads it
+                    with self.catalog.pinned() as catalog_file:
+                        # Hashing every destination touches the whole catalog; keep it off the event loop
+                        digests = await loop.run_in_executor(None, self._digest_destinations, catalog_file)
+                        changed = [d for d, digest in digests.items() if self._digests.get(d) != digest]
+                        removed = [d for d in self._digests if d not in digests]
+                        if self._catalog_version is not None and time.monotonic() < next_snapshot:
+                            payload = b"".join(
+                                d.encode() + b"\t" + entry + b"\n" for d in changed for entry in catalog_file.raw_entries(d)
+                            )
+                            await self._publish("delta", payload, removed=removed)
+                            logger.info(f"Published {self.role} catalog delta v{self.version}: {len(changed)} changed, {len(removed)} removed")
+                        else:
+                            next_snapshot = 0
+                        self._digests = digests
+                        self._catalog_version = catalog_file.version
+
+                if self._snapshot_requested or time.monotonic() >= next_snapshot:
+                    self._snapshot_requested = False
+                    with self.catalog.pinned() as catalog_file:
+                        # Copying the whole file is kept off the event loop too
+                        payload = await loop.run_in_executor(None, catalog_file.raw_file)
+                    await self._publish("snapshot", payload)
+                    next_snapshot = time.monotonic() + self.snapshot_interval
+                else:
+                    await self._publish("heartbeat")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to publish {self.role} catalog: {str(e)}")
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.heartbeat_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+
+class _RoleReplica:
+    __slots__ = ("version", "updated", "stale", "raw", "parsed")
+
+    def __init__(self):
+        self.version = None
+        self.updated = 0.0
+        self.stale = True
+        self.raw = {}  # destination -> unparsed entries
+        self.parsed = {}  # destination -> immutable entries, filled on first use
+
+
+class CatalogReplica:
+    """
+    Planner-side, versioned replica of provider catalogs fed by CatalogPublisher.
+
+    A role is fresh while its updates arrive in version order and the last
+    one (heartbeats included) is at most ``max_staleness`` seconds old; a
+    version gap marks the role stale until the next snapshot. Since PUB/SUB
+    drops whatever was published before a subscriber joined, ``on_stale(role)``
+    is called (at most once per ``max_staleness``) so the owner can ask the
+    provider for a fresh snapshot.
+    """
+
+    def __init__(self, context, endpoints, max_staleness=5.0, on_stale=None):
+        self.endpoints = endpoints
+        self.max_staleness = max_staleness
+        self.on_stale = on_stale
+        self._stale_reported = {}  # role -> monotonic time on_stale was last called
+        self.socket = context.socket(zmq.SUB)
+        self.roles = {}
+        self._task = None
+
+    def start(self):
+        for role, endpoint in self.endpoints.items():
+            logger.info(f"Subscribing to {role} catalog at {endpoint}")
+            self.socket.connect(endpoint)
+        self.socket.setsockopt(zmq.SUBSCRIBE, TOPIC_PREFIX)
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+        self.socket.close(linger=0)
+
+    def is_fresh(self, role):
+        replica = self.roles.get(role)
+        return (
+            replica is not None
+            and not replica.stale
+            and time.monotonic() - replica.updated <= self.max_staleness
+        )
+
+    def entries(self, role, destination):
+        """Replicated entries for a destination, or None if the replica cannot answer"""
+        if not self.is_fresh(role):
+            return None
+        replica = self.roles[role]
+        entries = replica.parsed.get(destination)
+        if entries is None:
+            raw = replica.raw.get(destination)
+            if raw is None:
+                return None
+            entries = replica.parsed[destination] = parse_entries(raw)
+        return entries
+
+    async def load_snapshot(self, role, payload):
+        """
+        Load a catalog snapshot a provider sent directly rather than over PUB
+        (providers that don't publish, e.g. on planner shards other than the
+        publishing one); its version is adopted from the next heartbeat
+        """
+        replica = self.roles.setdefault(role, _RoleReplica())
+        replica.raw = await asyncio.get_running_loop().run_in_executor(None, split_catalog_lines, payload)
+        replica.parsed = {}
+        replica.stale = False
+        replica.version = None
+        replica.updated = time.monotonic()
+        logger.info(f"Loaded {role} catalog snapshot sent by its provider")
+
+    def _report_stale(self, role):
+        now = time.monotonic()
+        if self.on_stale and now - self._stale_reported.get(role, -self.max_staleness) >= self.max_staleness:
+            self._stale_reported[role] = now
+            self.on_stale(role)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                _, header, payload = await self.socket.recv_multipart()
+                header = json.loads(header)
+                replica = self.roles.setdefault(header["role"], _RoleReplica())
+                kind = header["kind"]
+                version = header["version"]
+
+                if kind == "snapshot":
+                    replica.raw = await loop.run_in_executor(None, split_catalog_lines, payload)
+                    replica.parsed = {}
+                    replica.stale = False
+                    logger.info(f"Loaded {header['role']} catalog snapshot v{version}")
+                elif kind == "delta":
+                    if replica.version is None or version != replica.version + 1:
+                        replica.stale = True
+                    else:
+                        for destination, raw in split_catalog_lines(payload).items():
+                            replica.raw[destination] = raw
+                            replica.parsed.pop(destination, None)
+                        for destination in header.get("removed", ()):
+                            replica.raw.pop(destination, None)
+                            replica.parsed.pop(destination, None)
+                elif replica.version is None and not replica.stale:
+                    # First heartbeat after a snapshot loaded directly from a provider
+                    replica.version = version
+                elif version != replica.version:
+                    # Heartbeat for a version we never saw
+                    replica.stale = True
+
+                if kind != "heartbeat" and not replica.stale:
+                    replica.version = version
+                replica.updated = time.monotonic()
+                if replica.stale:
+                    self._report_stale(header["role"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Failed to apply catalog update: {str(e)}")
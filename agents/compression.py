@@ -0,0 +1,26 @@
+import zlib
+
+# Content encodings this build can produce and consume, in order of preference
+SUPPORTED_ENCODINGS = ("zlib",)
+
+
+def negotiate_encoding(accepted):
+    """Pick the preferred encoding that a peer advertised, or None"""
+    for encoding in SUPPORTED_ENCODINGS:
+        if encoding in accepted:
+            return encoding
+    return None
+
+
+def compress_content(content, encoding, level=6):
+    """Compress message content (str) into bytes using the given encoding"""
+    if encoding == "zlib":
+        return zlib.compress(content.encode(), level)
+    raise ValueError(f"Unsupported content encoding: {encoding}")
+
+
+def decompress_content(payload, encoding):
+    """Decompress a payload (bytes) produced by compress_content back into str"""
+    if encoding == "zlib":
+        return zlib.decompress(payload).decode()
+    raise ValueError(f"Unsupported content encoding: {encoding}")
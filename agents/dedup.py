@@ -0,0 +1,88 @@
+import hashlib
+import time
+from array import array
+
+# Slot markers; real fingerprints are always >= 2
+EMPTY = 0
+DELETED = 1
+
+
+def fingerprint(scope, key):
+    """64-bit fingerprint of a key within a scope (e.g. a client's idempotency key)"""
+    digest = hashlib.blake2b(f"{scope}\0{key}".encode(), digest_size=8).digest()
+    return max(int.from_bytes(digest, "little"), 2)
+
+
+class DedupWindow:
+    """
+    Recently seen keys, for spotting retries of requests already accepted.
+
+    Keys are stored as 64-bit fingerprints in two flat open-addressed
+    tables (``array("Q")``, at most half full), about 16 bytes per key of
+    capacity, so millions of keys cost megabytes rather than the hundreds
+    of bytes a set of strings would take per key. New keys go into the
+    current table; once it holds ``capacity / 2`` keys or is ``ttl / 2``
+    seconds old, it becomes the previous table and the old previous table
+    is dropped. A key is therefore remembered for at least ``ttl / 2``
+    seconds (unless more than ``capacity / 2`` newer keys arrive first) and
+    at most ``ttl``. Two different keys share a fingerprint with a
+    probability around n / 2**64.
+    """
+
+    def __init__(self, capacity=1 << 20, ttl=3600.0, clock=time.monotonic):
+        self.generation_size = max(capacity // 2, 1)
+        self.ttl = ttl
+        self.clock = clock
+        slots = 1 << (self.generation_size * 2 - 1).bit_length()
+        self._mask = slots - 1
+        self._current = array("Q", [EMPTY]) * slots
+        self._previous = array("Q", [EMPTY]) * slots
+        self._used = 0  # Occupied slots of the current table, deleted ones included
+        self._previous_used = 0
+        self._rotated_at = clock()
+
+    def __len__(self):
+        return self._used + self._previous_used
+
+    def __contains__(self, fp):
+        return self._find(self._current, fp) >= 0 or self._find(self._previous, fp) >= 0
+
+    def _find(self, table, fp):
+        mask = self._mask
+        index = fp & mask
+        while True:
+            value = table[index]
+            if value == fp:
+                return index
+            if value == EMPTY:
+                return -1
+            index = (index + 1) & mask
+
+    def _rotate(self):
+        self._previous, self._previous_used = self._current, self._used
+        self._current = array("Q", [EMPTY]) * (self._mask + 1)
+        self._used = 0
+        self._rotated_at = self.clock()
+
+    def add(self, fp):
+        """Remember a fingerprint; returns False if it was already in the window"""
+        if fp in self:
+            return False
+        if self._used >= self.generation_size or self.clock() - self._rotated_at >= self.ttl / 2:
+            self._rotate()
+        table = self._current
+        mask = self._mask
+        index = fp & mask
+        while table[index] > DELETED:
+            index = (index + 1) & mask
+        if table[index] == EMPTY:
+            self._used += 1
+        table[index] = fp
+        return True
+
+    def discard(self, fp):
+        """Forget a fingerprint (e.g. a request that was rejected and may be sent again)"""
+        for table in (self._current, self._previous):
+            index = self._find(table, fp)
+            if index >= 0:
+                table[index] = DELETED
@@ -0,0 +1,113 @@
+import heapq
+import itertools
+import time
+from collections import deque
+
+
+class _ClientQueue:
+    __slots__ = ("client_id", "weight", "max_in_flight", "max_queued", "items", "last_finish", "in_flight", "scheduled")
+
+    def __init__(self, client_id, weight, max_in_flight, max_queued):
+        self.client_id = client_id
+        self.weight = weight
+        self.max_in_flight = max_in_flight
+        self.max_queued = max_queued
+        self.items = deque()  # (virtual start, virtual finish, item)
+        self.last_finish = 0.0
+        self.in_flight = 0
+        self.scheduled = False  # In the ready heap (has items and is under its in-flight cap)
+
+
+class FairQueue:
+    """
+    Per-client queues served by weighted fair queuing (start-time fair
+    queuing over virtual time), with a cap on how many items of each client
+    may be in flight at once.
+
+    Each item gets a virtual finish tag of max(virtual now, the client's
+    last tag) + 1/weight; ``pop`` hands out the item with the smallest tag
+    among clients under their cap, so a client flooding the queue only
+    gets its weighted share while others have work waiting. ``classify``
+    maps a client id to its class in ``classes`` ({name: {"weight",
+    "max_in_flight", "max_queued"}}). Items stay in flight until ``done`` is
+    called with the token ``pop`` returned, or until ``in_flight_timeout``
+    passes.
+    """
+
+    def __init__(self, classes, classify, in_flight_timeout=300.0, clock=time.monotonic):
+        self.classes = classes
+        self.classify = classify
+        self.in_flight_timeout = in_flight_timeout
+        self.clock = clock
+        self.virtual_time = 0.0
+        self._clients = {}  # client_id -> _ClientQueue
+        self._ready = []  # Heap of (head finish tag, seq, _ClientQueue)
+        self._seq = itertools.count()
+        self._tokens = itertools.count(1)
+        self._in_flight = {}  # token -> (_ClientQueue, deadline)
+        self._next_expiry = 0.0
+
+    def __len__(self):
+        return sum(len(queue.items) for queue in self._clients.values())
+
+    def _queue(self, client_id):
+        queue = self._clients.get(client_id)
+        if queue is None:
+            settings = self.classes[self.classify(client_id)]
+            queue = self._clients[client_id] = _ClientQueue(
+                client_id, settings["weight"], settings["max_in_flight"], settings["max_queued"]
+            )
+        return queue
+
+    def _schedule(self, queue):
+        if queue.items and not queue.scheduled and queue.in_flight < queue.max_in_flight:
+            queue.scheduled = True
+            heapq.heappush(self._ready, (queue.items[0][1], next(self._seq), queue))
+
+    def push(self, client_id, item):
+        """Queue an item for a client; returns False if the client's queue is full"""
+        queue = self._queue(client_id)
+        if len(queue.items) >= queue.max_queued:
+            return False
+        start = max(self.virtual_time, queue.last_finish)
+        queue.last_finish = start + 1.0 / queue.weight
+        queue.items.append((start, queue.last_finish, item))
+        self._schedule(queue)
+        return True
+
+    def pop(self):
+        """(client_id, item, token) of the next item to serve, or None if nothing is eligible"""
+        self.expire()
+        if not self._ready:
+            return None
+        _, _, queue = heapq.heappop(self._ready)
+        queue.scheduled = False
+        start, _, item = queue.items.popleft()
+        self.virtual_time = max(self.virtual_time, start)
+        queue.in_flight += 1
+        token = next(self._tokens)
+        self._in_flight[token] = (queue, self.clock() + self.in_flight_timeout)
+        self._schedule(queue)
+        return queue.client_id, item, token
+
+    def done(self, token):
+        """Release the in-flight slot of a popped item (no-op if already released)"""
+        entry = self._in_flight.pop(token, None)
+        if entry is None:
+            return
+        queue = entry[0]
+        queue.in_flight -= 1
+        self._schedule(queue)
+        if not queue.items and not queue.in_flight:
+            # Idle clients are forgotten; they restart from the current virtual time
+            del self._clients[queue.client_id]
+
+    def expire(self):
+        """Release slots held longer than in_flight_timeout (work that never finished)"""
+        now = self.clock()
+        if now < self._next_expiry:
+            return
+        self._next_expiry = now + 1.0  # Scanning every in-flight item is only worth doing once a second
+        expired = [token for token, (_, deadline) in self._in_flight.items() if deadline <= now]
+        for token in expired:
+            self.done(token)
@@ -0,0 +1,97 @@
+import time
+from collections import OrderedDict, deque
+from agents.mcp_message import format_timestamp_ns
+from agents.capture import INBOUND, OUTBOUND
+
+_DIRECTIONS = {INBOUND: "in", OUTBOUND: "out"}
+
+# Rough memory cost of a recorded message (tuple + strings) and of a conversation (deque + key),
+# not counting the stored content itself
+ENTRY_OVERHEAD = 256
+CONVERSATION_OVERHEAD = 768
+
+
+class ConversationHistory:
+    """
+    Bounded record of the messages an agent sent and received, by conversation_id.
+
+    Each conversation keeps its last ``max_messages`` messages in a ring
+    buffer, with content cut to ``max_content`` characters. The estimated
+    size of everything stored never exceeds ``max_bytes``: when it would,
+    the least recently active conversations are dropped whole.
+    """
+
+    def __init__(self, max_messages=64, max_bytes=16 << 20, max_content=512):
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_content = max_content
+        self.size = 0
+        self.evicted = 0  # Conversations dropped to stay within max_bytes
+        self._conversations = OrderedDict()  # conversation_id -> deque of entries, least recent first
+
+    def __len__(self):
+        return len(self._conversations)
+
+    def __contains__(self, conversation_id):
+        return conversation_id in self._conversations
+
+    def record(self, direction, message):
+        """Append a message (INBOUND or OUTBOUND) to its conversation"""
+        full_content = message.content if isinstance(message.content, str) else ""
+        content = full_content[:self.max_content]
+        # (time recorded in ns, direction, performative, sender, receiver, content, full content length)
+        entry = (time.time_ns(), direction, message.performative, message.sender,
+                 message.receiver, content, len(full_content))
+        entry_size = ENTRY_OVERHEAD + len(content)
+
+        conversations = self._conversations
+        entries = conversations.get(message.conversation_id)
+        if entries is None:
+            entries = conversations[message.conversation_id] = deque(maxlen=self.max_messages)
+            self.size += CONVERSATION_OVERHEAD
+        else:
+            conversations.move_to_end(message.conversation_id)
+        if len(entries) == entries.maxlen:
+            self.size -= ENTRY_OVERHEAD + len(entries[0][5])
+        entries.append(entry)
+        self.size += entry_size
+
+        # Drop whole conversations, least recently active first (never the one just recorded)
+        while self.size > self.max_bytes and len(conversations) > 1:
+            _, dropped = conversations.popitem(last=False)
+            self.size -= CONVERSATION_OVERHEAD + sum(ENTRY_OVERHEAD + len(e[5]) for e in dropped)
+            self.evicted += 1
+
+    def timeline(self, conversation_id):
+        """The recorded messages of a conversation, oldest first (empty if unknown or evicted)"""
+        return [
+            {
+                "timestamp": format_timestamp_ns(timestamp_ns),
+                "direction": _DIRECTIONS[direction],
+                "performative": performative,
+                "sender": sender,
+                "receiver": receiver,
+                "content": content,
+                "content_length": length,
+                "truncated": length > len(content)
+            }
+            for timestamp_ns, direction, performative, sender, receiver, content, length
+            in self._conversations.get(conversation_id, ())
+        ]
+
+    def recent(self, limit=20):
+        """Ids of the most recently active conversations, most recent first"""
+        ids = []
+        for conversation_id in reversed(self._conversations):
+            if len(ids) == limit:
+                break
+            ids.append(conversation_id)
+        return ids
+
+    def stats(self):
+        return {
+            "conversations": len(self._conversations),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "evicted": self.evicted
+        }
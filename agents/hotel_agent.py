@@ -1,58 +1,108 @@
 from .base_agent import BaseAgent
-from .mcp_message import MCPMessage, MCPPerformatives
+from .mcp_message import MCPPerformatives
+from .catalog import Catalog, CatalogOverlay, freeze
+from .rate_calendar import RateTableCache, date_ordinal
+from .catalog_replication import CatalogPublisher
+from .inventory import InventoryLedger
+from config import CATALOGS, CATALOG_REPLICATION, INVENTORY
+import asyncio
 import logging
 import json
-import random
 from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
 
+# Returned when the catalog has nothing for a destination
+DEFAULT_HOTEL_OPTION = freeze({
+    "name": "Default Hotel",
+    "type": "standard",
+    "price_per_night": 5000,
+    "amenities": ["basic"],
+    "rating": 3.5,
+    "note": "Generic option for unspecified destination"
+})
+
+# Catalog fields used for pricing and booking that are not sent to the planner
+INTERNAL_FIELDS = ("nightly_rates", "rooms")
+
+
+def stay_ordinals(dates):
+    """(check_in, check_out) date ordinals of a stay, or None if the dates are missing or invalid"""
+    check_in = dates.get("check_in", dates.get("departure"))
+    check_out = dates.get("check_out", dates.get("return"))
+    try:
+        stay = date_ordinal(check_in), date_ordinal(check_out)
+    except (ValueError, TypeError):
+        return None
+    return stay if stay[1] > stay[0] else None
+
+
+def build_hotel_options(entries, dates, rate_table):
+    """
+    Date-stamp and price hotel catalog entries for a stay. rate_table() returns
+    the destination's RateTable and is only called when the stay is valid.
+    """
+    if not dates:
+        # Default to 7 nights if no dates provided
+        tomorrow = datetime.now() + timedelta(days=1)
+        dates = {
+            "check_in": tomorrow.strftime("%Y-%m-%d"),
+            "check_out": (tomorrow + timedelta(days=7)).strftime("%Y-%m-%d")
+        }
+    
+    # Price the stay for every hotel in one pass over the rate table
+    stay = stay_ordinals(dates)
+    totals = rate_table().totals(*stay) if stay else None
+    
+    # Catalog entries are shared and immutable, so per-request data goes in overlays
+    if totals is None:
+        return [CatalogOverlay(entry, hidden=INTERNAL_FIELDS, dates=dates) for entry in entries]
+    return [
+        CatalogOverlay(entry, hidden=INTERNAL_FIELDS, dates=dates, total_price=total)
+        for entry, total in zip(entries, totals)
+    ]
+
 class HotelAgent(BaseAgent):
-    def __init__(self, agent_id, endpoint):
+    role = "hotel"
+
+    def __init__(self, agent_id, endpoint, catalog_path=None, publish_catalog=None):
         super().__init__(agent_id, endpoint)
-        self.hotel_options = {
-            "Goa": [
-                {
-                    "name": "Taj Exotica",
-                    "type": "luxury",
-                    "price_per_night": 15000,
-                    "amenities": ["pool", "spa", "beach access", "restaurant"],
-                    "rating": 4.8
-                },
-                {
-                    "name": "Holiday Inn",
-                    "type": "mid-range",
-                    "price_per_night": 8000,
-                    "amenities": ["pool", "restaurant", "gym"],
-                    "rating": 4.2
-                }
-            ],
-            "Mumbai": [
-                {
-                    "name": "Taj Mahal Palace",
-                    "type": "luxury",
-                    "price_per_night": 20000,
-                    "amenities": ["pool", "spa", "multiple restaurants", "gym"],
-                    "rating": 4.9
-                },
-                {
-                    "name": "ITC Maratha",
-                    "type": "luxury",
-                    "price_per_night": 18000,
-                    "amenities": ["pool", "spa", "restaurant", "business center"],
-                    "rating": 4.7
-                }
-            ]
-        }
+        self.catalog = Catalog(catalog_path or CATALOGS["hotel"], cache_size=CATALOGS["cache_size"])
+        self._catalog_watch_task = None
+        # Publish the catalog for planner-side replicas (one provider per role should)
+        self.publish_catalog = CATALOG_REPLICATION["enabled"] if publish_catalog is None else publish_catalog
+        self.catalog_publisher = None
+        self.rate_tables = RateTableCache(CATALOGS["cache_size"])
+        self.inventory = InventoryLedger("HOTEL", hold_ttl=INVENTORY["hold_ttl"])
         logger.info("HotelAgent initialized")
 
     async def start(self):
         """Start the agent and notify the planner"""
-        await super().start()
         logger.info("Hotel Agent : Starting")
-        # Perform handshake with planner
-        await self.perform_handshake("planner")
+        # BaseAgent.start performs the handshake with the planner
+        await super().start()
         logger.info("Hotel Agent : Handshake initiated with planner")
+        if CATALOGS["reload_interval"]:
+            self._catalog_watch_task = asyncio.create_task(self.catalog.watch(CATALOGS["reload_interval"]))
+        if self.publish_catalog:
+            self.catalog_publisher = CatalogPublisher(
+                self.context,
+                CATALOG_REPLICATION["endpoints"]["hotel"],
+                "hotel",
+                self.catalog,
+                snapshot_interval=CATALOG_REPLICATION["snapshot_interval"],
+                heartbeat_interval=CATALOG_REPLICATION["heartbeat_interval"]
+            )
+            self.catalog_publisher.start()
+
+    async def stop(self):
+        """Stop the agent and release the catalog"""
+        if self._catalog_watch_task:
+            self._catalog_watch_task.cancel()
+        if self.catalog_publisher:
+            self.catalog_publisher.stop()
+        await super().stop()
+        self.catalog.close()
 
     async def handle_message(self, message):
         """Handle incoming MCP messages"""
@@ -67,7 +117,19 @@ class HotelAgent(BaseAgent):
                 if await self.handle_connection_message(message):
                     return
                 
-            if message.performative == MCPPerformatives.CFP:
+            # On-demand profiling and conversation history of this agent
+            if message.performative == MCPPerformatives.QUERY and content.get("type") == "profile":
+                await self.handle_profile_request(message, content)
+                return
+            if message.performative == MCPPerformatives.QUERY and content.get("type") == "history":
+                await self.handle_history_request(message, content)
+                return
+                
+            if message.performative == MCPPerformatives.CFP and "batch" in content:
+                logger.info(f"Processing batched hotel request for {len(content['batch'])} trips")
+                await self.send_batch_proposal(message, content["batch"], self._get_hotel_options_for)
+                
+            elif message.performative == MCPPerformatives.CFP:
                 trip_id = content.get("trip_id")
                 destination = content.get("destination")
                 dates = content.get("dates", {})
@@ -77,39 +139,16 @@ class HotelAgent(BaseAgent):
                 # Get hotel options for the destination
                 options = self._get_hotel_options(destination, dates)
                 
-                # Create response
-                response = MCPMessage(
-                    performative=MCPPerformatives.PROPOSE,
-                    content=json.dumps({
-                        "trip_id": trip_id,
-                        "options": options
-                    }),
-                    sender=self.agent_id,
-                    receiver=message.sender
-                )
-                
                 logger.info("Sending hotel options")
-                await self.send_message(response)
+                await self.send_proposal(message, content, options)
                 logger.info("Hotel options sent")
                 
-            elif message.performative == MCPPerformatives.ACCEPT_PROPOSAL:
-                trip_id = content.get("trip_id")
-                selected_option = content.get("selected_option")
+            elif message.performative == MCPPerformatives.QUERY and content.get("type") == "catalog_snapshot":
+                # A planner replica joined late or missed an update
+                await self.handle_catalog_snapshot_request(message, self.catalog, self.catalog_publisher)
                 
-                # Confirm the booking
-                response = MCPMessage(
-                    performative=MCPPerformatives.CONFIRM,
-                    content=json.dumps({
-                        "trip_id": trip_id,
-                        "status": "booked",
-                        "booking_id": f"HOTEL-{random.randint(1000, 9999)}",
-                        "selected_option": selected_option,
-                        "message": "Hotel booking confirmed"
-                    }),
-                    sender=self.agent_id,
-                    receiver=message.sender
-                )
-                await self.send_message(response)
+            elif await self.handle_booking_message(message, content, self.inventory, self._booking_units):
+                logger.info(f"Handled {message.performative} booking message for trip {content.get('trip_id')}")
                 
         except json.JSONDecodeError:
             logger.error("Invalid JSON in message content")
@@ -121,49 +160,35 @@ class HotelAgent(BaseAgent):
 
     def _calculate_nights(self, dates):
         """Calculate number of nights from check-in to check-out"""
-        try:
-            check_in = dates.get("check_in")
-            check_out = dates.get("check_out")
-            if check_in and check_out:
-                check_in_date = datetime.strptime(check_in, "%Y-%m-%d")
-                check_out_date = datetime.strptime(check_out, "%Y-%m-%d")
-                return (check_out_date - check_in_date).days
-        except (ValueError, TypeError):
-            pass
-        return 1  # Default to 1 night if dates are invalid
+        stay = stay_ordinals(dates)
+        return stay[1] - stay[0] if stay else 1  # Default to 1 night if dates are invalid
 
     def _get_hotel_options(self, destination, dates):
         """Get hotel options for the given destination and dates"""
-        options = self.hotel_options.get(destination, [])
+        return self._get_hotel_options_for(destination, [{"dates": dates}])[0]
+
+    def _get_hotel_options_for(self, destination, queries):
+        """Hotel options of several stays at one destination, sharing the catalog lookup and rate table"""
+        options = self.catalog.get(destination)
         
         # If no specific options for destination, return default options
         if not options:
-            return [{
-                "name": "Default Hotel",
-                "type": "standard",
-                "price_per_night": 5000,
-                "amenities": ["basic"],
-                "rating": 3.5,
-                "note": "Generic option for unspecified destination"
-            }]
-        
-        # Add date information and calculate total price
-        for option in options:
-            if dates:
-                option["dates"] = dates
-                # Calculate number of nights
-                if "departure" in dates and "return" in dates:
-                    start = datetime.strptime(dates["departure"], "%Y-%m-%d")
-                    end = datetime.strptime(dates["return"], "%Y-%m-%d")
-                    nights = (end - start).days
-                    option["total_price"] = option["price_per_night"] * nights
-            else:
-                # Default to 7 nights if no dates provided
-                tomorrow = datetime.now() + timedelta(days=1)
-                option["dates"] = {
-                    "check_in": tomorrow.strftime("%Y-%m-%d"),
-                    "check_out": (tomorrow + timedelta(days=7)).strftime("%Y-%m-%d")
-                }
-                option["total_price"] = option["price_per_night"] * 7
+            return [[DEFAULT_HOTEL_OPTION] for _ in queries]
         
-        return options
\ No newline at end of file
+        rate_table = lambda: self.rate_tables.get(destination, options)
+        return [build_hotel_options(options, query.get("dates", {}), rate_table) for query in queries]
+
+    def provider_capabilities(self):
+        """Hotel options are bookable rooms"""
+        return {**super().provider_capabilities(), "batch": True, "booking": True, "price_field": "price_per_night"}
+
+    def _booking_units(self, content):
+        """Room-night inventory keys and rooms per night of the option accepted in content"""
+        option_id = (content.get("selected_option") or {}).get("id")
+        entry = next((e for e in self.catalog.get(content.get("destination")) if e.get("id") == option_id), None)
+        if entry is None:
+            raise ValueError("Selected hotel option is not bookable")
+        stay = stay_ordinals(content.get("dates") or {})
+        if stay is None:
+            raise ValueError("Valid check-in and check-out dates are required to book")
+        return [(option_id, night) for night in range(*stay)], entry.get("rooms", INVENTORY["default_rooms"])
@@ -0,0 +1,132 @@
+import heapq
+import logging
+import time
+from agents.mcp_message import MonotonicIdGenerator
+
+logger = logging.getLogger(__name__)
+
+HELD = "held"
+BOOKED = "booked"
+RELEASED = "released"
+EXPIRED = "expired"
+
+
+class Hold:
+    """Units of one or more inventory keys reserved for a single accepted proposal"""
+    __slots__ = ("hold_id", "request_key", "keys", "quantity", "expires_at", "state", "booking_id")
+
+    def __init__(self, hold_id, request_key, keys, quantity, expires_at):
+        self.hold_id = hold_id
+        self.request_key = request_key
+        self.keys = keys
+        self.quantity = quantity
+        self.expires_at = expires_at
+        self.state = HELD
+        self.booking_id = None
+
+
+class InventoryLedger:
+    """
+    Per-unit inventory counters (a room-night, the seats of a departure, ...)
+    with short-lived holds.
+
+    A hold takes units from every key it covers at once, or from none of
+    them; it is turned into a booking by ``confirm`` or given back by
+    ``cancel``, and expires on its own after ``hold_ttl`` seconds. All three
+    are idempotent: ``hold`` with the same request key returns the existing
+    hold, and confirming or cancelling twice returns the first outcome.
+
+    Every operation runs to completion without awaiting, so on the agent's
+    event loop concurrent bookings of the same property never interleave and
+    no lock is needed; each touches only the counters of its own keys.
+    Expired holds are released lazily from a heap, and finished holds are
+    forgotten ``hold_ttl`` after they ended.
+    """
+
+    def __init__(self, id_prefix, hold_ttl=120.0, clock=time.monotonic):
+        self.hold_ttl = hold_ttl
+        self.clock = clock
+        self._available = {}  # key -> units neither held nor booked (created on first use)
+        self._holds = {}  # hold_id -> Hold
+        self._request_keys = {}  # request key -> hold_id, for idempotent holds
+        self._bookings = {}  # booking_id -> Hold
+        self._expiry = []  # Heap of (deadline, hold_id)
+        # Boot nonce + counter: ids never collide, even across provider restarts
+        self._hold_ids = MonotonicIdGenerator(f"{id_prefix}-HOLD")
+        self._booking_ids = MonotonicIdGenerator(id_prefix)
+
+    def available(self, key, capacity):
+        """Units of a key that can still be held"""
+        self._sweep()
+        return self._available.get(key, capacity)
+
+    def hold(self, request_key, keys, quantity, capacity):
+        """
+        Hold ``quantity`` units of every key (each starting at ``capacity``).
+        Returns the Hold, or None if some key does not have enough units left.
+        """
+        self._sweep()
+        existing = self._holds.get(self._request_keys.get(request_key))
+        if existing is not None and existing.state in (HELD, BOOKED):
+            return existing
+
+        available = self._available
+        if any(available.get(key, capacity) < quantity for key in keys):
+            return None
+        for key in keys:
+            available[key] = available.get(key, capacity) - quantity
+
+        hold = Hold(self._hold_ids(), request_key, tuple(keys), quantity, self.clock() + self.hold_ttl)
+        self._holds[hold.hold_id] = hold
+        self._request_keys[request_key] = hold.hold_id
+        heapq.heappush(self._expiry, (hold.expires_at, hold.hold_id))
+        return hold
+
+    def confirm(self, hold_id):
+        """Turn a hold into a booking; returns the Hold, or None if it expired or was released"""
+        self._sweep()
+        hold = self._holds.get(hold_id)
+        if hold is None or hold.state not in (HELD, BOOKED):
+            return None
+        if hold.state == HELD:
+            hold.state = BOOKED
+            hold.booking_id = self._booking_ids()
+            self._bookings[hold.booking_id] = hold
+        return hold
+
+    def cancel(self, reference):
+        """Release a hold or a booking (by hold or booking id); returns the Hold, or None if unknown"""
+        self._sweep()
+        hold = self._bookings.get(reference) or self._holds.get(reference)
+        if hold is None:
+            return None
+        if hold.state in (HELD, BOOKED):
+            self._release(hold, RELEASED)
+        return hold
+
+    def _release(self, hold, state):
+        available = self._available
+        for key in hold.keys:
+            available[key] += hold.quantity
+        hold.state = state
+        if hold.booking_id is None:
+            # Keep the outcome around for retries, then forget the hold
+            hold.expires_at = self.clock() + self.hold_ttl
+            heapq.heappush(self._expiry, (hold.expires_at, hold.hold_id))
+
+    def _sweep(self):
+        """Expire holds past their deadline and forget finished ones"""
+        expiry = self._expiry
+        now = self.clock()
+        while expiry and expiry[0][0] <= now:
+            _, hold_id = heapq.heappop(expiry)
+            hold = self._holds.get(hold_id)
+            if hold is None:
+                continue
+            if hold.state == HELD:
+                logger.info(f"Hold {hold_id} expired")
+                self._release(hold, EXPIRED)
+            elif hold.state in (RELEASED, EXPIRED) and hold.expires_at <= now:
+                del self._holds[hold_id]
+                if self._request_keys.get(hold.request_key) == hold_id:
+                    del self._request_keys[hold.request_key]
@@ -0,0 +1,150 @@
+import asyncio
+import json
+import logging
+import mmap
+import os
+
+logger = logging.getLogger(__name__)
+
+
+class TripJournal:
+    """
+    Append-only journal of planner trip state transitions.
+
+    Records are buffered and written in groups (one write + fsync per batch,
+    off the event loop). Every ``compact_every`` records the live state is
+    written to a snapshot file and the journal is truncated. Each record has
+    a sequence number and the snapshot remembers the last one it covers, so
+    a crash between snapshot and truncation never replays a record twice.
+    """
+
+    def __init__(self, path, flush_interval=0.002, max_batch=512, compact_every=10000, fsync=True):
+        self.path = path
+        self.snapshot_path = f"{path}.snapshot"
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.compact_every = compact_every
+        self.fsync = fsync
+
+        self._seq = 0
+        self._buffer = []
+        self._records_since_snapshot = 0
+        self._snapshot_fn = None
+        self._file = None
+        self._wake = None
+        self._lock = None
+        self._flush_task = None
+        self._closing = False
+
+    def replay(self, apply):
+        """Load the snapshot, apply(trips, record) every newer journal record, and return the trips"""
+        trips = {}
+        snapshot_seq = 0
+        if os.path.exists(self.snapshot_path):
+            with open(self.snapshot_path, "r") as f:
+                snapshot = json.load(f)
+            trips = snapshot.get("trips", {})
+            snapshot_seq = snapshot.get("seq", 0)
+        self._seq = snapshot_seq
+
+        replayed = 0
+        if os.path.exists(self.path) and os.path.getsize(self.path) > 0:
+            with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                for line in iter(mm.readline, b""):
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Torn write from a crash; nothing valid can follow it
+                        logger.warning(f"Journal {self.path} ends with a partial record, ignoring it")
+                        break
+                    if record["seq"] <= snapshot_seq:
+                        continue
+                    apply(trips, record)
+                    self._seq = record["seq"]
+                    replayed += 1
+
+        logger.info(f"Journal replay: {len(trips)} trips from snapshot and {replayed} records")
+        return trips
+
+    async def start(self, snapshot_fn):
+        """
+        Open the journal for appending. snapshot_fn() must return the live
+        trip state as fresh containers, since it is serialized off the event loop.
+        """
+        self._snapshot_fn = snapshot_fn
+        self._wake = asyncio.Event()
+        self._lock = asyncio.Lock()
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "ab")
+        # Start from a clean snapshot so the journal never carries a torn tail
+        await self.compact()
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    def append(self, op, trip_id, **fields):
+        """Queue a record for the next group commit (never blocks)"""
+        self._seq += 1
+        self._buffer.append(json.dumps({"seq": self._seq, "op": op, "trip_id": trip_id, **fields}).encode() + b"\n")
+        if self._wake is not None:
+            self._wake.set()
+
+    async def _flush_loop(self):
+        while not self._closing:
+            await self._wake.wait()
+            self._wake.clear()
+            if len(self._buffer) < self.max_batch:
+                # Give concurrent handlers a moment to join this commit group
+                await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        """Write and fsync all buffered records as one batch"""
+        async with self._lock:
+            if not self._buffer:
+                return
+            batch, self._buffer = self._buffer, []
+            await asyncio.get_running_loop().run_in_executor(None, self._write, b"".join(batch))
+            self._records_since_snapshot += len(batch)
+            if self._records_since_snapshot >= self.compact_every:
+                await self._compact_locked()
+
+    async def compact(self):
+        """Write a snapshot of the live state and truncate the journal"""
+        async with self._lock:
+            await self._compact_locked()
+
+    async def _compact_locked(self):
+        # The live state already reflects every queued record, so they are covered by the snapshot
+        snapshot = {"seq": self._seq, "trips": self._snapshot_fn()}
+        self._buffer = []
+        await asyncio.get_running_loop().run_in_executor(None, self._write_snapshot, snapshot)
+        self._records_since_snapshot = 0
+
+    def _write(self, data):
+        self._file.write(data)
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def _write_snapshot(self, snapshot):
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        os.replace(tmp_path, self.snapshot_path)
+        self._file.flush()
+        os.ftruncate(self._file.fileno(), 0)
+
+    async def close(self):
+        """Flush pending records and close the journal"""
+        self._closing = True
+        if self._flush_task:
+            self._wake.set()
+            await self._flush_task
+        if self._file:
+            await self.flush()
+            self._file.close()
+            self._file = None
@@ -1,31 +1,103 @@
 import json
-from datetime import datetime
+import itertools
+import secrets
+import time
+from datetime import datetime, timedelta
 import uuid
 
+_EPOCH = datetime(1970, 1, 1)
+
+
+def uuid_id():
+    """Generate a random UUID4 string (globally unique, but comparatively slow)"""
+    return str(uuid.uuid4())
+
+
+class MonotonicIdGenerator:
+    """
+    Cheap id generator producing "<prefix>.<boot nonce>-<counter>" strings.
+    The boot nonce keeps ids unique across restarts of the same agent.
+    """
+    __slots__ = ("_prefix", "_counter")
+
+    def __init__(self, prefix):
+        self._prefix = f"{prefix}.{secrets.token_hex(4)}-"
+        self._counter = itertools.count(1)
+
+    def __call__(self):
+        return f"{self._prefix}{next(self._counter):x}"
+
+
+def format_timestamp_ns(timestamp_ns):
+    """Format integer nanoseconds since the epoch as a naive UTC ISO-8601 string"""
+    seconds, remainder = divmod(timestamp_ns, 1_000_000_000)
+    return (_EPOCH + timedelta(seconds=seconds, microseconds=remainder // 1000)).isoformat()
+
+
+def parse_timestamp(timestamp):
+    """Parse an ISO-8601 timestamp string into integer nanoseconds since the epoch"""
+    parsed = datetime.fromisoformat(timestamp)
+    if parsed.tzinfo is not None:
+        parsed = parsed.replace(tzinfo=None) - parsed.utcoffset()
+    delta = parsed - _EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1_000_000_000 + delta.microseconds * 1000
+
+
 class MCPMessage:
     """
     Multi-Agent Communication Protocol (MCP) Message Format
     Based on principles of structured agent communication
+
+    Timestamps are kept as integer nanoseconds and only formatted as ISO-8601
+    when the message is serialized; timestamps received from peers are kept
+    as the original string until someone asks for ``timestamp_ns``.
     """
-    def __init__(self, 
+    __slots__ = ("performative", "content", "sender", "receiver",
+                 "conversation_id", "_timestamp", "protocol", "content_encoding")
+
+    # Used when no conversation_id or id_factory is given
+    default_id_factory = staticmethod(uuid_id)
+
+    def __init__(self,
                  performative,  # Type of message (REQUEST, INFORM, QUERY, etc.)
                  content,      # Actual message content
                  sender,       # Sender agent ID
                  receiver,     # Receiver agent ID
                  conversation_id=None,  # For tracking conversation threads
-                 timestamp=None,        # Message timestamp
-                 protocol="MCP-1.0"):   # Protocol version
+                 timestamp=None,        # Message timestamp (ISO string or int nanoseconds)
+                 protocol="MCP-1.0",    # Protocol version
+                 id_factory=None,       # Callable generating new conversation ids
+                 content_encoding=None):  # Set when content travels compressed
         self.performative = performative
         self.content = content
         self.sender = sender
         self.receiver = receiver
-        self.conversation_id = conversation_id or str(uuid.uuid4())
-        self.timestamp = timestamp or datetime.utcnow().isoformat()
+        self.conversation_id = conversation_id or (id_factory or self.default_id_factory)()
+        self._timestamp = timestamp or time.time_ns()
         self.protocol = protocol
+        self.content_encoding = content_encoding
 
-    def to_json(self):
-        """Convert message to JSON format"""
-        return json.dumps({
+    @property
+    def timestamp(self):
+        """Message timestamp as an ISO-8601 string"""
+        if isinstance(self._timestamp, int):
+            return format_timestamp_ns(self._timestamp)
+        return self._timestamp
+
+    @timestamp.setter
+    def timestamp(self, value):
+        self._timestamp = value
+
+    @property
+    def timestamp_ns(self):
+        """Message timestamp as integer nanoseconds since the epoch"""
+        if isinstance(self._timestamp, int):
+            return self._timestamp
+        return parse_timestamp(self._timestamp)
+
+    def to_dict(self):
+        """Convert message to a JSON-serializable dict"""
+        data = {
             "protocol": self.protocol,
             "performative": self.performative,
             "content": self.content,
@@ -33,7 +105,14 @@ class MCPMessage:
             "receiver": self.receiver,
             "conversation_id": self.conversation_id,
             "timestamp": self.timestamp
-        })
+        }
+        if self.content_encoding:
+            data["content_encoding"] = self.content_encoding
+        return data
+
+    def to_json(self):
+        """Convert message to JSON format"""
+        return json.dumps(self.to_dict())
 
     @classmethod
     def from_json(cls, json_str):
@@ -46,7 +125,8 @@ class MCPMessage:
             receiver=data["receiver"],
             conversation_id=data.get("conversation_id"),
             timestamp=data.get("timestamp"),
-            protocol=data.get("protocol", "MCP-1.0")
+            protocol=data.get("protocol", "MCP-1.0"),
+            content_encoding=data.get("content_encoding")
         )
 
     def create_reply(self, performative, content):
@@ -70,5 +150,7 @@ class MCPPerformatives:
     REJECT = "REJECT"            # Reject a proposal
     FAILURE = "FAILURE"          # Report failure
     CFP = "CALL_FOR_PROPOSALS"   # Call for proposals
+    ACCEPT_PROPOSAL = "ACCEPT_PROPOSAL"  # Accept (and hold) a proposed option
+    CANCEL = "CANCEL"            # Cancel a hold or booking
     CONFIRM = "CONFIRM"          # Confirm an action
-    DISCONFIRM = "DISCONFIRM"    # Disconfirm an action 
\ No newline at end of file
+    DISCONFIRM = "DISCONFIRM"    # Disconfirm an action
\ No newline at end of file
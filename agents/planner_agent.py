@@ -1,34 +1,474 @@
 from .base_agent import BaseAgent
 from .mcp_message import MCPMessage, MCPPerformatives
+from .journal import TripJournal
+from .catalog import thaw
+from .catalog_replication import CatalogReplica
+from .rate_calendar import RateTableCache
+from .proposal_cache import ProposalCache
+from .fair_queue import FairQueue
+from .dedup import DedupWindow, fingerprint
+from .travel_agent import build_travel_options
+from .hotel_agent import build_hotel_options
+from config import CATALOGS, STREAMING, JOURNAL, CATALOG_REPLICATION, ITINERARIES, FAIR_QUEUING, IDEMPOTENCY, PROVIDERS, BATCHING, INVENTORY
+import asyncio
 import logging
 import json
+from collections import OrderedDict
 
 logger = logging.getLogger(__name__)
 
+# Client messages that wait their turn in the fair queue; everything else is handled on arrival
+QUEUED_PERFORMATIVES = (MCPPerformatives.REQUEST, MCPPerformatives.CANCEL)
+
+# Trip fields persisted in the journal besides every role's "<role>_options" (the rest is derived, in-memory state)
+JOURNALED_FIELDS = ("destination", "dates", "status", "requester", "conversation_id", "roles", "completed_roles",
+                    "legs", "origin", "itinerary", "trips", "batch", "idempotency_key")
+
+# Options built from the catalog replica, for roles whose providers publish their catalog
+REPLICA_BUILDERS = {
+    "travel": lambda planner, entries, request: build_travel_options(entries, request["dates"]),
+    "hotel": lambda planner, entries, request: build_hotel_options(
+        entries, request["dates"], lambda: planner.replica_rate_tables.get(request["destination"], entries)
+    )
+}
+
+# How the option of a role that goes in a plan is picked, by the "select" its provider advertised
+OPTION_SELECTORS = {
+    "first": lambda options, capabilities: options[0],
+    "cheapest": lambda options, capabilities: min(
+        options, key=lambda option: option.get(capabilities.get("price_field", "price"), float("inf"))
+    )
+}
+
+
+def _is_journaled(field):
+    return field in JOURNALED_FIELDS or field.endswith("_options")
+
+
+def _store_proposal(request, role, options, final):
+    """Record a proposal (chunk) for a role in the trip state"""
+    request.setdefault(f"{role}_options", []).extend(options)
+    completed_roles = request.setdefault("completed_roles", [])
+    if final and role not in completed_roles:
+        completed_roles.append(role)
+
+
+def _apply_journal_record(trips, record):
+    """Replay one journal record onto the recovered trip state"""
+    op = record["op"]
+    trip_id = record["trip_id"]
+    if op == "request":
+        trips[trip_id] = record["state"]
+        return
+    request = trips.get(trip_id)
+    if request is None:
+        return
+    if op == "cfp":
+        # A (re-)issued CFP replaces whatever the role had proposed so far
+        request.pop(f"{record['role']}_options", None)
+        if record["role"] in request.get("completed_roles", []):
+            request["completed_roles"].remove(record["role"])
+    elif op == "proposal":
+        _store_proposal(request, record["role"], record["options"], record["final"])
+    elif op == "plan_sent":
+        del trips[trip_id]
+
 class PlannerAgent(BaseAgent):
-    def __init__(self, agent_id, endpoint, travel_agent_id="travel", hotel_agent_id="hotel"):
+    def __init__(self, agent_id, endpoint, journal_path=None, replicate_catalogs=None):
         super().__init__(agent_id, endpoint, is_planner=True)
         self.trip_requests = {}
-        self.travel_agent_id = travel_agent_id
-        self.hotel_agent_id = hotel_agent_id
-        logger.info(f"PlannerAgent initialized with travel_agent_id={self.travel_agent_id}, hotel_agent_id={self.hotel_agent_id}")
+        # Providers by the role they announced when connecting
+        self.providers = {}  # role -> agent_id
+        self.provider_roles = {}  # agent_id -> role
+        self.provider_capabilities = {}  # role -> advertised capability schema
+        self._provider_handlers = {
+            MCPPerformatives.PROPOSE: self._handle_proposal,  # Proposals or proposal chunks
+            MCPPerformatives.CONFIRM: self._handle_booking_reply,
+            MCPPerformatives.DISCONFIRM: self._handle_booking_reply,
+            MCPPerformatives.RESPONSE: self._handle_catalog_snapshot  # From providers that don't publish
+        }
+        self.journal = TripJournal(
+            journal_path or JOURNAL["path"],
+            flush_interval=JOURNAL["flush_interval"],
+            max_batch=JOURNAL["max_batch"],
+            compact_every=JOURNAL["compact_every"],
+            fsync=JOURNAL["fsync"]
+        ) if JOURNAL["enabled"] else None
+        # Trips restored from the journal that still need CFPs once providers connect
+        self.recovered_trips = set()
+        # Local replica of provider catalogs for answering without a CFP round trip
+        if replicate_catalogs is None:
+            replicate_catalogs = CATALOG_REPLICATION["enabled"]
+        self.catalog_replica = CatalogReplica(
+            self.context,
+            CATALOG_REPLICATION["endpoints"],
+            max_staleness=CATALOG_REPLICATION["max_staleness"],
+            on_stale=lambda role: asyncio.create_task(self._request_catalog_snapshot(role))
+        ) if replicate_catalogs else None
+        self.replica_rate_tables = RateTableCache(CATALOGS["cache_size"])
+        # Options of recently planned legs, reused by requests for the same city and dates
+        self.proposal_cache = ProposalCache(ttl=ITINERARIES["cache_ttl"], max_entries=ITINERARIES["cache_size"])
+        # Client requests are served by weighted fair queuing across client identities
+        self.client_classes = {}  # client_id -> class advertised in its connection test and requests
+        self.fair_queue = FairQueue(
+            FAIR_QUEUING["classes"],
+            self._client_class,
+            in_flight_timeout=FAIR_QUEUING["in_flight_timeout"]
+        ) if FAIR_QUEUING["enabled"] else None
+        self._fair_queue_wake = asyncio.Event()
+        self._fair_queue_task = None
+        self._admission = None  # Fair queue token of the request being handled
+        # (client, idempotency key) fingerprints of accepted requests, so retries aren't planned twice
+        self.recent_requests = DedupWindow(IDEMPOTENCY["window_keys"], IDEMPOTENCY["window_ttl"])
+        # Trip each recent key fingerprint was accepted for (a retry may come with a new trip_id)
+        self.request_trip_ids = OrderedDict()
+        logger.info("PlannerAgent initialized")
+
+    async def start(self):
+        """Recover in-flight trips from the journal, then start the agent"""
+        if self.journal:
+            recovered = self.journal.replay(_apply_journal_record)
+            self.trip_requests.update(recovered)
+            self.recovered_trips.update(recovered)
+            for trip_id, request in recovered.items():
+                if request.get("idempotency_key"):
+                    key = fingerprint(request["requester"], request["idempotency_key"])
+                    self.recent_requests.add(key)
+                    self._remember_request(key, trip_id)
+            await self.journal.start(self._journal_snapshot)
+            if recovered:
+                logger.info(f"Recovered {len(recovered)} in-flight trips from the journal")
+        await super().start()
+        if self.catalog_replica:
+            self.catalog_replica.start()
+        if self.fair_queue is not None:
+            self._fair_queue_task = asyncio.create_task(self._serve_fair_queue())
+
+    async def stop(self):
+        """Stop the agent and flush the journal"""
+        if self.catalog_replica:
+            self.catalog_replica.stop()
+        if self._fair_queue_task:
+            self._fair_queue_task.cancel()
+        await super().stop()
+        if self.journal:
+            await self.journal.close()
+
+    def _journal(self, op, trip_id, **fields):
+        """Append a trip state transition to the journal, if enabled"""
+        if self.journal:
+            self.journal.append(op, trip_id, **fields)
+
+    def _journaled_state(self, request):
+        """The fields of a trip that go in the journal (in-memory bookkeeping stays out)"""
+        return {field: value for field, value in request.items() if _is_journaled(field)}
+
+    def _journal_snapshot(self):
+        """Copy of the in-flight trip state for journal compaction"""
+        return {
+            trip_id: {
+                field: list(value) if isinstance(value, list) else value
+                for field, value in request.items() if _is_journaled(field)
+            }
+            for trip_id, request in self.trip_requests.items()
+            if self._in_flight(request)
+        }
+
+    def _in_flight(self, request):
+        """True while a trip (or the itinerary or batch it belongs to) is still being planned"""
+        parent = request.get("itinerary") or request.get("batch")
+        if parent:
+            request = self.trip_requests.get(parent, request)
+        return request["status"] == "planning"
+
+    def record_peer_capabilities(self, peer_id, content):
+        """Remember a peer's handshake, registering it as the provider of the role it announced"""
+        super().record_peer_capabilities(peer_id, content)
+        role = content.get("role")
+        if not role:
+            return
+        previous = self.providers.get(role)
+        if previous is not None and previous != peer_id:
+            logger.warning(f"{peer_id} replaces {previous} as the {role} provider")
+            self.provider_roles.pop(previous, None)
+        self.providers[role] = peer_id
+        self.provider_roles[peer_id] = role
+        self.provider_capabilities[role] = content.get("capabilities") or {}
+        logger.info(f"Registered {peer_id} as {role} provider: {self.provider_capabilities[role]}")
+
+    def _provider_id(self, role):
+        return self.providers.get(role)
+
+    def _role_of(self, agent_id):
+        """Provider role of an agent, or None if it is not one of our providers"""
+        return self.provider_roles.get(agent_id)
+
+    def _roles(self, request):
+        """Provider roles a trip (or leg) needs"""
+        return request.get("roles") or PROVIDERS["default_roles"]
+
+    def _missing_providers(self, roles):
+        """Roles without a connected provider"""
+        return [role for role in roles if self.providers.get(role) not in self.connected_agents]
+
+    def _client_class(self, client_id):
+        """Fair queuing class of a client: configured override, then advertised class, then the default"""
+        client_class = FAIR_QUEUING["clients"].get(client_id) or self.client_classes.get(client_id)
+        return client_class if client_class in FAIR_QUEUING["classes"] else FAIR_QUEUING["default_class"]
+
+    def _request_identity(self, message, content):
+        """(trip_id, idempotency key fingerprint or None) of a client trip REQUEST, None for other messages"""
+        if message.performative != MCPPerformatives.REQUEST:
+            return None
+        if not isinstance(content, dict) or content.get("type") == "book":
+            return None
+        key = content.get("idempotency_key")
+        return content.get("trip_id", "default"), fingerprint(message.sender, key) if key else None
+
+    def _remember_request(self, key, trip_id):
+        """Remember the trip an accepted key fingerprint belongs to, keeping only the most recent ones"""
+        self.request_trip_ids[key] = trip_id
+        if len(self.request_trip_ids) > IDEMPOTENCY["trip_ids"]:
+            self.request_trip_ids.popitem(last=False)
+
+    def _forget_request(self, message, content):
+        """Let a rejected request be sent again with the same idempotency key"""
+        if content.get("idempotency_key"):
+            key = fingerprint(message.sender, content["idempotency_key"])
+            self.recent_requests.discard(key)
+            self.request_trip_ids.pop(key, None)
+
+    async def dispatch_message(self, message):
+        """
+        Answer retried requests from the dedup window and queue client
+        requests for fair scheduling; provider and control messages are
+        handled right away.
+        """
+        if message.performative not in QUEUED_PERFORMATIVES or self._role_of(message.sender):
+            await self.handle_message(message)
+            return
+        try:
+            content = json.loads(message.content)
+        except (TypeError, ValueError):
+            content = None
+        if isinstance(content, dict) and content.get("client_class"):
+            # Every request carries it: with sharding, the connection test may have gone to another shard
+            self.client_classes[message.sender] = content["client_class"]
+        trip_id, key = self._request_identity(message, content) or (None, None)
+        if key is not None and not self.recent_requests.add(key):
+            logger.info(f"Request for trip {trip_id} from {message.sender} is a retry, not planning it again")
+            await self._answer_retry(message, self.request_trip_ids.get(key, trip_id), trip_id)
+            return
+        if key is not None:
+            self._remember_request(key, trip_id)
+        if self.fair_queue is None:
+            await self.handle_message(message)
+            return
+        if not self.fair_queue.push(message.sender, message):
+            logger.warning(f"Queue of client {message.sender} is full, rejecting request")
+            if key is not None:
+                self.recent_requests.discard(key)
+                self.request_trip_ids.pop(key, None)
+            response = message.create_reply(
+                MCPPerformatives.FAILURE,
+                json.dumps({"status": "busy", "trip_id": trip_id, "message": "Too many queued requests, retry later"})
+            )
+            await self.send_message(response)
+            return
+        self._fair_queue_wake.set()
+
+    async def _answer_retry(self, message, trip_id, requested_trip_id):
+        """
+        Answer a retried request with where its original trip (trip_id) stands
+        instead of planning it again; requested_trip_id is the one the retry carried
+        """
+        request = self.trip_requests.get(trip_id)
+        if request is None or request.get("requester") != message.sender:
+            # The original is still waiting in the fair queue
+            status, text = "queued", f"Trip {trip_id} is queued for planning"
+        elif request["status"] == "planning":
+            status, text = "planning_started", f"Trip {trip_id} is being planned"
+        else:
+            status, text = "planned", f"Trip {trip_id} is already planned, sending the plan again"
+        reply = {"status": status, "trip_id": trip_id, "duplicate": True, "message": text}
+        if requested_trip_id != trip_id:
+            reply["requested_trip_id"] = requested_trip_id
+        response = message.create_reply(MCPPerformatives.CONFIRM, json.dumps(reply))
+        await self.send_message(response)
+        if status == "planned":
+            # The final plan may be what the client never received
+            await self._send_plan(request, self._final_plan(trip_id, request))
+
+    async def _serve_fair_queue(self):
+        """Handle queued client requests one at a time in weighted fair order"""
+        while self.running:
+            entry = self.fair_queue.pop()
+            if entry is None:
+                self._fair_queue_wake.clear()
+                try:
+                    # Wake up now and then anyway to expire slots of trips that never finished
+                    await asyncio.wait_for(self._fair_queue_wake.wait(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            
+            _, message, token = entry
+            self._admission = token
+            try:
+                await self.run_handler(self.handle_message, message)
+            except Exception as e:
+                logger.error(f"Error handling queued request from {message.sender}: {str(e)}")
+            finally:
+                # Requests that started planning keep their slot until the plan is sent
+                if self._admission is not None:
+                    self.fair_queue.done(token)
+                self._admission = None
+
+    def _take_admission(self):
+        """Keep the fair queue slot of the request being handled until its trip completes"""
+        token, self._admission = self._admission, None
+        return token
+
+    def _release_admission(self, request):
+        token = request.pop("admission", None)
+        if token is not None and self.fair_queue is not None:
+            self.fair_queue.done(token)
+
+    def _restart_role(self, trip_id, role, request):
+        """A new CFP starts a role over, so drop any partial options from an earlier one"""
+        request.pop(f"{role}_options", None)
+        if role in request.get("completed_roles", []):
+            request["completed_roles"].remove(role)
+        self._journal("cfp", trip_id, role=role)
+
+    async def _send_cfp(self, trip_id, role, request):
+        """Call for proposals from the provider of a role"""
+        self._restart_role(trip_id, role, request)
+        
+        provider_id = self._provider_id(role)
+        cfp = MCPMessage(
+            performative=MCPPerformatives.CFP,
+            content=json.dumps({
+                "trip_id": trip_id,
+                "destination": request["destination"],
+                "dates": request["dates"],
+                "type": f"{role}_options",
+                # Only providers that advertised streaming are asked for chunked proposals
+                "stream": STREAMING["enabled"] and bool(self.provider_capabilities.get(role, {}).get("streaming"))
+            }),
+            sender=self.agent_id,
+            receiver=provider_id,
+            id_factory=self.id_factory
+        )
+        logger.info(f"Sending CFP to {role} agent {provider_id}")
+        await self.send_message(cfp)
+
+    async def _send_batch_cfps(self, role, trip_ids):
+        """
+        Call for proposals for many trips from the provider of a role, with
+        one CFP per BATCHING["cfp_size"] trips if the provider answers
+        batched CFPs (one CFP per trip otherwise)
+        """
+        if not self.provider_capabilities.get(role, {}).get("batch"):
+            await asyncio.gather(*(self._send_cfp(trip_id, role, self.trip_requests[trip_id]) for trip_id in trip_ids))
+            return
+        
+        provider_id = self._provider_id(role)
+        size = BATCHING["cfp_size"]
+        for start in range(0, len(trip_ids), size):
+            queries = []
+            for trip_id in trip_ids[start:start + size]:
+                request = self.trip_requests[trip_id]
+                self._restart_role(trip_id, role, request)
+                queries.append({"trip_id": trip_id, "destination": request["destination"], "dates": request["dates"]})
+            cfp = MCPMessage(
+                performative=MCPPerformatives.CFP,
+                content=json.dumps({"type": f"{role}_options", "batch": queries}),
+                sender=self.agent_id,
+                receiver=provider_id,
+                id_factory=self.id_factory
+            )
+            logger.info(f"Sending batched CFP for {len(queries)} trips to {role} agent {provider_id}")
+            await self.send_message(cfp)
+
+    async def _request_catalog_snapshot(self, role):
+        """Ask a provider to republish its catalog because our replica is missing or stale"""
+        provider_id = self._provider_id(role)
+        if provider_id not in self.connected_agents:
+            return
+        query = MCPMessage(
+            performative=MCPPerformatives.QUERY,
+            content=json.dumps({"type": "catalog_snapshot"}),
+            sender=self.agent_id,
+            receiver=provider_id,
+            id_factory=self.id_factory
+        )
+        logger.info(f"Requesting {role} catalog snapshot from {provider_id}")
+        await self.send_message(query)
+
+    async def _handle_catalog_snapshot(self, message, content):
+        """Load the catalog a non-publishing provider sent in answer to a snapshot request"""
+        if content.get("type") != "catalog_snapshot" or self.catalog_replica is None:
+            return
+        await self.catalog_replica.load_snapshot(self._role_of(message.sender), content["catalog"].encode())
+
+    def _replica_options(self, role, request):
+        """Options for a role built from the local catalog replica, or None if it can't answer"""
+        if self.catalog_replica is None or role not in REPLICA_BUILDERS:
+            return None
+        entries = self.catalog_replica.entries(role, request["destination"])
+        if not entries:
+            return None
+        return [thaw(option) for option in REPLICA_BUILDERS[role](self, entries, request)]
+
+    async def _resume_recovered_trips(self):
+        """Re-issue CFPs for recovered trips once the providers of all their roles are connected"""
+        for trip_id in list(self.recovered_trips):
+            request = self.trip_requests.get(trip_id)
+            if request is None or request["status"] != "planning" or "legs" in request or "trips" in request:
+                self.recovered_trips.discard(trip_id)
+                continue
+            roles = self._roles(request)
+            if self._missing_providers(roles):
+                continue
+            self.recovered_trips.discard(trip_id)
+            logger.info(f"Resuming recovered trip {trip_id}")
+            missing = [role for role in roles if role not in request.get("completed_roles", [])]
+            if not missing:
+                # Crashed after the last proposal but before the plan went out
+                await self._complete_trip(trip_id, request)
+            for role in missing:
+                await self._send_cfp(trip_id, role, request)
 
     async def handle_message(self, message):
         """Handle incoming MCP messages"""
         logger.info(f"PlannerAgent received message: {message.performative} from {message.sender}")
         logger.info(f"Message content: {message.content}")
         
+        content = None
         try:
             content = json.loads(message.content)
             
             # Handle connection messages first
             if content.get("type") in ["connect", "connected"]:
                 if await self.handle_connection_message(message):
+                    await self._resume_recovered_trips()
                     return
             
+            # On-demand profiling and conversation history of this agent
+            if message.performative == MCPPerformatives.QUERY and content.get("type") == "profile":
+                await self.handle_profile_request(message, content)
+                return
+            if message.performative == MCPPerformatives.QUERY and content.get("type") == "history":
+                await self.handle_history_request(message, content)
+                return
+            
             # Handle connection test
             if content.get("type") == "connection_test":
                 logger.info("Received connection test, sending response")
+                self.record_peer_capabilities(message.sender, content)
+                if content.get("client_class"):
+                    self.client_classes[message.sender] = content["client_class"]
                 response = message.create_reply(
                     MCPPerformatives.CONFIRM,
                     json.dumps({"status": "connected", "message": "Planner agent is ready"})
@@ -36,89 +476,99 @@ class PlannerAgent(BaseAgent):
                 await self.send_message(response)
                 return
             
-            if message.performative == MCPPerformatives.REQUEST:
+            # Replies from providers go to the handler for their performative, whatever the role
+            handler = self._provider_handlers.get(message.performative)
+            if handler and self._role_of(message.sender):
+                await handler(message, content)
+                return
+            
+            if message.performative == MCPPerformatives.REQUEST and content.get("type") == "book":
+                logger.info(f"Processing booking request from {message.sender}")
+                await self._start_booking(message, content)
+                
+            elif message.performative == MCPPerformatives.CANCEL:
+                logger.info(f"Processing booking cancellation from {message.sender}")
+                await self._cancel_booking(message, content)
+                
+            elif message.performative == MCPPerformatives.REQUEST:
                 logger.info(f"Processing trip request from {message.sender}")
                 
                 trip_id = content.get("trip_id", "default")
                 logger.info(f"Processing trip ID: {trip_id}")
                 
-                # Check if all required agents are connected
-                if not await self.is_connected():
-                    logger.error("Planner is not fully connected")
+                # Never let one client's request replace another client's trip
+                existing = self.trip_requests.get(trip_id)
+                if existing is not None and existing.get("requester") != message.sender:
+                    logger.error(f"Trip ID {trip_id} is already used by another client")
+                    self._forget_request(message, content)
                     response = message.create_reply(
                         MCPPerformatives.FAILURE,
                         json.dumps({
                             "status": "error",
-                            "message": "Planner is not fully connected"
+                            "trip_id": trip_id,
+                            "message": "Trip ID is already in use"
                         })
                     )
                     await self.send_message(response)
                     return
                 
-                if self.travel_agent_id not in self.connected_agents:
-                    logger.error(f"Travel agent {self.travel_agent_id} is not connected")
+                # Check if all required agents are connected
+                if not await self.is_connected():
+                    logger.error("Planner is not fully connected")
+                    self._forget_request(message, content)
                     response = message.create_reply(
                         MCPPerformatives.FAILURE,
                         json.dumps({
                             "status": "error",
-                            "message": "Travel agent is not connected"
+                            "message": "Planner is not fully connected"
                         })
                     )
                     await self.send_message(response)
                     return
                 
-                if self.hotel_agent_id not in self.connected_agents:
-                    logger.error(f"Hotel agent {self.hotel_agent_id} is not connected")
+                # Every role the trip needs must have a connected provider
+                roles = content.get("roles") or PROVIDERS["default_roles"]
+                if not isinstance(roles, list) or not all(isinstance(role, str) for role in roles):
+                    error = "roles must be a list of provider roles"
+                else:
+                    missing = self._missing_providers(roles)
+                    error = f"No provider is connected for: {', '.join(missing)}" if missing else None
+                if error:
+                    logger.error(f"Cannot plan trip {trip_id}: {error}")
+                    self._forget_request(message, content)
                     response = message.create_reply(
                         MCPPerformatives.FAILURE,
                         json.dumps({
                             "status": "error",
-                            "message": "Hotel agent is not connected"
+                            "trip_id": trip_id,
+                            "message": error
                         })
                     )
                     await self.send_message(response)
                     return
                 
+                if content.get("legs"):
+                    await self._start_itinerary(message, content, trip_id, roles)
+                    return
+                
+                if content.get("type") == "batch":
+                    await self._start_batch(message, content, trip_id, roles)
+                    return
+                
                 # Store request details
                 self.trip_requests[trip_id] = {
                     "destination": content.get("destination", "Goa"),
                     "dates": content.get("dates", {}),
+                    "roles": roles,
                     "status": "planning",
-                    "requester": message.sender
+                    "requester": message.sender,
+                    "conversation_id": message.conversation_id,
+                    "idempotency_key": content.get("idempotency_key"),
+                    "admission": self._take_admission()
                 }
                 logger.info(f"Stored request details for trip {trip_id}")
                 
-                # Call for proposals from travel agent
-                travel_msg = MCPMessage(
-                    performative=MCPPerformatives.CFP,
-                    content=json.dumps({
-                        "trip_id": trip_id,
-                        "destination": content.get("destination", "Goa"),
-                        "dates": content.get("dates", {}),
-                        "type": "travel_options"
-                    }),
-                    sender=self.agent_id,
-                    receiver=self.travel_agent_id
-                )
-                logger.info(f"Sending CFP to travel agent {self.travel_agent_id}")
-                await self.send_message(travel_msg)
-                logger.info("CFP sent to travel agent")
-                
-                # Call for proposals from hotel agent
-                hotel_msg = MCPMessage(
-                    performative=MCPPerformatives.CFP,
-                    content=json.dumps({
-                        "trip_id": trip_id,
-                        "destination": content.get("destination", "Goa"),
-                        "dates": content.get("dates", {}),
-                        "type": "hotel_options"
-                    }),
-                    sender=self.agent_id,
-                    receiver=self.hotel_agent_id
-                )
-                logger.info(f"Sending CFP to hotel agent {self.hotel_agent_id}")
-                await self.send_message(hotel_msg)
-                logger.info("CFP sent to hotel agent")
+                local_options = await self._plan_trip(trip_id, self.trip_requests[trip_id], content.get("live_pricing"))
                 
                 # Acknowledge receipt
                 response = message.create_reply(
@@ -133,42 +583,8 @@ class PlannerAgent(BaseAgent):
                 await self.send_message(response)
                 logger.info("Confirmation sent to requester")
                 
-            elif message.performative == MCPPerformatives.PROPOSE:
-                # Handle proposals from travel and hotel agents
-                logger.info(f"Received proposal from {message.sender}")
-                try:
-                    proposal_data = json.loads(message.content)
-                    trip_id = proposal_data.get("trip_id")
-                    logger.info(f"Processing proposal for trip {trip_id}")
-                    
-                    if trip_id in self.trip_requests:
-                        if message.sender == self.travel_agent_id:
-                            logger.info("Storing travel options")
-                            self.trip_requests[trip_id]["travel_options"] = proposal_data.get("options", [])
-                        elif message.sender == self.hotel_agent_id:
-                            logger.info("Storing hotel options")
-                            self.trip_requests[trip_id]["hotel_options"] = proposal_data.get("options", [])
-                        
-                        # Check if we have both travel and hotel options
-                        if "travel_options" in self.trip_requests[trip_id] and "hotel_options" in self.trip_requests[trip_id]:
-                            logger.info("Both travel and hotel options received, creating trip plan")
-                            # Create final trip plan
-                            trip_plan = self._create_trip_plan(trip_id)
-                            self.trip_requests[trip_id]["status"] = "completed"
-                            
-                            # Send final plan to requester
-                            final_response = MCPMessage(
-                                performative=MCPPerformatives.INFORM,
-                                content=json.dumps(trip_plan),
-                                sender=self.agent_id,
-                                receiver=self.trip_requests[trip_id].get("requester")
-                            )
-                            logger.info("Sending final trip plan to requester")
-                            await self.send_message(final_response)
-                            logger.info("Final trip plan sent")
-                            
-                except json.JSONDecodeError:
-                    logger.error("Invalid JSON in proposal")
+                for role, options in local_options.items():
+                    await self._accept_proposal(trip_id, self.trip_requests[trip_id], role, options, True)
                 
         except json.JSONDecodeError:
             logger.error("Invalid JSON in request")
@@ -177,25 +593,616 @@ class PlannerAgent(BaseAgent):
                 "Invalid request format. Please provide valid JSON with trip details."
             )
             await self.send_message(response)
+        except Exception as e:
+            logger.error(f"Error handling {message.performative} from {message.sender}: {str(e)}")
+            if self._role_of(message.sender):
+                return
+            # Let the client retry with the same idempotency key rather than be told "queued" forever
+            trip_id = None
+            if isinstance(content, dict):
+                trip_id = content.get("trip_id")
+                if message.performative == MCPPerformatives.REQUEST:
+                    self._forget_request(message, content)
+            response = message.create_reply(
+                MCPPerformatives.FAILURE,
+                json.dumps({"status": "error", "trip_id": trip_id, "message": "Could not process the request"})
+            )
+            await self.send_message(response)
 
-    def _create_trip_plan(self, trip_id):
-        """Create a comprehensive trip plan from available options"""
-        logger.info(f"Creating trip plan for {trip_id}")
-        request = self.trip_requests[trip_id]
-        travel_options = request.get("travel_options", [])
-        hotel_options = request.get("hotel_options", [])
+    def _local_options(self, role, request):
+        """Options for a role from the catalog replica or a recently planned identical leg, or None"""
+        options = self._replica_options(role, request)
+        if options is None:
+            options = self.proposal_cache.get(role, request["destination"], request["dates"])
+        return options
+
+    async def _plan_trip(self, trip_id, request, live_pricing=False):
+        """
+        Journal a stored trip (or leg) and call for proposals for every role
+        that can't be answered locally; returns {role: options} answered
+        locally, to be accepted once the requester has been confirmed.
+        """
+        self._journal("request", trip_id, state=self._journaled_state(request))
+        
+        # Answer from the catalog replica or recent proposals, unless live pricing was asked for
+        local_options = {}
+        roles = self._roles(request)
+        if not live_pricing:
+            for role in roles:
+                options = self._local_options(role, request)
+                if options is not None:
+                    local_options[role] = options
+        
+        # Call for proposals from the providers of all other roles at once
+        await asyncio.gather(*(
+            self._send_cfp(trip_id, role, request) for role in roles if role not in local_options
+        ))
+        logger.info(f"CFPs sent for {trip_id}, answered locally: {list(local_options)}")
+        return local_options
+
+    async def _start_itinerary(self, message, content, trip_id, roles):
+        """Plan every leg of a multi-city trip concurrently and answer with one itinerary"""
+        legs = content["legs"]
+        error = None
+        if not isinstance(legs, list):
+            error = "legs must be a list of legs"
+        elif len(legs) > ITINERARIES["max_legs"]:
+            error = f"An itinerary can have at most {ITINERARIES['max_legs']} legs"
+        elif not all(isinstance(leg, dict) and leg.get("destination") for leg in legs):
+            error = "Every leg needs a destination"
+        elif not all(isinstance(leg.get("dates", {}), dict) for leg in legs):
+            error = "The dates of every leg must be an object with check_in and check_out"
+        else:
+            # Legs must connect: each one starts the day the previous one ends
+            for previous, leg in zip(legs, legs[1:]):
+                if previous.get("dates", {}).get("check_out") != leg.get("dates", {}).get("check_in"):
+                    error = f"Leg to {leg['destination']} must start when the leg to {previous['destination']} ends"
+                    break
+        if error:
+            self._forget_request(message, content)
+            response = message.create_reply(
+                MCPPerformatives.FAILURE,
+                json.dumps({"status": "error", "trip_id": trip_id, "message": error})
+            )
+            await self.send_message(response)
+            return
+        
+        leg_ids = [f"{trip_id}.leg{index}" for index in range(len(legs))]
+        self.trip_requests[trip_id] = itinerary = {
+            "legs": leg_ids,
+            "origin": content.get("origin"),
+            "roles": roles,
+            "status": "planning",
+            "requester": message.sender,
+            "conversation_id": message.conversation_id,
+            "idempotency_key": content.get("idempotency_key"),
+            "admission": self._take_admission()
+        }
+        self._journal("request", trip_id, state=self._journaled_state(itinerary))
+        for leg_id, leg in zip(leg_ids, legs):
+            self.trip_requests[leg_id] = {
+                "destination": leg["destination"],
+                "dates": leg.get("dates", {}),
+                "roles": roles,
+                "status": "planning",
+                "requester": message.sender,
+                "conversation_id": message.conversation_id,
+                "itinerary": trip_id
+            }
+        
+        # Fan out to the providers for all legs at once
+        local_options = await asyncio.gather(*(
+            self._plan_trip(leg_id, self.trip_requests[leg_id], content.get("live_pricing")) for leg_id in leg_ids
+        ))
+        
+        response = message.create_reply(
+            MCPPerformatives.CONFIRM,
+            json.dumps({
+                "status": "planning_started",
+                "trip_id": trip_id,
+                "legs": leg_ids,
+                "message": f"Planning your trip to {', '.join(leg['destination'] for leg in legs)}"
+            })
+        )
+        await self.send_message(response)
+        
+        for leg_id, options_by_role in zip(leg_ids, local_options):
+            for role, options in options_by_role.items():
+                await self._accept_proposal(leg_id, self.trip_requests[leg_id], role, options, True)
+
+    async def _leg_completed(self, itinerary_id):
+        """Send the itinerary once all its legs are planned (or a progressive update until then)"""
+        itinerary = self.trip_requests.get(itinerary_id)
+        if itinerary is None or itinerary["status"] != "planning":
+            return
+        legs = [self.trip_requests.get(leg_id) for leg_id in itinerary["legs"]]
+        done = all(leg is not None and leg["status"] == "completed" for leg in legs)
+        
+        plan = self._create_itinerary_plan(itinerary_id, final=done)
+        if done:
+            itinerary["status"] = "completed"
+            self._release_admission(itinerary)
+            logger.info(f"All legs of itinerary {itinerary_id} planned, sending it to requester")
+            await self._send_plan(itinerary, plan)
+            self._journal("plan_sent", itinerary_id)
+            for leg_id in itinerary["legs"]:
+                self._journal("plan_sent", leg_id)
+        elif STREAMING["progressive_updates"]:
+            await self._send_plan(itinerary, plan)
+
+    def _create_itinerary_plan(self, itinerary_id, final=True):
+        """Chain the (best so far) plans of an itinerary's legs, each leaving from the previous city"""
+        itinerary = self.trip_requests[itinerary_id]
+        legs = []
+        origin = itinerary.get("origin")
+        for leg_id in itinerary["legs"]:
+            leg = self.trip_requests.get(leg_id)
+            if leg is None:
+                continue
+            plan = self._create_trip_plan(leg_id, final=leg["status"] == "completed")
+            plan["from"] = origin
+            origin = leg["destination"]
+            legs.append(plan)
+        return {
+            "trip_id": itinerary_id,
+            "type": "itinerary",
+            "legs": legs,
+            "status": "planned" if final else "partial",
+            "final": final
+        }
+
+    async def _start_batch(self, message, content, batch_id, roles):
+        """Plan many independent trips with one CFP per provider and answer with all their plans at once"""
+        trips = content.get("trips")
+        error = None
+        if not isinstance(trips, list) or not trips:
+            error = "A batch needs a list of trips"
+        elif len(trips) > BATCHING["max_trips"]:
+            error = f"A batch can have at most {BATCHING['max_trips']} trips"
+        elif not all(isinstance(trip, dict) and trip.get("trip_id") and trip.get("destination") for trip in trips):
+            error = "Every trip of a batch needs a trip_id and a destination"
+        elif len({trip["trip_id"] for trip in trips}) != len(trips):
+            error = "Trip ids in a batch must be unique"
+        if error:
+            self._forget_request(message, content)
+            response = message.create_reply(
+                MCPPerformatives.FAILURE,
+                json.dumps({"status": "error", "trip_id": batch_id, "message": error})
+            )
+            await self.send_message(response)
+            return
+        
+        # Trips of the batch are planned (and can be booked) as "<batch_id>.<trip_id>"
+        trip_ids = [f"{batch_id}.{trip['trip_id']}" for trip in trips]
+        self.trip_requests[batch_id] = batch = {
+            "trips": trip_ids,
+            "roles": roles,
+            "status": "planning",
+            "requester": message.sender,
+            "conversation_id": message.conversation_id,
+            "idempotency_key": content.get("idempotency_key"),
+            "admission": self._take_admission()
+        }
+        self._journal("request", batch_id, state=self._journaled_state(batch))
+        batch["pending"] = len(trip_ids)  # Trips not planned yet
+        for trip_id, trip in zip(trip_ids, trips):
+            self.trip_requests[trip_id] = {
+                "destination": trip["destination"],
+                "dates": trip.get("dates", {}),
+                "roles": roles,
+                "status": "planning",
+                "requester": message.sender,
+                "conversation_id": message.conversation_id,
+                "batch": batch_id
+            }
+        
+        local_options = await self._plan_batch(trip_ids, content.get("live_pricing"))
+        
+        response = message.create_reply(
+            MCPPerformatives.CONFIRM,
+            json.dumps({
+                "status": "planning_started",
+                "trip_id": batch_id,
+                "message": f"Planning {len(trip_ids)} trips"
+            })
+        )
+        await self.send_message(response)
+        
+        for trip_id, options_by_role in local_options.items():
+            for role, options in options_by_role.items():
+                await self._accept_proposal(trip_id, self.trip_requests[trip_id], role, options, True)
+
+    async def _plan_batch(self, trip_ids, live_pricing=False):
+        """
+        Journal the trips of a batch and call for proposals for everything
+        that can't be answered locally, with batched CFPs for all roles at
+        once; returns {trip_id: {role: options}} answered locally.
+        """
+        local_options = {}
+        to_call = {}  # role -> trip_ids that need a CFP
+        for trip_id in trip_ids:
+            request = self.trip_requests[trip_id]
+            self._journal("request", trip_id, state=self._journaled_state(request))
+            local = {}
+            for role in self._roles(request):
+                options = None if live_pricing else self._local_options(role, request)
+                if options is None:
+                    to_call.setdefault(role, []).append(trip_id)
+                else:
+                    local[role] = options
+            if local:
+                local_options[trip_id] = local
+        
+        await asyncio.gather(*(self._send_batch_cfps(role, ids) for role, ids in to_call.items()))
+        logger.info(f"Batched CFPs sent for {len(trip_ids)} trips: {({role: len(ids) for role, ids in to_call.items()})}")
+        return local_options
+
+    async def _batch_trip_completed(self, batch_id):
+        """Send the plans of a batch once its last trip is planned"""
+        batch = self.trip_requests.get(batch_id)
+        if batch is None or batch["status"] != "planning":
+            return
+        if "pending" in batch:
+            batch["pending"] -= 1
+        else:
+            # Recovered from the journal: count what is left once
+            batch["pending"] = sum(
+                1 for trip_id in batch["trips"] if self.trip_requests.get(trip_id, {}).get("status") != "completed"
+            )
+        if batch["pending"] > 0:
+            return
+        
+        batch["status"] = "completed"
+        self._release_admission(batch)
+        logger.info(f"All {len(batch['trips'])} trips of batch {batch_id} planned, sending them to requester")
+        await self._send_plan(batch, self._create_batch_plan(batch_id))
+        self._journal("plan_sent", batch_id)
+        for trip_id in batch["trips"]:
+            self._journal("plan_sent", trip_id)
+
+    def _create_batch_plan(self, batch_id):
+        """The final plans of every trip of a batch, in request order"""
+        batch = self.trip_requests[batch_id]
+        return {
+            "trip_id": batch_id,
+            "type": "batch",
+            "plans": [self._create_trip_plan(trip_id) for trip_id in batch["trips"]],
+            "status": "planned",
+            "final": True
+        }
+
+    def _final_plan(self, trip_id, request):
+        """Final plan of a trip, itinerary or batch"""
+        if "legs" in request:
+            return self._create_itinerary_plan(trip_id, final=True)
+        if "trips" in request:
+            return self._create_batch_plan(trip_id)
+        return self._create_trip_plan(trip_id)
+
+    async def _handle_proposal(self, message, proposal_data):
+        """Store a proposal chunk and push a progressive or final plan to the requester"""
+        if "batch" in proposal_data:
+            # Answer to a batched CFP: the final options of many trips
+            for proposal in proposal_data["batch"]:
+                await self._handle_proposal(message, proposal)
+            return
+        
+        trip_id = proposal_data.get("trip_id")
+        logger.info(f"Processing proposal for trip {trip_id}")
+        
+        request = self.trip_requests.get(trip_id)
+        if request is None or request["status"] != "planning":
+            return
         
-        # Simple selection logic - can be made more sophisticated
-        selected_travel = travel_options[0] if travel_options else {"status": "No travel options available"}
-        selected_hotel = hotel_options[0] if hotel_options else {"status": "No hotel options available"}
+        role = self._role_of(message.sender)
+        if role not in self._roles(request):
+            logger.warning(f"Ignoring proposal from {message.sender}, trip {trip_id} didn't ask for it")
+            return
+        
+        # Proposals without a "final" flag come from non-streaming providers
+        await self._accept_proposal(trip_id, request, role, proposal_data.get("options", []), proposal_data.get("final", True))
+
+    async def _accept_proposal(self, trip_id, request, role, options, final):
+        """Store options for a role and push a progressive or final plan to the requester"""
+        logger.info(f"Storing {role} options")
+        _store_proposal(request, role, options, final)
+        self._journal("proposal", trip_id, role=role, options=options, final=final)
+        
+        if final:
+            self.proposal_cache.put(role, request["destination"], request["dates"], list(request[f"{role}_options"]))
+        
+        # The trip is planned once every role it needs has proposed
+        roles = self._roles(request)
+        if all(r in request["completed_roles"] for r in roles):
+            await self._complete_trip(trip_id, request)
+        elif STREAMING["progressive_updates"] and not request.get("itinerary") and not request.get("batch"):
+            trip_plan = self._create_trip_plan(trip_id, final=False)
+            selection = [trip_plan[r] for r in roles]
+            # Only push an update when the best plan so far actually changed
+            if selection != request.get("last_selection"):
+                request["last_selection"] = selection
+                logger.info("Sending progressive trip plan to requester")
+                await self._send_plan(request, trip_plan)
+
+    async def _complete_trip(self, trip_id, request):
+        """Send the final plan of a trip, or report a finished leg to its itinerary"""
+        request["status"] = "completed"
+        if request.get("itinerary"):
+            logger.info(f"Leg {trip_id} planned")
+            await self._leg_completed(request["itinerary"])
+            return
+        if request.get("batch"):
+            await self._batch_trip_completed(request["batch"])
+            return
+        self._release_admission(request)
+        logger.info("Options of every role received, creating trip plan")
+        trip_plan = self._create_trip_plan(trip_id)
+        logger.info("Sending final trip plan to requester")
+        await self._send_plan(request, trip_plan)
+        self._journal("plan_sent", trip_id)
+        logger.info("Final trip plan sent")
+
+    async def _send_to_provider(self, role, performative, content, conversation_id):
+        """Send a message to the provider of a role"""
+        await self.send_message(MCPMessage(
+            performative=performative,
+            content=json.dumps(content),
+            sender=self.agent_id,
+            receiver=self._provider_id(role),
+            conversation_id=conversation_id
+        ))
+
+    async def _start_booking(self, message, content):
+        """Hold the selected options with every provider; the bookings are confirmed once all holds succeed"""
+        trip_id = content.get("trip_id")
+        request = self.trip_requests.get(trip_id)
+        if request is None or request["status"] not in ("completed", "booking", "booked"):
+            response = message.create_reply(
+                MCPPerformatives.FAILURE,
+                json.dumps({"status": "error", "trip_id": trip_id, "message": "No trip plan to book"})
+            )
+            await self.send_message(response)
+            return
         
+        if "legs" in request or "trips" in request:
+            response = message.create_reply(
+                MCPPerformatives.FAILURE,
+                json.dumps({"status": "error", "trip_id": trip_id,
+                            "message": "Book each leg of an itinerary or trip of a batch by its own trip_id"})
+            )
+            await self.send_message(response)
+            return
+        
+        quantity = content.get("quantity", 1)
+        if type(quantity) is not int or quantity < 1:
+            response = message.create_reply(
+                MCPPerformatives.FAILURE,
+                json.dumps({"status": "error", "trip_id": trip_id, "message": f"Invalid quantity {quantity!r}"})
+            )
+            await self.send_message(response)
+            return
+        
+        if request["status"] == "booked":
+            # Retried book request: send the outcome again
+            await self._send_booking_result(trip_id, request)
+            return
+        if request["status"] == "booking":
+            # The outcome of the attempt in progress goes to its requester, within hold_ttl at the latest
+            response = message.create_reply(
+                MCPPerformatives.CONFIRM,
+                json.dumps({
+                    "status": "booking_in_progress",
+                    "trip_id": trip_id,
+                    "message": f"Your trip to {request['destination']} is already being booked"
+                })
+            )
+            await self.send_message(response)
+            return
+        
+        # Book the options of the final plan unless the client picked others, with every provider that takes bookings
+        plan = self._create_trip_plan(trip_id)
+        selections = {}
+        for role in self._roles(request):
+            if not self.provider_capabilities.get(role, {}).get("booking"):
+                continue
+            option_id = content.get(f"{role}_option_id")
+            if option_id is None:
+                selections[role] = plan[role]
+                continue
+            selected = next((o for o in request.get(f"{role}_options", []) if o.get("id") == option_id), None)
+            if selected is None:
+                response = message.create_reply(
+                    MCPPerformatives.FAILURE,
+                    json.dumps({"status": "error", "trip_id": trip_id, "message": f"Unknown {role} option {option_id}"})
+                )
+                await self.send_message(response)
+                return
+            selections[role] = selected
+        
+        request["status"] = "booking"
+        request["booking"] = booking = {
+            "status": "holding",
+            "id": self.id_factory(),  # Conversation of this booking attempt with the providers
+            "requester": message.sender,
+            "conversation_id": message.conversation_id,
+            "roles": {role: {"option": option} for role, option in selections.items()}
+        }
+        
+        response = message.create_reply(
+            MCPPerformatives.CONFIRM,
+            json.dumps({
+                "status": "booking_started",
+                "trip_id": trip_id,
+                "message": f"Booking your trip to {request['destination']}"
+            })
+        )
+        await self.send_message(response)
+        
+        for role, state in booking["roles"].items():
+            await self._send_to_provider(role, MCPPerformatives.ACCEPT_PROPOSAL, {
+                "trip_id": trip_id,
+                "destination": request["destination"],
+                "dates": request["dates"],
+                "selected_option": state["option"],
+                "quantity": quantity,
+                # Lets the provider recognise a retried hold for the same attempt
+                "hold_key": f"{booking['id']}:{role}"
+            }, booking["id"])
+        asyncio.create_task(self._expire_booking(trip_id, booking["id"]))
+
+    async def _expire_booking(self, trip_id, booking_id):
+        """Fail a booking attempt that is still holding or confirming once the hold TTL has passed"""
+        await asyncio.sleep(INVENTORY["hold_ttl"])
+        request = self.trip_requests.get(trip_id)
+        booking = request.get("booking") if request else None
+        if booking is not None and booking["id"] == booking_id and booking["status"] in ("holding", "confirming"):
+            await self._fail_booking(trip_id, request, "Timed out waiting for the providers")
+
+    async def _handle_booking_reply(self, message, content):
+        """Advance a booking on a provider's hold, booking or cancel reply"""
+        kind = content.get("type")
+        if kind not in ("hold", "booking", "cancel"):
+            return
+        role = self._role_of(message.sender)
+        trip_id = content.get("trip_id")
+        request = self.trip_requests.get(trip_id)
+        booking = request.get("booking") if request else None
+        status = content.get("status")
+        if kind == "cancel" or role is None:
+            logger.info(f"Booking cancel reply for trip {trip_id} from {message.sender}: {status}")
+            return
+        
+        if booking is None or message.conversation_id != booking["id"] or booking["status"] in ("failed", "cancelled"):
+            # Reply to an abandoned booking attempt; give back whatever it holds
+            if status in ("held", "booked"):
+                stale = {"hold_id": content.get("hold_id"), "booking_id": content.get("booking_id")}
+                await self._release_booking_role(trip_id, role, stale, message.conversation_id)
+            return
+        
+        state = booking["roles"].get(role)
+        if state is None:
+            return
+        if status not in ("held", "booked"):
+            await self._fail_booking(trip_id, request, f"{role}: {content.get('message', status)}")
+            return
+        
+        state["hold_id"] = content.get("hold_id")
+        if kind == "booking" or content.get("booking_id"):
+            state["booking_id"] = content.get("booking_id")
+        
+        roles = booking["roles"].values()
+        if booking["status"] == "holding" and all(s.get("hold_id") for s in roles):
+            # Every provider holds its part: confirm them all
+            booking["status"] = "confirming"
+            for r, s in booking["roles"].items():
+                await self._send_to_provider(r, MCPPerformatives.CONFIRM, {
+                    "type": "booking",
+                    "trip_id": trip_id,
+                    "hold_id": s["hold_id"]
+                }, booking["id"])
+        elif booking["status"] == "confirming" and all(s.get("booking_id") for s in roles):
+            booking["status"] = "booked"
+            request["status"] = "booked"
+            logger.info(f"Trip {trip_id} booked")
+            await self._send_booking_result(trip_id, request)
+
+    async def _release_booking_role(self, trip_id, role, state, conversation_id):
+        """Cancel the hold or booking a provider has for one role of a trip"""
+        reference = {"booking_id": state["booking_id"]} if state.get("booking_id") else {"hold_id": state.get("hold_id")}
+        if not any(reference.values()):
+            return
+        await self._send_to_provider(role, MCPPerformatives.CANCEL, {"trip_id": trip_id, **reference}, conversation_id)
+        state.pop("hold_id", None)
+        state.pop("booking_id", None)
+
+    async def _fail_booking(self, trip_id, request, reason):
+        """Give back every hold of a booking attempt and report the failure"""
+        logger.warning(f"Booking of trip {trip_id} failed: {reason}")
+        booking = request["booking"]
+        booking["status"] = "failed"
+        booking["message"] = reason
+        request["status"] = "completed"
+        for role, state in booking["roles"].items():
+            await self._release_booking_role(trip_id, role, state, booking["id"])
+        await self._send_booking_result(trip_id, request)
+
+    async def _cancel_booking(self, message, content):
+        """Cancel a trip's bookings (or pending holds) with every provider"""
+        trip_id = content.get("trip_id")
+        request = self.trip_requests.get(trip_id)
+        booking = request.get("booking") if request else None
+        if booking is None or booking["status"] == "failed":
+            response = message.create_reply(
+                MCPPerformatives.FAILURE,
+                json.dumps({"status": "error", "trip_id": trip_id, "message": "No booking to cancel"})
+            )
+            await self.send_message(response)
+            return
+        
+        # Cancelling twice is harmless: the second time there is nothing left to release
+        booking["status"] = "cancelled"
+        request["status"] = "completed"
+        for role, state in booking["roles"].items():
+            await self._release_booking_role(trip_id, role, state, booking["id"])
+        response = message.create_reply(
+            MCPPerformatives.CONFIRM,
+            json.dumps({"status": "cancelled", "trip_id": trip_id, "message": f"Booking of trip {trip_id} cancelled"})
+        )
+        await self.send_message(response)
+
+    async def _send_booking_result(self, trip_id, request):
+        """Tell the requester how a booking attempt ended"""
+        booking = request["booking"]
+        result = {
+            "type": "booking",
+            "trip_id": trip_id,
+            "status": booking["status"],
+            "bookings": {role: state.get("booking_id") for role, state in booking["roles"].items()}
+        }
+        if booking.get("message"):
+            result["message"] = booking["message"]
+        await self.send_message(MCPMessage(
+            performative=MCPPerformatives.INFORM,
+            content=json.dumps(result),
+            sender=self.agent_id,
+            receiver=booking["requester"],
+            conversation_id=booking["conversation_id"],
+            id_factory=self.id_factory
+        ))
+
+    async def _send_plan(self, request, trip_plan):
+        """Send a (partial or final) trip plan to the requester"""
+        plan_message = MCPMessage(
+            performative=MCPPerformatives.INFORM,
+            content=json.dumps(trip_plan),
+            sender=self.agent_id,
+            receiver=request.get("requester"),
+            conversation_id=request.get("conversation_id"),
+            id_factory=self.id_factory
+        )
+        await self.send_message(plan_message)
+
+    def _create_trip_plan(self, trip_id, final=True):
+        """Create a comprehensive trip plan from available options (best so far unless final)"""
+        logger.info(f"Creating trip plan for {trip_id}")
+        request = self.trip_requests[trip_id]
+        roles = self._roles(request)
         plan = {
             "trip_id": trip_id,
             "destination": request["destination"],
             "dates": request["dates"],
-            "travel": selected_travel,
-            "hotel": selected_hotel,
-            "status": "planned"
+            "roles": roles
         }
+        # One option per role, picked the way its provider advertised
+        for role in roles:
+            options = request.get(f"{role}_options", [])
+            if options:
+                capabilities = self.provider_capabilities.get(role, {})
+                selector = OPTION_SELECTORS.get(capabilities.get("select"), OPTION_SELECTORS["first"])
+                plan[role] = selector(options, capabilities)
+            else:
+                plan[role] = {"status": f"No {role} options available"}
+        plan["status"] = "planned" if final else "partial"
+        plan["final"] = final
         logger.info(f"Trip plan created: {json.dumps(plan, indent=2)}")
         return plan
\ No newline at end of file
@@ -0,0 +1,158 @@
+import zmq.asyncio
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hash ring with virtual nodes; adding a node moves ~1/N of the keys"""
+
+    def __init__(self, virtual_nodes=64):
+        self.virtual_nodes = virtual_nodes
+        self._points = []  # Sorted hash points
+        self._owners = []  # Node owning each point
+
+    def add(self, node):
+        for i in range(self.virtual_nodes):
+            point = _hash(f"{node}#{i}")
+            index = bisect.bisect(self._points, point)
+            self._points.insert(index, point)
+            self._owners.insert(index, node)
+
+    def remove(self, node):
+        kept = [(point, owner) for point, owner in zip(self._points, self._owners) if owner != node]
+        self._points = [point for point, _ in kept]
+        self._owners = [owner for _, owner in kept]
+
+    def lookup(self, key):
+        if not self._points:
+            raise LookupError("Hash ring is empty")
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._owners[index]
+
+
+class PlannerRouter:
+    """
+    Thin front router for sharded planners.
+
+    Clients talk to the router exactly as they would to a single planner.
+    Each message is relayed, with the client's identity frame kept in the
+    envelope, to the shard that owns its trip_id (or the client identity)
+    on a consistent hash ring; ids of itinerary legs and batch trips are
+    routed by their parent's id. Shard replies travel back the same way.
+    Every shard is a regular PlannerAgent with its own providers.
+
+    Keys seen recently stay pinned to the shard that first got them, so
+    when shards are added only new keys rebalance onto them and in-flight
+    trips drain where their state lives.
+    """
+
+    def __init__(self, endpoint, shard_key="trip_id", virtual_nodes=64, sticky_keys=100000):
+        self.endpoint = endpoint
+        self.shard_key = shard_key
+        self.context = zmq.asyncio.Context()
+        self.frontend = self.context.socket(zmq.ROUTER)
+        self.ring = HashRing(virtual_nodes)
+        self.shards = {}  # shard_id -> DEALER socket connected to the shard
+        self.sticky_keys = sticky_keys
+        self.assignments = OrderedDict()  # Recently routed key -> shard_id (LRU)
+        self._tasks = {}
+        self.running = False
+
+    async def start(self):
+        """Bind the client-facing socket and start relaying"""
+        logger.info(f"Planner router binding to {self.endpoint}")
+        self.frontend.bind(self.endpoint)
+        self.running = True
+        self._tasks["frontend"] = asyncio.create_task(self._relay_requests())
+
+    def add_shard(self, shard_id, endpoint):
+        """Connect a planner shard and give it its share of the hash ring"""
+        backend = self.context.socket(zmq.DEALER)
+        backend.setsockopt_string(zmq.IDENTITY, f"router-{shard_id}")
+        backend.connect(endpoint)
+        self.shards[shard_id] = backend
+        self.ring.add(shard_id)
+        self._tasks[shard_id] = asyncio.create_task(self._relay_replies(backend))
+        logger.info(f"Planner router added shard {shard_id} at {endpoint}")
+
+    def remove_shard(self, shard_id):
+        """Stop routing new work to a shard; its keys move to the remaining shards"""
+        self.ring.remove(shard_id)
+        self.assignments = OrderedDict(
+            (key, owner) for key, owner in self.assignments.items() if owner != shard_id
+        )
+        self._tasks.pop(shard_id).cancel()
+        self.shards.pop(shard_id).close(linger=0)
+        logger.info(f"Planner router removed shard {shard_id}")
+
+    def _routing_key(self, frames):
+        """trip_id from the message content, falling back to the client identity"""
+        if self.shard_key == "trip_id":
+            try:
+                content = json.loads(json.loads(frames[2])["content"])
+                trip_id = content.get("trip_id")
+                if trip_id:
+                    # Itinerary legs and batch trips ("<parent>.leg0", "<batch_id>.<trip_id>")
+                    # live on the shard of their parent
+                    return str(trip_id).split(".", 1)[0]
+            except (ValueError, KeyError, TypeError, AttributeError):
+                pass
+        return frames[0].hex()
+
+    def _shard_for(self, key):
+        shard_id = self.assignments.get(key)
+        if shard_id is None:
+            shard_id = self.ring.lookup(key)
+            self.assignments[key] = shard_id
+            if len(self.assignments) > self.sticky_keys:
+                self.assignments.popitem(last=False)
+        else:
+            self.assignments.move_to_end(key)
+        return shard_id
+
+    async def _relay_requests(self):
+        while self.running:
+            try:
+                # [client identity, empty, envelope, payload...]
+                frames = await self.frontend.recv_multipart()
+                if len(frames) < 3:
+                    logger.error("Planner router received invalid message format")
+                    continue
+                shard_id = self._shard_for(self._routing_key(frames))
+                await self.shards[shard_id].send_multipart(frames)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Planner router error relaying request: {str(e)}")
+
+    async def _relay_replies(self, backend):
+        while self.running:
+            try:
+                # The shard addressed [client identity, empty, ...]; hand it back to the client
+                frames = await backend.recv_multipart()
+                await self.frontend.send_multipart(frames)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Planner router error relaying reply: {str(e)}")
+
+    async def stop(self):
+        """Stop relaying and close all sockets"""
+        self.running = False
+        for task in self._tasks.values():
+            task.cancel()
+        for backend in self.shards.values():
+            backend.close(linger=0)
+        self.frontend.close(linger=0)
+        self.context.term()
+        logger.info("Planner router stopped")
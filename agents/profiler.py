@@ -0,0 +1,87 @@
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+
+def _frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Time-boxed sampling profiler for one thread (normally the event loop's).
+
+    A daemon thread looks at the target thread's current stack every
+    ``interval`` seconds for ``duration`` seconds, counts identical stacks
+    and writes them in collapsed format ("root;caller;callee count" lines,
+    as read by flamegraph.pl and speedscope). Nothing runs when no profile
+    is being taken; while one is, the loop only pays for the GIL hand-offs.
+    """
+
+    def __init__(self, thread_id, path, duration, interval=0.005):
+        self.thread_id = thread_id
+        self.path = path
+        self.duration = duration
+        self.interval = interval
+        self.samples = 0
+        self._stacks = Counter()
+        self._labels = {}  # code object -> label, so each function is formatted once
+        self._thread = None
+
+    def start(self, on_done=None):
+        """Start sampling; on_done(profiler, error) is called from the sampler thread when finished"""
+        self._thread = threading.Thread(target=self._run, args=(on_done,), name="profiler", daemon=True)
+        self._thread.start()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _sample(self):
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+        labels = self._labels
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            label = labels.get(code)
+            if label is None:
+                label = labels[code] = _frame_label(code)
+            stack.append(label)
+            frame = frame.f_back
+        stack.reverse()
+        self._stacks[";".join(stack)] += 1
+        self.samples += 1
+
+    def _run(self, on_done):
+        error = None
+        try:
+            deadline = time.monotonic() + self.duration
+            next_sample = time.monotonic()
+            while next_sample < deadline:
+                self._sample()
+                next_sample += self.interval
+                delay = next_sample - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+            self._write()
+        except Exception as e:
+            error = e
+            logger.error(f"Profiling failed: {str(e)}")
+        if on_done:
+            on_done(self, error)
+
+    def _write(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "w") as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        logger.info(f"Wrote {self.samples} samples to {self.path}")
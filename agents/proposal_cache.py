@@ -0,0 +1,41 @@
+import json
+import time
+from collections import OrderedDict
+
+
+class ProposalCache:
+    """
+    Recently completed proposals by (role, destination, dates), so a leg
+    that was just planned (e.g. the same city and dates in another
+    itinerary) is answered without a CFP. Entries live for ``ttl`` seconds
+    and at most ``max_entries`` are kept, least recently used evicted first.
+    """
+
+    def __init__(self, ttl=60.0, max_entries=1024, clock=time.monotonic):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()  # key -> (expires_at, options)
+
+    @staticmethod
+    def key(role, destination, dates):
+        return role, destination, json.dumps(dates, sort_keys=True)
+
+    def get(self, role, destination, dates):
+        """Cached options, or None if missing or expired"""
+        key = self.key(role, destination, dates)
+        cached = self._entries.get(key)
+        if cached is None:
+            return None
+        if cached[0] <= self.clock():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return cached[1]
+
+    def put(self, role, destination, dates, options):
+        key = self.key(role, destination, dates)
+        self._entries[key] = (self.clock() + self.ttl, options)
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
@@ -0,0 +1,94 @@
+from array import array
+from collections import OrderedDict
+from datetime import date
+from functools import lru_cache
+
+
+@lru_cache(maxsize=4096)
+def date_ordinal(value):
+    """Proleptic Gregorian ordinal of a YYYY-MM-DD string (cached, raises ValueError if invalid)"""
+    return date.fromisoformat(value).toordinal()
+
+
+class RateTable:
+    """
+    Nightly rates for all properties of one destination.
+
+    Each property with a ``nightly_rates`` calendar ({"start": "YYYY-MM-DD",
+    "rates": [...]}) gets a row of prefix sums over a window shared by the
+    whole destination, all stored in one flat array; nights outside a
+    property's calendar cost its ``price_per_night``. The price of any stay
+    is then a constant-time lookup, and ``totals`` prices a stay for every
+    property in a single pass.
+    """
+
+    def __init__(self, entries):
+        self.base = array("q", (entry["price_per_night"] for entry in entries))
+        calendars = [entry.get("nightly_rates") for entry in entries]
+
+        spans = [(date_ordinal(c["start"]), len(c["rates"])) for c in calendars if c]
+        self.start = min((start for start, _ in spans), default=0)
+        self.days = max((start + length for start, length in spans), default=0) - self.start
+        self.width = self.days + 1
+
+        # Row offsets into the prefix array; -1 marks flat-rate properties
+        self.rows = array("q")
+        self.prefix = array("q")
+        for base, calendar in zip(self.base, calendars):
+            if not calendar:
+                self.rows.append(-1)
+                continue
+            nightly = [base] * self.days
+            offset = date_ordinal(calendar["start"]) - self.start
+            nightly[offset:offset + len(calendar["rates"])] = calendar["rates"]
+
+            self.rows.append(len(self.prefix))
+            running = 0
+            self.prefix.append(0)
+            for rate in nightly:
+                running += rate
+                self.prefix.append(running)
+
+    def _window(self, check_in, check_out):
+        """Clamp a stay (ordinals) to the calendar window; returns (i, j, nights outside it)"""
+        i = min(max(check_in - self.start, 0), self.days)
+        j = min(max(check_out - self.start, 0), self.days)
+        return i, j, (check_out - check_in) - (j - i)
+
+    def total(self, index, check_in, check_out):
+        """Total price of a stay for one property"""
+        row = self.rows[index]
+        if row < 0:
+            return self.base[index] * (check_out - check_in)
+        i, j, outside = self._window(check_in, check_out)
+        return self.prefix[row + j] - self.prefix[row + i] + self.base[index] * outside
+
+    def totals(self, check_in, check_out):
+        """Total price of a stay for every property, in catalog order"""
+        nights = check_out - check_in
+        i, j, outside = self._window(check_in, check_out)
+        prefix = self.prefix
+        return [
+            base * nights if row < 0 else prefix[row + j] - prefix[row + i] + base * outside
+            for base, row in zip(self.base, self.rows)
+        ]
+
+
+class RateTableCache:
+    """
+    Rate tables of the ``max_size`` most recently used destinations (like
+    Catalog's parsed entries), rebuilt whenever a catalog hands out new entries
+    """
+
+    def __init__(self, max_size=256):
+        self.max_size = max_size
+        self._tables = OrderedDict()  # destination -> (entries the table was built from, RateTable)
+
+    def get(self, destination, entries):
+        cached = self._tables.get(destination)
+        if cached is None or cached[0] is not entries:
+            cached = self._tables[destination] = (entries, RateTable(entries))
+            if len(self._tables) > self.max_size:
+                self._tables.popitem(last=False)
+        self._tables.move_to_end(destination)
+        return cached[1]
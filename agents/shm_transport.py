@@ -0,0 +1,177 @@
+import logging
+import secrets
+import struct
+import time
+from collections import deque
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+logger = logging.getLogger(__name__)
+
+# content_encoding of messages whose content is in the sender's arena
+SHM_ENCODING = "shm"
+
+# Block header: content length, generation (0 = invalid), outstanding references
+_BLOCK_HEADER = struct.Struct("<QIi")
+# Handle frame: offset, length, generation, followed by the arena name
+_HANDLE = struct.Struct("<QQI")
+_ALIGN = 8
+# Names of arenas; other shared memory segments on the host are never attached
+_NAME_PREFIX = "mcp_"
+
+# Arenas created by this process (all agents may share one process, as with main.py)
+_OWNED = set()
+
+
+class _Block:
+    __slots__ = ("offset", "size", "generation", "deadline")
+
+    def __init__(self, offset, size, generation, deadline):
+        self.offset = offset
+        self.size = size
+        self.generation = generation
+        self.deadline = deadline
+
+
+class SharedArena:
+    """
+    Ring of blocks in a shared memory segment, written by the agent that
+    owns it and read by agents on the same host.
+
+    ``put`` copies a payload into the next free block and returns a small
+    handle to send instead of the payload; the block starts with one
+    reference, which the receiver drops once it has read it (``ArenaReader``).
+    Blocks are recycled in the order they were written, as soon as the
+    oldest ones are released, or after ``lease`` seconds if a receiver
+    never releases them. ``put`` returns None when the payload doesn't fit,
+    so the caller can send it over the socket instead.
+    """
+
+    def __init__(self, size, lease=30.0, clock=time.monotonic):
+        self.shm = SharedMemory(name=f"{_NAME_PREFIX}{secrets.token_hex(6)}", create=True, size=size)
+        self.name = self.shm.name
+        _OWNED.add(self.name)
+        self.capacity = self.shm.size
+        self.lease = lease
+        self.clock = clock
+        self._blocks = deque()  # Live blocks, oldest first
+        self._head = 0  # Where the next block goes
+        self._generation = 0
+
+    def _reclaim(self):
+        """Recycle the oldest blocks that were released or whose lease ran out"""
+        buf = self.shm.buf
+        now = self.clock()
+        while self._blocks:
+            block = self._blocks[0]
+            _, _, refs = _BLOCK_HEADER.unpack_from(buf, block.offset)
+            if refs > 0 and now < block.deadline:
+                break
+            if refs > 0:
+                logger.warning(f"Reclaiming unreleased block at {block.offset} of arena {self.name}")
+                # A late reader sees the generation change and rejects the block
+                _BLOCK_HEADER.pack_into(buf, block.offset, 0, 0, 0)
+            self._blocks.popleft()
+        if not self._blocks:
+            self._head = 0
+
+    def _allocate(self, size):
+        """Offset of a free run of size bytes, or None if the ring is too full"""
+        self._reclaim()
+        if not self._blocks:
+            return 0 if size <= self.capacity else None
+        tail = self._blocks[0].offset
+        if self._head > tail:
+            # Free space is [head, end) and [0, tail)
+            if self._head + size <= self.capacity:
+                return self._head
+            return 0 if size < tail else None
+        # Free space is [head, tail)
+        return self._head if self._head + size < tail else None
+
+    def put(self, payload):
+        """Copy payload (bytes) into the arena; returns the handle frame, or None if it doesn't fit"""
+        length = len(payload)
+        size = -(-(_BLOCK_HEADER.size + length) // _ALIGN) * _ALIGN
+        offset = self._allocate(size)
+        if offset is None:
+            return None
+        self._generation = self._generation % 0xFFFFFFFF + 1
+        buf = self.shm.buf
+        start = offset + _BLOCK_HEADER.size
+        buf[start:start + length] = payload
+        _BLOCK_HEADER.pack_into(buf, offset, length, self._generation, 1)
+        self._blocks.append(_Block(offset, size, self._generation, self.clock() + self.lease))
+        self._head = offset + size
+        return _HANDLE.pack(offset, length, self._generation) + self.name.encode()
+
+    def close(self):
+        """Release and remove the segment (readers that still have it attached keep their mapping)"""
+        self._blocks.clear()
+        _OWNED.discard(self.name)
+        self.shm.close()
+        try:
+            self.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+class ArenaReader:
+    """The arenas of other agents this agent reads from, attached once by name at handshake"""
+
+    def __init__(self):
+        self._arenas = {}  # name -> SharedMemory
+
+    def attach(self, name):
+        """Attach an arena; returns False if it can't be (another host or IPC namespace)"""
+        if name in self._arenas:
+            return True
+        if not name.startswith(_NAME_PREFIX):
+            logger.warning(f"Not attaching {name}: not a shared memory arena")
+            return False
+        try:
+            shm = SharedMemory(name=name)
+        except (FileNotFoundError, OSError, ValueError) as e:
+            logger.info(f"Cannot attach shared memory arena {name}: {str(e)}")
+            return False
+        if name not in _OWNED:
+            # The owner unlinks the segment; don't let this process's resource tracker do it too
+            resource_tracker.unregister(shm._name, "shared_memory")
+        self._arenas[name] = shm
+        return True
+
+    def read(self, handle, name):
+        """
+        Content (str) of a block in the arena ``name`` (the one its sender
+        offered at handshake), dropping the reference the sender gave us
+        """
+        if len(handle) < _HANDLE.size:
+            raise ValueError("Truncated shared memory handle")
+        offset, length, generation = _HANDLE.unpack_from(handle)
+        if bytes(handle[_HANDLE.size:]).decode(errors="replace") != name:
+            raise ValueError(f"Shared memory handle is not for the sender's arena {name}")
+        shm = self._arenas.get(name)
+        if shm is None:
+            raise ValueError(f"Shared memory arena {name} is not attached")
+        if offset % _ALIGN or offset + _BLOCK_HEADER.size + length > shm.size:
+            raise ValueError(f"Block at {offset} of length {length} is outside arena {name}")
+        buf = shm.buf
+        stored_length, stored_generation, refs = _BLOCK_HEADER.unpack_from(buf, offset)
+        if stored_generation != generation or stored_length != length:
+            raise ValueError(f"Block at {offset} of arena {name} was recycled before it was read")
+        start = offset + _BLOCK_HEADER.size
+        view = buf[start:start + length]
+        try:
+            # Decoded straight out of shared memory, without an intermediate bytes copy
+            content = str(view, "utf-8")
+        finally:
+            view.release()
+        if _BLOCK_HEADER.unpack_from(buf, offset)[1] != generation:
+            raise ValueError(f"Block at {offset} of arena {name} was recycled while it was read")
+        _BLOCK_HEADER.pack_into(buf, offset, length, generation, refs - 1)
+        return content
+
+    def close(self):
+        for shm in self._arenas.values():
+            shm.close()
+        self._arenas.clear()
@@ -1,54 +1,84 @@
 from .base_agent import BaseAgent
-from .mcp_message import MCPMessage, MCPPerformatives
+from .mcp_message import MCPPerformatives
+from .catalog import Catalog, CatalogOverlay, freeze
+from .catalog_replication import CatalogPublisher
+from .inventory import InventoryLedger
+from config import CATALOGS, CATALOG_REPLICATION, INVENTORY
+import asyncio
 import logging
 import json
-import random
 from datetime import datetime, timedelta
 
 logger = logging.getLogger(__name__)
 
+# Catalog fields used for booking that are not sent to the planner
+INTERNAL_FIELDS = ("seats",)
+
+# Returned when the catalog has nothing for a destination
+DEFAULT_TRAVEL_OPTION = freeze({
+    "type": "flight",
+    "airline": "Default Airlines",
+    "departure": "09:00",
+    "arrival": "11:00",
+    "price": 4000,
+    "class": "economy",
+    "note": "Generic option for unspecified destination"
+})
+
+
+def build_travel_options(entries, dates):
+    """Date-stamp travel catalog entries for a trip"""
+    if not dates:
+        # Default to next day if no dates provided
+        tomorrow = datetime.now() + timedelta(days=1)
+        dates = {
+            "departure": tomorrow.strftime("%Y-%m-%d"),
+            "return": (tomorrow + timedelta(days=7)).strftime("%Y-%m-%d")
+        }
+    
+    # Catalog entries are shared and immutable, so per-request data goes in overlays
+    return [CatalogOverlay(entry, hidden=INTERNAL_FIELDS, dates=dates) for entry in entries]
+
 class TravelAgent(BaseAgent):
-    def __init__(self, agent_id, endpoint):
+    role = "travel"
+
+    def __init__(self, agent_id, endpoint, catalog_path=None, publish_catalog=None):
         super().__init__(agent_id, endpoint)
-        self.travel_options = {
-            "Goa": [
-                {
-                    "type": "flight",
-                    "airline": "Air India",
-                    "price": 5000,
-                    "duration": "2h 30m"
-                },
-                {
-                    "type": "train",
-                    "name": "Goa Express",
-                    "price": 2000,
-                    "duration": "12h"
-                }
-            ],
-            "Mumbai": [
-                {
-                    "type": "flight",
-                    "airline": "IndiGo",
-                    "price": 4000,
-                    "duration": "2h"
-                },
-                {
-                    "type": "train",
-                    "name": "Rajdhani Express",
-                    "price": 1500,
-                    "duration": "8h"
-                }
-            ]
-        }
+        self.catalog = Catalog(catalog_path or CATALOGS["travel"], cache_size=CATALOGS["cache_size"])
+        self._catalog_watch_task = None
+        # Publish the catalog for planner-side replicas (one provider per role should)
+        self.publish_catalog = CATALOG_REPLICATION["enabled"] if publish_catalog is None else publish_catalog
+        self.catalog_publisher = None
+        self.inventory = InventoryLedger("TRAVEL", hold_ttl=INVENTORY["hold_ttl"])
         logger.info("TravelAgent initialized")
 
     async def start(self):
         """Start the agent and notify the planner"""
-        await super().start()
         logger.info("Travel Agent : Starting")
-        # Perform handshake with planner
-        await self.perform_handshake("planner")
+        # BaseAgent.start performs the handshake with the planner
+        await super().start()
         logger.info("Travel Agent : Handshake initiated with planner")
+        if CATALOGS["reload_interval"]:
+            self._catalog_watch_task = asyncio.create_task(self.catalog.watch(CATALOGS["reload_interval"]))
+        if self.publish_catalog:
+            self.catalog_publisher = CatalogPublisher(
+                self.context,
+                CATALOG_REPLICATION["endpoints"]["travel"],
+                "travel",
+                self.catalog,
+                snapshot_interval=CATALOG_REPLICATION["snapshot_interval"],
+                heartbeat_interval=CATALOG_REPLICATION["heartbeat_interval"]
+            )
+            self.catalog_publisher.start()
+
+    async def stop(self):
+        """Stop the agent and release the catalog"""
+        if self._catalog_watch_task:
+            self._catalog_watch_task.cancel()
+        if self.catalog_publisher:
+            self.catalog_publisher.stop()
+        await super().stop()
+        self.catalog.close()
 
     async def handle_message(self, message):
         """Handle incoming MCP messages"""
@@ -63,7 +93,19 @@ class TravelAgent(BaseAgent):
                 if await self.handle_connection_message(message):
                     return
                 
-            if message.performative == MCPPerformatives.CFP:
+            # On-demand profiling and conversation history of this agent
+            if message.performative == MCPPerformatives.QUERY and content.get("type") == "profile":
+                await self.handle_profile_request(message, content)
+                return
+            if message.performative == MCPPerformatives.QUERY and content.get("type") == "history":
+                await self.handle_history_request(message, content)
+                return
+                
+            if message.performative == MCPPerformatives.CFP and "batch" in content:
+                logger.info(f"Processing batched travel request for {len(content['batch'])} trips")
+                await self.send_batch_proposal(message, content["batch"], self._get_travel_options_for)
+                
+            elif message.performative == MCPPerformatives.CFP:
                 trip_id = content.get("trip_id")
                 destination = content.get("destination")
                 dates = content.get("dates", {})
@@ -73,39 +115,16 @@ class TravelAgent(BaseAgent):
                 # Get travel options for the destination
                 options = self._get_travel_options(destination, dates)
                 
-                # Create response
-                response = MCPMessage(
-                    performative=MCPPerformatives.PROPOSE,
-                    content=json.dumps({
-                        "trip_id": trip_id,
-                        "options": options
-                    }),
-                    sender=self.agent_id,
-                    receiver=message.sender
-                )
-                
                 logger.info("Sending travel options")
-                await self.send_message(response)
+                await self.send_proposal(message, content, options)
                 logger.info("Travel options sent")
                 
-            elif message.performative == MCPPerformatives.ACCEPT_PROPOSAL:
-                trip_id = content.get("trip_id")
-                selected_option = content.get("selected_option")
+            elif message.performative == MCPPerformatives.QUERY and content.get("type") == "catalog_snapshot":
+                # A planner replica joined late or missed an update
+                await self.handle_catalog_snapshot_request(message, self.catalog, self.catalog_publisher)
                 
-                # Confirm the booking
-                response = MCPMessage(
-                    performative=MCPPerformatives.CONFIRM,
-                    content=json.dumps({
-                        "trip_id": trip_id,
-                        "status": "booked",
-                        "booking_id": f"TRAVEL-{random.randint(1000, 9999)}",
-                        "selected_option": selected_option,
-                        "message": "Travel booking confirmed"
-                    }),
-                    sender=self.agent_id,
-                    receiver=message.sender
-                )
-                await self.send_message(response)
+            elif await self.handle_booking_message(message, content, self.inventory, self._booking_units):
+                logger.info(f"Handled {message.performative} booking message for trip {content.get('trip_id')}")
                 
         except json.JSONDecodeError:
             logger.error("Invalid JSON in message content")
@@ -117,30 +136,32 @@ class TravelAgent(BaseAgent):
 
     def _get_travel_options(self, destination, dates):
         """Get travel options for the given destination and dates"""
-        options = self.travel_options.get(destination, [])
+        return self._get_travel_options_for(destination, [{"dates": dates}])[0]
+
+    def _get_travel_options_for(self, destination, queries):
+        """Travel options of several trips to one destination, sharing the catalog lookup"""
+        options = self.catalog.get(destination)
         
         # If no specific options for destination, return default options
         if not options:
-            return [{
-                "type": "flight",
-                "airline": "Default Airlines",
-                "departure": "09:00",
-                "arrival": "11:00",
-                "price": 4000,
-                "class": "economy",
-                "note": "Generic option for unspecified destination"
-            }]
-        
-        # Add date information to options
-        for option in options:
-            if dates:
-                option["dates"] = dates
-            else:
-                # Default to next day if no dates provided
-                tomorrow = datetime.now() + timedelta(days=1)
-                option["dates"] = {
-                    "departure": tomorrow.strftime("%Y-%m-%d"),
-                    "return": (tomorrow + timedelta(days=7)).strftime("%Y-%m-%d")
-                }
+            return [[DEFAULT_TRAVEL_OPTION] for _ in queries]
         
-        return options
\ No newline at end of file
+        return [build_travel_options(options, query.get("dates", {})) for query in queries]
+
+    def provider_capabilities(self):
+        """Travel options are bookable seats"""
+        return {**super().provider_capabilities(), "batch": True, "booking": True, "price_field": "price"}
+
+    def _booking_units(self, content):
+        """Seat inventory keys (one per departure) and capacity of the option accepted in content"""
+        option_id = (content.get("selected_option") or {}).get("id")
+        entry = next((e for e in self.catalog.get(content.get("destination")) if e.get("id") == option_id), None)
+        if entry is None:
+            raise ValueError("Selected travel option is not bookable")
+        dates = content.get("dates") or {}
+        # Trips from the client carry check_in/check_out for the outbound and return legs
+        legs = [dates.get("departure", dates.get("check_in")), dates.get("return", dates.get("check_out"))]
+        keys = [(option_id, leg, day) for leg, day in zip(("outbound", "return"), legs) if day]
+        if not keys:
+            raise ValueError("Travel dates are required to book")
+        return keys, entry.get("seats", INVENTORY["default_seats"])
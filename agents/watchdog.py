@@ -0,0 +1,180 @@
+import asyncio
+import itertools
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Lag samples kept for percentiles (a minute's worth at the default interval)
+LAG_SAMPLES = 600
+
+# One watchdog per event loop, shared by the agents running on it (main.py runs several)
+_watchdogs = {}
+
+
+def watch_loop(agent_id, **settings):
+    """The running loop's watchdog (started on first use), with agent_id among the agents it watches"""
+    loop = asyncio.get_running_loop()
+    watchdog = _watchdogs.get(loop)
+    if watchdog is None:
+        watchdog = _watchdogs[loop] = LoopWatchdog(**settings)
+        watchdog.start()
+    watchdog.agents.add(agent_id)
+    return watchdog
+
+
+def unwatch_loop(watchdog, agent_id):
+    """Stop watching for an agent; the watchdog stops with the last agent on its loop"""
+    watchdog.agents.discard(agent_id)
+    if not watchdog.agents:
+        watchdog.stop()
+        if _watchdogs.get(watchdog.loop) is watchdog:
+            del _watchdogs[watchdog.loop]
+
+
+class LoopWatchdog:
+    """
+    Watches an event loop, and the agents running on it, for blocking code.
+
+    A task on the loop wakes up every ``interval`` seconds and records how
+    late it woke up (the loop's lag). A daemon thread checks that heartbeat:
+    once the loop has not run for ``lag_threshold`` seconds it captures the
+    loop thread's stack, which points at the code that is blocking, and
+    logs it with the message being handled. Handlers reported through
+    ``handler_started``/``handler_finished`` that take longer than
+    ``handler_budget`` are logged with their performative, conversation_id
+    and the stack of any stall that happened while they ran.
+    """
+
+    def __init__(self, interval=0.1, lag_threshold=0.25, handler_budget=0.5,
+                 report_interval=60.0, max_stack_depth=30):
+        self.agents = set()  # Agents on the loop, for log messages
+        self.interval = interval
+        self.lag_threshold = lag_threshold
+        self.handler_budget = handler_budget
+        self.report_interval = report_interval
+        self.max_stack_depth = max_stack_depth
+        self.max_lag = 0.0
+        self.stalls = 0
+        self.slow_handlers = 0
+        self._lags = deque(maxlen=LAG_SAMPLES)
+        self._heartbeat = time.monotonic()
+        self._stalled = False
+        self.loop = None
+        self._thread_id = None
+        self._active = {}  # token -> (agent_id, performative, conversation_id, sender, started, task)
+        self._stall_stacks = {}  # token -> stack captured while that handler was running
+        self._tokens = itertools.count(1)
+        self._task = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        """Start watching the running loop (call from the loop's thread)"""
+        self.loop = asyncio.get_running_loop()
+        self._thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._task = asyncio.create_task(self._beat())
+        self._thread = threading.Thread(target=self._watch, name="event-loop-watchdog", daemon=True)
+        self._thread.start()
+
+    @property
+    def name(self):
+        return ", ".join(sorted(self.agents)) or "agent"
+
+    def stop(self):
+        self._stop.set()
+        if self._task:
+            self._task.cancel()
+
+    async def _beat(self):
+        next_report = time.monotonic() + self.report_interval
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self._heartbeat = now
+            self._lags.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.lag_threshold:
+                logger.warning(f"{self.name} event loop was blocked for {lag * 1000:.0f} ms")
+            if self.report_interval and now >= next_report:
+                next_report = now + self.report_interval
+                stats = self.stats()
+                logger.info(f"{self.name} event loop lag p50 {stats['lag_p50_ms']} ms, p99 {stats['lag_p99_ms']} ms, "
+                            f"max {stats['lag_max_ms']} ms; {self.stalls} stalls, {self.slow_handlers} slow handlers")
+
+    def _watch(self):
+        """Watchdog thread: capture the loop's stack once per stall"""
+        while not self._stop.wait(self.interval):
+            blocked = time.monotonic() - self._heartbeat - self.interval
+            if blocked < self.lag_threshold:
+                self._stalled = False
+                continue
+            if self._stalled:
+                continue
+            self._stalled = True
+            self.stalls += 1
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                continue
+            stack = "".join(traceback.format_stack(frame, limit=self.max_stack_depth))
+            running = self._running_handler()
+            if running is not None:
+                token, (agent_id, performative, conversation_id, sender, _, _) = running
+                self._stall_stacks[token] = stack
+                if token not in self._active:
+                    self._stall_stacks.pop(token, None)  # Finished meanwhile; nobody would collect it
+                context = f" while {agent_id} handled {performative} from {sender} (conversation {conversation_id})"
+            else:
+                context = ""
+            logger.warning(f"{self.name} event loop blocked for {blocked * 1000:.0f} ms{context}, in:\n{stack}")
+
+    def _running_handler(self):
+        """(token, handler) of the handler whose task is running on the loop (read from the watchdog thread)"""
+        try:
+            task = asyncio.current_task(self.loop)
+            # One snapshot: the loop may finish the handler meanwhile
+            for token, handler in list(self._active.items()):
+                if handler[5] is task:
+                    return token, handler
+        except RuntimeError:
+            pass  # The active handlers changed while we looked
+        return None
+
+    def handler_started(self, agent_id, message):
+        """Start timing agent_id's handling of a message; returns the token for handler_finished"""
+        token = next(self._tokens)
+        self._active[token] = (agent_id, message.performative, message.conversation_id, message.sender,
+                               time.monotonic(), asyncio.current_task())
+        return token
+
+    def handler_finished(self, token):
+        agent_id, performative, conversation_id, sender, started, _ = self._active.pop(token)
+        stack = self._stall_stacks.pop(token, None)
+        elapsed = time.monotonic() - started
+        if elapsed < self.handler_budget:
+            return
+        self.slow_handlers += 1
+        blocked_in = f", blocked in:\n{stack}" if stack else " (no stall caught in this handler)"
+        logger.warning(f"{agent_id} handler for {performative} from {sender} (conversation {conversation_id}) "
+                       f"took {elapsed * 1000:.0f} ms, over its {self.handler_budget * 1000:.0f} ms budget{blocked_in}")
+
+    def stats(self):
+        lags = sorted(self._lags)
+
+        def percentile(fraction):
+            return round(lags[min(len(lags) - 1, int(len(lags) * fraction))] * 1000, 1) if lags else 0.0
+
+        return {
+            "lag_p50_ms": percentile(0.5),
+            "lag_p99_ms": percentile(0.99),
+            "lag_max_ms": round(self.max_lag * 1000, 1),
+            "stalls": self.stalls,
+            "slow_handlers": self.slow_handlers
+        }
@@ -1,10 +1,13 @@
 import asyncio
+import hashlib
 import zmq.asyncio
 import json
 import logging
+import random
 import uuid
 from agents.mcp_message import MCPMessage, MCPPerformatives
-from config import AGENT_ENDPOINTS
+from agents.compression import SUPPORTED_ENCODINGS, decompress_content
+from config import AGENT_ENDPOINTS, CLIENT_RETRIES
 
 # Configure logging
 logging.basicConfig(
@@ -13,8 +16,15 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+def _key_suffix(idempotency_key):
+    """Random trip id suffix, or one derived from the idempotency key so a resend reuses the trip id"""
+    if idempotency_key is None:
+        return uuid.uuid4().hex[:8]
+    return hashlib.blake2b(str(idempotency_key).encode(), digest_size=8).hexdigest()
+
+
 class TripPlanningClient:
-    def __init__(self):
+    def __init__(self, client_class=None):
         self.context = zmq.asyncio.Context()
         self.socket = self.context.socket(zmq.DEALER)
         self.client_id = str(uuid.uuid4())  # Generate unique client ID
@@ -26,6 +36,15 @@ class TripPlanningClient:
         self.socket.setsockopt(zmq.SNDTIMEO, 5000)  # 5 second timeout for send
         
         self.running = True
+        # Fair queuing class advertised to the planner ("interactive" or "batch")
+        self.client_class = client_class
+        # Queues of progressive trip plans, keyed by trip_id, for stream_plan consumers
+        self.plan_streams = {}
+        # Futures resolved with the booking outcome, keyed by trip_id
+        self.pending_bookings = {}
+        # Futures resolved when the planner acknowledges a request, keyed by trip_id
+        self.pending_acks = {}
+        self.retry_tasks = set()
         logger.info(f"Client initialized with ID: {self.client_id}")
 
     async def connect(self):
@@ -42,7 +61,9 @@ class TripPlanningClient:
                 performative=MCPPerformatives.INFORM,
                 content=json.dumps({
                     "type": "connection_test",
-                    "status": "ready"
+                    "status": "ready",
+                    "accept_encoding": list(SUPPORTED_ENCODINGS),
+                    **({"client_class": self.client_class} if self.client_class else {})
                 }),
                 sender=self.client_id,
                 receiver="planner"
@@ -62,8 +83,7 @@ class TripPlanningClient:
                     # For ROUTER socket, we receive multipart message
                     frames = await asyncio.wait_for(self.socket.recv_multipart(), timeout=5.0)
                     if len(frames) >= 2:
-                        response_json = frames[1].decode()
-                        response = MCPMessage.from_json(response_json)
+                        response = self._decode_frames(frames)
                         logger.info("Received response from planner agent")
                         return True
                     else:
@@ -81,10 +101,31 @@ class TripPlanningClient:
             logger.error(f"Failed to connect: {str(e)}")
             return False
 
-    async def send_trip_request(self, destination, check_in, check_out, budget="mid-range"):
-        """Send a trip planning request to the planner agent"""
+    def _decode_frames(self, frames):
+        """Rebuild a message from [empty, envelope, compressed payload?] frames"""
+        message = MCPMessage.from_json(frames[1].decode())
+        if message.content_encoding:
+            message.content = decompress_content(frames[2], message.content_encoding)
+            message.content_encoding = None
+        return message
+
+    async def send_trip_request(self, destination, check_in, check_out, budget="mid-range", stream=False,
+                                idempotency_key=None, roles=None):
+        """
+        Send a trip planning request to the planner agent and return its
+        trip_id. roles lists the kinds of providers to plan with (the
+        planner's defaults, travel and hotel, if not given). The request is
+        resent until the planner acknowledges it; pass the same
+        idempotency_key to make a request sent again by the caller count as
+        the same trip (it gets the same trip_id, so its plan can be streamed).
+        """
+        trip_id = f"TRIP-{check_in.replace('-', '')}-{_key_suffix(idempotency_key)}"
+        if stream:
+            # Register before sending so no early update is missed
+            self.plan_streams.setdefault(trip_id, asyncio.Queue())
+        
         trip_request = {
-            "trip_id": f"TRIP-{check_in.replace('-', '')}",
+            "trip_id": trip_id,
             "destination": destination,
             "dates": {
                 "check_in": check_in,
@@ -93,28 +134,253 @@ class TripPlanningClient:
             "preferences": {
                 "budget": budget,
                 "travel_type": "flexible"
-            }
+            },
+            "idempotency_key": idempotency_key or uuid.uuid4().hex
         }
+        if roles:
+            trip_request["roles"] = roles
+
+        logger.info(f"Sending trip request for {destination}")
+        try:
+            await self._send_request(trip_request)
+            logger.info("Trip request sent successfully")
+        except Exception as e:
+            logger.error(f"Failed to send trip request: {str(e)}")
+            self.plan_streams.pop(trip_id, None)
+            raise
+        return trip_id
 
+    async def _send(self, performative, content):
+        """Send a message to the planner"""
+        if self.client_class and performative in (MCPPerformatives.REQUEST, MCPPerformatives.CANCEL):
+            # Requests may reach planner shards that never saw our connection test
+            content = {**content, "client_class": self.client_class}
         msg = MCPMessage(
-            performative=MCPPerformatives.REQUEST,
-            content=json.dumps(trip_request),
+            performative=performative,
+            content=json.dumps(content),
             sender=self.client_id,
             receiver="planner"
         )
+        await self.socket.send_multipart([b"", msg.to_json().encode()])
 
-        logger.info(f"Sending trip request for {destination}")
+    async def _send_request(self, request):
+        """Send a REQUEST and keep resending it in the background until the planner acknowledges it"""
+        trip_id = request["trip_id"]
+        acknowledged = self.pending_acks[trip_id] = asyncio.get_running_loop().create_future()
         try:
-            # For ROUTER socket, we need to send multipart message
-            frames = [
-                b"",  # empty frame
-                msg.to_json().encode()  # message content
-            ]
-            await self.socket.send_multipart(frames)
-            logger.info("Trip request sent successfully")
-        except Exception as e:
-            logger.error(f"Failed to send trip request: {str(e)}")
+            await self._send(MCPPerformatives.REQUEST, request)
+        except Exception:
+            self.pending_acks.pop(trip_id, None)
             raise
+        task = asyncio.create_task(self._retry_until_acknowledged(request, acknowledged))
+        self.retry_tasks.add(task)
+        task.add_done_callback(self.retry_tasks.discard)
+
+    async def _retry_until_acknowledged(self, request, acknowledged):
+        """
+        Resend a request (same idempotency key, so the planner plans it only
+        once) while it is unacknowledged or refused as busy. Retries back off
+        exponentially with full jitter, so clients cut off by the same blip
+        don't all come back at once.
+        """
+        trip_id = request["trip_id"]
+        try:
+            for attempt in range(1, CLIENT_RETRIES["attempts"]):
+                try:
+                    reply = await asyncio.wait_for(asyncio.shield(acknowledged), CLIENT_RETRIES["ack_timeout"])
+                except asyncio.TimeoutError:
+                    reply = None
+                if reply is not None and reply.get("status") != "busy":
+                    return
+                
+                backoff = min(CLIENT_RETRIES["max_delay"], CLIENT_RETRIES["base_delay"] * 2 ** attempt)
+                await asyncio.sleep(random.uniform(0, backoff))
+                if reply is not None:
+                    acknowledged = self.pending_acks[trip_id] = asyncio.get_running_loop().create_future()
+                logger.warning(f"No acknowledgement for {trip_id}, resending request (attempt {attempt + 1})")
+                try:
+                    await self._send(MCPPerformatives.REQUEST, request)
+                except zmq.error.ZMQError as e:
+                    logger.error(f"Failed to resend request for {trip_id}: {str(e)}")
+            
+            try:
+                await asyncio.wait_for(asyncio.shield(acknowledged), CLIENT_RETRIES["ack_timeout"])
+            except asyncio.TimeoutError:
+                logger.error(f"Planner never acknowledged the request for {trip_id}")
+        finally:
+            if self.pending_acks.get(trip_id) is acknowledged:
+                del self.pending_acks[trip_id]
+
+    def _acknowledge(self, content):
+        """Resolve the pending acknowledgement of the trip a CONFIRM or FAILURE is about"""
+        # A retry answered for its original trip names the trip_id it was sent with too
+        for trip_id in (content.get("trip_id"), content.get("requested_trip_id")):
+            acknowledged = self.pending_acks.get(trip_id)
+            if acknowledged is not None and not acknowledged.done():
+                acknowledged.set_result(content)
+
+    async def book_trip(self, trip_id, travel_option_id=None, hotel_option_id=None, quantity=1):
+        """
+        Book a planned trip (the options of its final plan unless others are
+        picked by id) and return the outcome: {"status": "booked" or "failed",
+        "bookings": {role: booking_id}, ...}, or the planner's {"status": "error", ...}
+        if it rejected the request. Requires receive_responses to be running.
+        """
+        outcome = self.pending_bookings.get(trip_id)
+        if outcome is None:
+            outcome = self.pending_bookings[trip_id] = asyncio.get_running_loop().create_future()
+        request = {"type": "book", "trip_id": trip_id, "quantity": quantity}
+        if travel_option_id:
+            request["travel_option_id"] = travel_option_id
+        if hotel_option_id:
+            request["hotel_option_id"] = hotel_option_id
+        
+        logger.info(f"Sending booking request for {trip_id}")
+        try:
+            await self._send(MCPPerformatives.REQUEST, request)
+            return await outcome
+        finally:
+            self.pending_bookings.pop(trip_id, None)
+
+    async def cancel_booking(self, trip_id):
+        """Cancel the booking (or pending holds) of a trip"""
+        logger.info(f"Cancelling booking for {trip_id}")
+        await self._send(MCPPerformatives.CANCEL, {"trip_id": trip_id})
+
+    async def request_profile(self, duration=10.0):
+        """Ask the planner to profile itself; the .folded file path arrives as a RESPONSE"""
+        logger.info(f"Requesting a {duration}s planner profile")
+        await self._send(MCPPerformatives.QUERY, {"type": "profile", "duration": duration})
+
+    async def request_history(self, conversation_id=None):
+        """Ask the planner for a conversation's message timeline (or its recent conversations)"""
+        request = {"type": "history"}
+        if conversation_id:
+            request["conversation_id"] = conversation_id
+        await self._send(MCPPerformatives.QUERY, request)
+
+    async def send_itinerary_request(self, trip_id, legs, origin=None, stream=False, idempotency_key=None, roles=None):
+        """
+        Send a multi-city request; legs is an ordered list of
+        {"destination": ..., "dates": {"check_in": ..., "check_out": ...}},
+        each starting the day the previous one ends. Returns the trip_id.
+        """
+        if stream:
+            self.plan_streams.setdefault(trip_id, asyncio.Queue())
+        request = {"trip_id": trip_id, "legs": legs, "idempotency_key": idempotency_key or uuid.uuid4().hex}
+        if origin:
+            request["origin"] = origin
+        if roles:
+            request["roles"] = roles
+        
+        logger.info(f"Sending itinerary request for {' -> '.join(leg['destination'] for leg in legs)}")
+        try:
+            await self._send_request(request)
+        except Exception:
+            self.plan_streams.pop(trip_id, None)
+            raise
+        return trip_id
+
+    async def send_batch_request(self, trips, batch_id=None, roles=None, live_pricing=False, stream=False,
+                                 idempotency_key=None):
+        """
+        Send many trip queries ({"trip_id", "destination", "dates"}) in one
+        request and return the batch_id. The planner answers with a single
+        plan holding the plans of every trip (pass stream=True and use
+        stream_plan to receive it); each trip is planned, and can be booked,
+        as "<batch_id>.<trip_id>".
+        """
+        batch_id = batch_id or f"BATCH-{_key_suffix(idempotency_key)}"
+        if stream:
+            self.plan_streams.setdefault(batch_id, asyncio.Queue())
+        request = {
+            "type": "batch",
+            "trip_id": batch_id,
+            "trips": trips,
+            "idempotency_key": idempotency_key or uuid.uuid4().hex
+        }
+        if roles:
+            request["roles"] = roles
+        if live_pricing:
+            request["live_pricing"] = True
+        
+        logger.info(f"Sending batch request {batch_id} for {len(trips)} trips")
+        try:
+            await self._send_request(request)
+        except Exception:
+            self.plan_streams.pop(batch_id, None)
+            raise
+        return batch_id
+
+    async def stream_plan(self, trip_id):
+        """
+        Yield progressive trip plans for trip_id until the final plan arrives.
+        Requires receive_responses to be running; pass stream=True to
+        send_trip_request so updates are buffered from the start.
+        """
+        queue = self.plan_streams.setdefault(trip_id, asyncio.Queue())
+        try:
+            while True:
+                plan = await queue.get()
+                yield plan
+                if plan.get("final", True):
+                    break
+        finally:
+            self.plan_streams.pop(trip_id, None)
+
+    def _display_plan(self, plan):
+        """Log a final trip plan (or one leg of an itinerary)"""
+        logger.info("\n=== Trip Plan ===")
+        if plan.get("from"):
+            logger.info(f"From: {plan['from']}")
+        logger.info(f"Destination: {plan['destination']}")
+        logger.info(f"Dates: {plan['dates']['check_in']} to {plan['dates']['check_out']}")
+        
+        # Display travel details (unless the trip was planned without travel)
+        travel = plan.get('travel')
+        if travel is not None:
+            logger.info("\nTravel Details:")
+            if isinstance(travel, dict) and travel.get('status') != "No travel options available":
+                logger.info(f"Type: {travel['type']}")
+                if travel['type'] == 'flight':
+                    logger.info(f"Airline: {travel['airline']}")
+                elif travel['type'] == 'train':
+                    logger.info(f"Train: {travel['name']}")
+                elif travel['type'] == 'bus':
+                    logger.info(f"Bus: {travel['name']}")
+                logger.info(f"Price: ₹{travel['price']}")
+                if travel.get('duration'):
+                    logger.info(f"Duration: {travel['duration']}")
+            else:
+                logger.info("No travel options available")
+        
+        # Display hotel details (unless the trip was planned without a hotel)
+        hotel = plan.get('hotel')
+        if hotel is not None:
+            logger.info("\nHotel Details:")
+            if isinstance(hotel, dict) and hotel.get('status') != "No hotel options available":
+                logger.info(f"Name: {hotel['name']}")
+                logger.info(f"Type: {hotel['type']}")
+                logger.info(f"Price per night: ₹{hotel['price_per_night']}")
+                logger.info(f"Amenities: {', '.join(hotel['amenities'])}")
+                logger.info(f"Rating: {hotel['rating']}/5.0")
+            else:
+                logger.info("No hotel options available")
+        
+        # Display options of any other provider roles the trip was planned with
+        for role in plan.get("roles", []):
+            if role in ("travel", "hotel"):
+                continue
+            option = plan.get(role) or {}
+            logger.info(f"\n{role.replace('_', ' ').title()} Details:")
+            if "status" in option and len(option) == 1:
+                logger.info(option["status"])
+                continue
+            for field, value in option.items():
+                if field != "id":
+                    logger.info(f"{field.replace('_', ' ').capitalize()}: {value}")
+        
+        logger.info("\n=== End of Trip Plan ===\n")
 
     async def receive_responses(self):
         """Receive and process responses from the planner agent"""
@@ -125,56 +391,66 @@ class TripPlanningClient:
                 # For ROUTER socket, we receive multipart message
                 frames = await self.socket.recv_multipart()
                 if len(frames) >= 2:
-                    message_json = frames[1].decode()
-                    message = MCPMessage.from_json(message_json)
+                    message = self._decode_frames(frames)
                     logger.info("Received message from planner")
                     logger.info(f"Message performative: {message.performative}")
                     
                     if message.performative == MCPPerformatives.INFORM:
-                        # This is the final trip plan
                         plan = json.loads(message.content)
-                        logger.info("\n=== Trip Plan ===")
-                        logger.info(f"Destination: {plan['destination']}")
-                        logger.info(f"Dates: {plan['dates']['check_in']} to {plan['dates']['check_out']}")
-                        
-                        # Display travel details
-                        travel = plan['travel']
-                        logger.info("\nTravel Details:")
-                        if isinstance(travel, dict) and travel.get('status') != "No travel options available":
-                            logger.info(f"Type: {travel['type']}")
-                            if travel['type'] == 'flight':
-                                logger.info(f"Airline: {travel['airline']}")
-                            elif travel['type'] == 'train':
-                                logger.info(f"Train: {travel['name']}")
-                            elif travel['type'] == 'bus':
-                                logger.info(f"Bus: {travel['name']}")
-                            logger.info(f"Price: ₹{travel['price']}")
-                            logger.info(f"Duration: {travel['duration']}")
-                        else:
-                            logger.info("No travel options available")
+                        if plan.get("type") == "booking":
+                            # Outcome of a book_trip request
+                            logger.info(f"Booking of {plan['trip_id']} {plan['status']}: {plan['bookings']}")
+                            outcome = self.pending_bookings.get(plan["trip_id"])
+                            if outcome is not None and not outcome.done():
+                                outcome.set_result(plan)
+                            continue
                         
-                        # Display hotel details
-                        hotel = plan['hotel']
-                        logger.info("\nHotel Details:")
-                        if isinstance(hotel, dict) and hotel.get('status') != "No hotel options available":
-                            logger.info(f"Name: {hotel['name']}")
-                            logger.info(f"Type: {hotel['type']}")
-                            logger.info(f"Price per night: ₹{hotel['price_per_night']}")
-                            logger.info(f"Amenities: {', '.join(hotel['amenities'])}")
-                            logger.info(f"Rating: {hotel['rating']}/5.0")
-                        else:
-                            logger.info("No hotel options available")
+                        stream = self.plan_streams.get(plan.get("trip_id"))
+                        if stream is not None:
+                            stream.put_nowait(plan)
+                        if not plan.get("final", True):
+                            # Progressive "best so far" plan; the final one follows
+                            logger.info(f"Received partial plan for {plan.get('trip_id')}")
+                            continue
+                        if plan.get("type") == "batch":
+                            logger.info(f"Received {len(plan['plans'])} trip plans of batch {plan['trip_id']}")
+                            continue
                         
-                        logger.info("\n=== End of Trip Plan ===\n")
+                        # This is the final trip plan (or itinerary of several legs)
+                        for leg in plan.get("legs", [plan]):
+                            self._display_plan(leg)
                         
                     elif message.performative == MCPPerformatives.CONFIRM:
                         # This is a confirmation message
                         content = json.loads(message.content)
                         logger.info(f"Confirmation: {content['message']}")
+                        self._acknowledge(content)
+                        
+                    elif message.performative == MCPPerformatives.RESPONSE:
+                        content = json.loads(message.content)
+                        if content.get("type") == "profile":
+                            logger.info(f"Profile {content['status']}: {content['samples']} samples in {content['path']}")
+                        elif content.get("type") == "history" and "messages" in content:
+                            logger.info(f"History of {content['conversation_id']} ({content['status']}):")
+                            for entry in content["messages"]:
+                                logger.info(f"  {entry['timestamp']} {entry['direction']:>3} {entry['performative']} "
+                                            f"{entry['sender']} -> {entry['receiver']}")
+                        elif content.get("type") == "history":
+                            logger.info(f"Recent conversations: {content.get('recent')}")
                         
                     elif message.performative == MCPPerformatives.FAILURE:
                         # This is an error message
                         logger.error(f"Error: {message.content}")
+                        try:
+                            content = json.loads(message.content)
+                        except ValueError:
+                            continue
+                        if isinstance(content, dict):
+                            self._acknowledge(content)
+                            # A rejected book request (e.g. an invalid quantity) ends the booking too
+                            outcome = self.pending_bookings.get(content.get("trip_id"))
+                            if outcome is not None and not outcome.done():
+                                outcome.set_result(content)
                 else:
                     logger.error("Invalid message format received")
                     
@@ -192,6 +468,8 @@ class TripPlanningClient:
         """Close the client connection"""
         logger.info("Closing client connection...")
         self.running = False
+        for task in self.retry_tasks:
+            task.cancel()
         self.socket.close()
         self.context.term()
         logger.info("Client connection closed")
@@ -211,16 +489,32 @@ async def main():
         receiver_task = asyncio.create_task(client.receive_responses())
         
         # Send trip request
-        await client.send_trip_request(
+        trip_id = await client.send_trip_request(
             destination="Goa",
             check_in="2024-04-01",
             check_out="2024-04-07",
-            budget="mid-range"
+            budget="mid-range",
+            stream=True
         )
         
-        # Wait for responses
+        # Wait for progressive plans until the final one arrives
         logger.info("Waiting for responses...")
-        await asyncio.sleep(30)  # Wait longer to ensure we get all responses
+        
+        async def follow_plan():
+            async for plan in client.stream_plan(trip_id):
+                logger.info(f"Plan update for {trip_id}: {plan['status']}")
+        
+        try:
+            await asyncio.wait_for(follow_plan(), timeout=30)
+        except asyncio.TimeoutError:
+            logger.error("Timed out waiting for the final trip plan")
+        
+        # Book the options of the final plan
+        try:
+            result = await asyncio.wait_for(client.book_trip(trip_id), timeout=30)
+            logger.info(f"Booking {result['status']}: {result.get('message', result['bookings'])}")
+        except asyncio.TimeoutError:
+            logger.error("Timed out waiting for the booking")
         
     except KeyboardInterrupt:
         logger.info("Received shutdown signal")
@@ -1,3 +1,5 @@
+import os
+
 # ZMQ Communication endpoints
 AGENT_ENDPOINTS = {
     "planner": "tcp://127.0.0.1:5555",
@@ -10,4 +12,166 @@ MESSAGE_TYPES = {
     "REQUEST": "request",
     "RESPONSE": "response",
     "INFORM": "inform"
-}
\ No newline at end of file
+}
+
+# Conversation id generation: "monotonic" (agent prefix + counter) or "uuid"
+MESSAGE_ID_MODE = "monotonic"
+
+# Content compression for large payloads (negotiated per peer at handshake)
+COMPRESSION = {
+    "enabled": True,
+    "min_size": 16 * 1024,  # Only compress content at least this many characters long
+    "level": 6
+}
+
+# Streaming proposals: providers send options in chunks, the planner pushes partial plans
+STREAMING = {
+    "enabled": True,
+    "chunk_size": 20,  # Options per PROPOSE chunk
+    "progressive_updates": True  # Send "best plan so far" INFORMs before the final plan
+}
+
+# Planner journal of in-flight trips, replayed on startup for crash recovery
+JOURNAL = {
+    "enabled": True,
+    "path": "planner.journal",
+    "flush_interval": 0.002,  # Seconds to wait for more records to join a group commit
+    "max_batch": 512,  # Flush immediately once this many records are queued
+    "compact_every": 10000,  # Snapshot and truncate after this many records
+    "fsync": True
+}
+
+# Provider catalogs: files of "<destination>\t<JSON entry>" lines
+CATALOGS = {
+    "travel": os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "travel.catalog"),
+    "hotel": os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "hotel.catalog"),
+    "cache_size": 256,  # Destinations kept parsed in memory per provider
+    "reload_interval": 5.0  # Seconds between checks for catalog changes (0 disables hot reload)
+}
+
+# Sharded planning: a front router at AGENT_ENDPOINTS["planner"] hashes each trip
+# (or client) onto one of these planner shards, each with its own providers
+PLANNER_SHARDS = {
+    "enabled": False,
+    "endpoints": ["tcp://127.0.0.1:5600", "tcp://127.0.0.1:5601"],
+    "shard_key": "trip_id",  # "trip_id" or "client"
+    "virtual_nodes": 64,  # Points per shard on the consistent hash ring
+    "sticky_keys": 100000  # Recently routed keys pinned to their shard across rebalancing
+}
+
+# Catalog replication: providers publish catalog snapshots/deltas, the planner keeps
+# a replica and answers fresh destinations locally instead of sending CFPs
+CATALOG_REPLICATION = {
+    "enabled": True,
+    "endpoints": {
+        "travel": "tcp://127.0.0.1:5570",
+        "hotel": "tcp://127.0.0.1:5571"
+    },
+    "snapshot_interval": 30.0,  # Seconds between full snapshots
+    "heartbeat_interval": 1.0,  # Seconds between version heartbeats (and change checks)
+    "max_staleness": 5.0  # Replica data older than this falls back to a live CFP
+}
+
+# Booking inventory kept by the providers
+INVENTORY = {
+    "hold_ttl": 120.0,  # Seconds an accepted proposal holds inventory before it must be confirmed
+    "default_rooms": 10,  # Rooms per night for hotels without a "rooms" catalog field
+    "default_seats": 100  # Seats per departure for travel options without a "seats" catalog field
+}
+
+# Traffic capture: every frame an agent sends or receives, for replay.py
+CAPTURE = {
+    "enabled": False,
+    "directory": "captures",  # One <agent_id>.cap file per agent
+    "buffer_size": 1 << 20,  # Bytes buffered in memory between background writes
+    "flush_interval": 1.0,  # Seconds before a partly filled buffer is written anyway
+    "max_bytes": 256 << 20  # Stop capturing once a file reaches this size
+}
+
+# On-demand sampling profiles, started with a QUERY of type "profile"
+PROFILING = {
+    "directory": "profiles",  # Collapsed-stack (.folded) output for flamegraphs
+    "default_duration": 10.0,  # Seconds, when the request doesn't say
+    "max_duration": 120.0,
+    "interval": 0.005,  # Seconds between samples
+    "min_interval": 0.001
+}
+
+# Per-conversation message history kept by every agent (QUERY type "history")
+HISTORY = {
+    "enabled": True,
+    "max_messages": 64,  # Most recent messages kept per conversation
+    "max_bytes": 16 << 20,  # Memory budget; least recently active conversations are evicted
+    "max_content": 512  # Characters of content kept per message
+}
+
+# Multi-city trips: a REQUEST with "legs" is planned leg by leg, all legs at once
+ITINERARIES = {
+    "max_legs": 10,
+    "cache_ttl": 60.0,  # Seconds a completed leg's options are reused for the same city and dates
+    "cache_size": 1024  # Cached (role, city, dates) proposals
+}
+
+# Fair queuing of client requests in the planner: each client identity gets its own
+# queue, served in proportion to its class weight with a cap on trips in flight
+FAIR_QUEUING = {
+    "enabled": True,
+    "classes": {
+        "interactive": {"weight": 4, "max_in_flight": 8, "max_queued": 100},
+        "batch": {"weight": 1, "max_in_flight": 32, "max_queued": 10000}
+    },
+    "default_class": "interactive",
+    "clients": {},  # client identity -> class, overriding the class a client advertises
+    "in_flight_timeout": 120.0  # Seconds before a trip that never completed gives its slot back
+}
+
+# Idempotent trip requests: the planner remembers (client, idempotency key) pairs
+# and answers retries with the trip's current state instead of planning it again
+IDEMPOTENCY = {
+    "window_keys": 1 << 20,  # Keys remembered (about 16 bytes each)
+    "window_ttl": 3600.0,  # Seconds a key is remembered for at most (at least half of it)
+    "trip_ids": 100000  # Most recent keys whose trip_id is kept, to answer retries sent with a new trip_id
+}
+
+# Client retries of requests the planner hasn't acknowledged, with full-jitter exponential backoff
+CLIENT_RETRIES = {
+    "attempts": 5,  # Sends of a request in total
+    "ack_timeout": 2.0,  # Seconds to wait for an acknowledgement before resending
+    "base_delay": 0.5,  # Seconds; the n-th retry waits a random time up to base_delay * 2**n
+    "max_delay": 10.0
+}
+
+# Provider roles: providers announce their role and capabilities when they connect,
+# so a new kind of provider needs no planner changes
+PROVIDERS = {
+    "default_roles": ["travel", "hotel"]  # Roles a trip needs unless its request lists "roles"
+}
+
+# Batched trip requests (REQUEST type "batch"): many trips planned with one CFP per provider
+BATCHING = {
+    "max_trips": 10000,  # Trips in one batch request
+    "cfp_size": 500  # Trips per batched CFP (each answered by one batched PROPOSE)
+}
+
+# Shared memory transport for agents on the same host as the planner: large content is
+# written once into the sender's arena and only a small handle goes over ZMQ. Used only
+# when the planner could attach the arena at handshake; falls back to the socket when
+# the arena is full. Needs arena_size of free /dev/shm per agent.
+SHARED_MEMORY = {
+    "enabled": False,
+    "arena_size": 32 << 20,  # Bytes per agent arena (a ring of blocks)
+    "min_size": 64 * 1024,  # Only content at least this many characters long
+    "lease": 30.0  # Seconds before a block the planner never released is reused anyway
+}
+
+# Event loop watchdog in every agent: handlers run inline on the event loop, so blocking
+# code stalls the whole agent. Measures loop lag, logs the stack of the loop thread when
+# it stalls, and logs handlers that run over budget with their performative and conversation_id.
+WATCHDOG = {
+    "enabled": True,
+    "interval": 0.1,  # Seconds between heartbeats of the loop
+    "lag_threshold": 0.25,  # Seconds without a heartbeat before the loop's stack is captured
+    "handler_budget": 0.5,  # Seconds a message handler may take before it is reported
+    "report_interval": 60.0,  # Seconds between lag percentile summaries (0 to disable)
+    "max_stack_depth": 30  # Frames kept of a captured stack
+}
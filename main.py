@@ -1,9 +1,12 @@
+import argparse
 import asyncio
 import logging
+import multiprocessing
 from agents.planner_agent import PlannerAgent
+from agents.planner_router import PlannerRouter
 from agents.travel_agent import TravelAgent
 from agents.hotel_agent import HotelAgent
-from config import AGENT_ENDPOINTS
+from config import AGENT_ENDPOINTS, JOURNAL, PLANNER_SHARDS
 
 # Configure logging
 logging.basicConfig(
@@ -12,32 +15,37 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-async def main():
+async def run_planner(endpoint, journal_path=None, publish_catalogs=True):
+    """Run a planner with its travel and hotel agents until interrupted"""
+    planner = None
+    travel = None
+    hotel = None
     try:
-        # Initialize planner first
+        # Initialize planner first; providers register their roles when they connect
         planner = PlannerAgent(
-            "planner", 
-            AGENT_ENDPOINTS["planner"],
-            travel_agent_id="travel",
-            hotel_agent_id="hotel"
+            "planner",
+            endpoint,
+            journal_path=journal_path
         )
-        
+
         # Initialize travel and hotel agents to connect to planner
-        travel = TravelAgent("travel", AGENT_ENDPOINTS["planner"])
-        hotel = HotelAgent("hotel", AGENT_ENDPOINTS["planner"])
-        
+        # Catalogs are shared by all shards, so only one set of providers publishes them
+        publish_catalog = None if publish_catalogs else False
+        travel = TravelAgent("travel", endpoint, publish_catalog=publish_catalog)
+        hotel = HotelAgent("hotel", endpoint, publish_catalog=publish_catalog)
+
         # Start planner first and wait for it to be ready
         logger.info("Starting planner agent...")
         await planner.start()
         logger.info("Planner agent started")
         await asyncio.sleep(1)  # Give planner time to bind
-        
+
         # Start travel agent
         logger.info("Starting travel agent...")
         await travel.start()
         logger.info("Travel agent started")
         await asyncio.sleep(1)  # Give travel agent time to connect
-        
+
         # Start hotel agent
         logger.info("Starting hotel agent...")
         await hotel.start()
@@ -45,22 +53,83 @@ async def main():
         await asyncio.sleep(1)  # Give hotel agent time to connect
 
         logger.info("All agents started successfully")
-        
+
         # Keep the main process running
         while True:
             await asyncio.sleep(1)
-            
-    except KeyboardInterrupt:
+
+    except (KeyboardInterrupt, asyncio.CancelledError):
         logger.info("Received shutdown signal")
     except Exception as e:
         logger.error(f"Error in main: {str(e)}")
     finally:
         # Stop agents in reverse order
         logger.info("Stopping agents...")
-        await hotel.stop()
-        await travel.stop()
-        await planner.stop()
+        for agent in (hotel, travel, planner):
+            if agent:
+                await agent.stop()
         logger.info("All agents stopped")
 
+async def run_router():
+    """Run the front router that spreads trips over the planner shards"""
+    router = PlannerRouter(
+        AGENT_ENDPOINTS["planner"],
+        shard_key=PLANNER_SHARDS["shard_key"],
+        virtual_nodes=PLANNER_SHARDS["virtual_nodes"],
+        sticky_keys=PLANNER_SHARDS["sticky_keys"]
+    )
+    try:
+        await router.start()
+        for index, endpoint in enumerate(PLANNER_SHARDS["endpoints"]):
+            router.add_shard(f"shard-{index}", endpoint)
+        logger.info(f"Planner router started with {len(PLANNER_SHARDS['endpoints'])} shards")
+        while True:
+            await asyncio.sleep(1)
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        logger.info("Received shutdown signal")
+    finally:
+        await router.stop()
+
+def run_shard(index):
+    """Process entry point for one planner shard"""
+    try:
+        asyncio.run(run_planner(
+            PLANNER_SHARDS["endpoints"][index],
+            journal_path=f"{JOURNAL['path']}.{index}",
+            publish_catalogs=index == 0
+        ))
+    except KeyboardInterrupt:
+        pass
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the trip planning agents")
+    parser.add_argument("--role", choices=["all", "router", "shard"], default="all",
+                        help="Run everything, only the front router, or a single planner shard")
+    parser.add_argument("--shard-index", type=int, default=0, help="Shard to run with --role shard")
+    args = parser.parse_args()
+
+    if not PLANNER_SHARDS["enabled"]:
+        asyncio.run(run_planner(AGENT_ENDPOINTS["planner"]))
+    elif args.role == "shard":
+        run_shard(args.shard_index)
+    elif args.role == "router":
+        asyncio.run(run_router())
+    else:
+        # One process per shard so planning scales past a single event loop
+        shards = [
+            multiprocessing.Process(target=run_shard, args=(index,), daemon=True)
+            for index in range(len(PLANNER_SHARDS["endpoints"]))
+        ]
+        for shard in shards:
+            shard.start()
+        try:
+            asyncio.run(run_router())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for shard in shards:
+                shard.terminate()
+                shard.join()
+
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    main()
@@ -0,0 +1,203 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import tempfile
+import time
+import zmq
+import zmq.asyncio
+from agents.capture import INBOUND, OUTBOUND, read_capture
+from agents.planner_agent import PlannerAgent
+from agents.travel_agent import TravelAgent
+from agents.hotel_agent import HotelAgent
+
+logging.basicConfig(
+    level=logging.WARNING,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def _body(frames):
+    """Body frames of a captured message (everything after the empty delimiter)"""
+    delimiter = frames.index(b"")
+    return frames[delimiter + 1:]
+
+
+def _conversation_id(frames):
+    try:
+        return json.loads(_body(frames)[0])["conversation_id"]
+    except (ValueError, KeyError, IndexError):
+        return None
+
+
+def measure(events):
+    """
+    Latency and throughput of (seconds, direction, conversation_id) events.
+    The latency of an inbound message is the time until the agent's first
+    outbound message in the same conversation.
+    """
+    pending = {}
+    latencies = []
+    for at, direction, conversation_id in events:
+        if direction == INBOUND:
+            pending.setdefault(conversation_id, at)
+        elif conversation_id in pending:
+            latencies.append(at - pending.pop(conversation_id))
+
+    inbound = sum(1 for _, direction, _ in events if direction == INBOUND)
+    duration = (events[-1][0] - events[0][0]) if events else 0.0
+    latencies.sort()
+    return {
+        "inbound": inbound,
+        "outbound": len(events) - inbound,
+        "duration": duration,
+        "throughput": inbound / duration if duration else 0.0,
+        "latency_p50": statistics.median(latencies) if latencies else None,
+        "latency_p95": latencies[int(0.95 * (len(latencies) - 1))] if latencies else None,
+        "latency_max": latencies[-1] if latencies else None,
+        "answered": len(latencies)
+    }
+
+
+def _start_target(agent, endpoint, journal_dir):
+    # No catalog replication: updates from a live system on this host would leak into the replay
+    if agent == "planner":
+        return PlannerAgent("planner", endpoint, journal_path=os.path.join(journal_dir, "planner.journal"),
+                            replicate_catalogs=False)
+    if agent == "travel":
+        return TravelAgent("travel", endpoint, publish_catalog=False)
+    return HotelAgent("hotel", endpoint, publish_catalog=False)
+
+
+async def replay(capture_path, agent, endpoint, fast=False, idle_timeout=2.0):
+    """
+    Feed the inbound traffic of a capture into a fresh agent and return
+    (original, replayed) measurements. The replayer plays every peer of the
+    agent: one DEALER per original sender for a planner, the planner's
+    ROUTER for a provider.
+    """
+    records = list(read_capture(capture_path))
+    original = measure([(r.offset_ns / 1e9, r.direction, _conversation_id(r.frames)) for r in records])
+    inbound = [r for r in records if r.direction == INBOUND]
+
+    context = zmq.asyncio.Context()
+    events = []
+    peers = {}
+    tasks = []
+    journal_dir = tempfile.mkdtemp(prefix="replay-")
+
+    async def collect(socket):
+        while True:
+            frames = await socket.recv_multipart()
+            events.append((time.perf_counter(), OUTBOUND, _conversation_id(frames)))
+
+    if agent == "planner":
+        target = _start_target(agent, endpoint, journal_dir)
+        await target.start()
+
+        def socket_for(frames):
+            # The last routing frame is the original sender's identity
+            identity = frames[frames.index(b"") - 1]
+            socket = peers.get(identity)
+            if socket is None:
+                socket = peers[identity] = context.socket(zmq.DEALER)
+                socket.setsockopt(zmq.IDENTITY, identity)
+                socket.connect(endpoint)
+                tasks.append(asyncio.create_task(collect(socket)))
+            return socket, [b"", *_body(frames)]
+    else:
+        router = context.socket(zmq.ROUTER)
+        router.bind(endpoint)
+        target = _start_target(agent, endpoint, journal_dir)
+        await target.start()
+        # The provider's own connection request is not part of the replay
+        await router.recv_multipart()
+        tasks.append(asyncio.create_task(collect(router)))
+
+        def socket_for(frames):
+            return router, [agent.encode(), b"", *_body(frames)]
+
+    await asyncio.sleep(0.5)  # Let connections settle before the clock starts
+
+    try:
+        start = time.perf_counter()
+        first_offset = inbound[0].offset_ns if inbound else 0
+        for record in inbound:
+            if not fast:
+                delay = start + (record.offset_ns - first_offset) / 1e9 - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            socket, frames = socket_for(record.frames)
+            events.append((time.perf_counter(), INBOUND, _conversation_id(record.frames)))
+            await socket.send_multipart(frames)
+
+        # Wait until the agent has been quiet for idle_timeout
+        seen = -1
+        while seen != len(events):
+            seen = len(events)
+            await asyncio.sleep(idle_timeout)
+        # The idle wait is not part of the measured run
+        replayed = measure(events)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await target.stop()
+        for socket in peers.values():
+            socket.close(linger=0)
+        if agent != "planner":
+            router.close(linger=0)
+        context.term()
+    return original, replayed
+
+
+def _format(value, unit=""):
+    if value is None:
+        return "-"
+    if unit == "ms":
+        return f"{value * 1000:.2f} ms"
+    if unit == "/s":
+        return f"{value:.1f}/s"
+    if unit == "s":
+        return f"{value:.3f} s"
+    return str(value)
+
+
+def report(original, replayed):
+    """Print original vs replayed measurements side by side"""
+    rows = [
+        ("inbound messages", "inbound", ""),
+        ("outbound messages", "outbound", ""),
+        ("answered", "answered", ""),
+        ("duration", "duration", "s"),
+        ("throughput", "throughput", "/s"),
+        ("latency p50", "latency_p50", "ms"),
+        ("latency p95", "latency_p95", "ms"),
+        ("latency max", "latency_max", "ms")
+    ]
+    print(f"{'':20}{'original':>16}{'replayed':>16}{'delta':>12}")
+    for label, key, unit in rows:
+        before, after = original[key], replayed[key]
+        delta = f"{(after - before) / before * 100:+.1f}%" if before and after is not None else "-"
+        print(f"{label:20}{_format(before, unit):>16}{_format(after, unit):>16}{delta:>12}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured agent traffic and compare latency/throughput")
+    parser.add_argument("capture", help="Capture file recorded by an agent (CAPTURE in config.py)")
+    parser.add_argument("--agent", choices=["planner", "travel", "hotel"], default="planner",
+                        help="Kind of agent the capture was recorded from")
+    parser.add_argument("--endpoint", default="tcp://127.0.0.1:5590", help="Private endpoint for the replay")
+    parser.add_argument("--fast", action="store_true", help="Send as fast as possible instead of at original speed")
+    parser.add_argument("--idle-timeout", type=float, default=2.0,
+                        help="Seconds without traffic after which the replay is considered done")
+    args = parser.parse_args()
+
+    original, replayed = asyncio.run(replay(args.capture, args.agent, args.endpoint, args.fast, args.idle_timeout))
+    report(original, replayed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+import asyncio
+
+import config
+from agents.hotel_agent import HotelAgent
+from agents.mcp_message import MCPPerformatives
+from agents.planner_agent import PlannerAgent
+from agents.travel_agent import TravelAgent
+from client import TripPlanningClient
+
+ENDPOINT = "tcp://127.0.0.1:5655"
+
+
+async def _final_plan(client, trip_id):
+    async for plan in client.stream_plan(trip_id):
+        if plan.get("final", True):
+            return plan
+
+
+def test_resent_request_gets_the_original_plan(tmp_path, monkeypatch):
+    monkeypatch.setitem(config.AGENT_ENDPOINTS, "planner", ENDPOINT)
+
+    async def scenario():
+        planner = PlannerAgent("planner", ENDPOINT, journal_path=str(tmp_path / "planner.journal"),
+                               replicate_catalogs=False)
+        travel = TravelAgent("travel", ENDPOINT, publish_catalog=False)
+        hotel = HotelAgent("hotel", ENDPOINT, publish_catalog=False)
+        client = TripPlanningClient()
+        receiver = None
+        try:
+            await planner.start()
+            await travel.start()
+            await hotel.start()
+            await asyncio.sleep(0.5)
+            await client.connect()
+            receiver = asyncio.create_task(client.receive_responses())
+
+            trip_id = await client.send_trip_request("Goa", "2024-04-01", "2024-04-05", stream=True,
+                                                     idempotency_key="same-key")
+            plan = await asyncio.wait_for(_final_plan(client, trip_id), 10)
+
+            # Sent again by the caller: same trip, planned once, and its plan arrives again
+            resent_id = await client.send_trip_request("Goa", "2024-04-01", "2024-04-05", stream=True,
+                                                       idempotency_key="same-key")
+            assert resent_id == trip_id
+            resent_plan = await asyncio.wait_for(_final_plan(client, resent_id), 10)
+            assert resent_plan == plan
+            assert [t for t in planner.trip_requests if t.startswith("TRIP-")] == [trip_id]
+
+            # A resend under another trip_id is answered for the original trip
+            acknowledged = asyncio.get_running_loop().create_future()
+            client.pending_acks["OTHER"] = acknowledged
+            await client._send(MCPPerformatives.REQUEST, {
+                "trip_id": "OTHER",
+                "destination": "Goa",
+                "dates": {"check_in": "2024-04-01", "check_out": "2024-04-05"},
+                "idempotency_key": "same-key"
+            })
+            reply = await asyncio.wait_for(acknowledged, 10)
+            assert reply["trip_id"] == trip_id
+            assert reply["duplicate"] is True
+            assert reply["requested_trip_id"] == "OTHER"
+        finally:
+            if receiver is not None:
+                receiver.cancel()
+            await client.close()
+            await hotel.stop()
+            await travel.stop()
+            await planner.stop()
+
+    asyncio.run(scenario())